@@ -1,20 +1,52 @@
 import streamlit as st
-import pandas as pd
 import time
+import functools
 import json
 import os
-import plotly.graph_objects as go # Importar Plotly
-from streamlit_autorefresh import st_autorefresh
+import numpy as np
+from datetime import datetime, timezone
+# plotly, pydeck y streamlit_autorefresh se importan en la función que los usa:
+# el primer render de un worker nuevo no paga lo que todavía no dibuja.
 # Asegúrate de que estos módulos existen en tu carpeta 'utils'
-from utils.demo import get_demo_data
-from utils.ttn import get_lorawan_data
+from utils.demo import TRAIL_POINTS, get_demo_alerts, get_demo_data, get_demo_fleet, get_demo_geofences, get_demo_history
+from utils.geo import viewport
+from utils.ingest import get_service
+from utils.metrics import REGISTRY
+from utils.normalize import get_normalizer
+from utils.recorder import SessionRecorder, recorder_options, recordings_dir
+from utils.replay import SPEEDS, Replay
 
 # ==== CONFIGURACIÓN INICIAL ====
+_SCRIPT_T0 = time.perf_counter()
+
+# Métricas de render (las vuelca el tick del servicio a METRICS_DIR y las
+# expone el /metrics del receptor; ver utils/metrics.py)
+if "METRICS_PROCESS" not in os.environ:
+    REGISTRY.process = "dashboard"
+RENDER_SECONDS = REGISTRY.histogram("dashboard_render_seconds", "Duración del script o de un panel",
+                                    ("panel",))
+E2E_DELAY_SECONDS = REGISTRY.histogram(
+    "dashboard_e2e_delay_seconds", "Desde la medición (device_time) hasta que el dashboard la ve",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+def timed(panel):
+    """Observa la duración de cada ejecución del panel en RENDER_SECONDS."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with RENDER_SECONDS.time(panel=panel):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+# 1. CARGAR CSS NASA (se lee una vez por proceso; cada rerun solo lo reenvía)
+@st.cache_resource
+def load_css():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles.css"), encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
 
-# 1. CARGAR CSS NASA
 try:
-    with open("styles.css") as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+    st.markdown(load_css(), unsafe_allow_html=True)
 except FileNotFoundError:
     # Esto es un error de desarrollo, pero se mantiene la alerta.
     st.error("Error: styles.css no encontrado. Asegúrese de que el archivo CSS esté en el mismo directorio.")
@@ -26,23 +58,81 @@ st.set_page_config(page_title="PULSERA GUARDIÁN - TELEMETRÍA DE MISIÓN", layo
 def get_key(d,k,default=None):
     return d.get(k, default) if isinstance(d, dict) else default
 
+# Un único servicio de ingesta por proceso (MQTT + vista en memoria), compartido
+# por todas las sesiones y reruns.
+@st.cache_resource
+def get_ingestion():
+    return get_service().start()
+
+# Grabaciones en Parquet (utils/recorder.py) para el modo de reproducción, con
+# la misma configuración (RECORDER_BUCKETS) con la que las escribe el servicio
+@st.cache_resource
+def get_recordings():
+    return SessionRecorder(recordings_dir(), **recorder_options())
+
+def normalize_lorawan(lr):
+    # Misma normalización (utils/normalize.py) que usa la ingesta MQTT/webhook
+    data = None
+    if isinstance(lr, dict) and "payload" in lr:
+        payload = lr["payload"]
+        if isinstance(payload, dict):
+            data = get_normalizer(lr.get("model_id")).normalize(payload)
+            if not data:
+                data = {"raw_payload": payload}
+            data["timestamp"] = lr.get("timestamp", time.time())
+    else:
+        data = lr
+    return data
+
 # --- BARRA LATERAL (CONFIGURACIÓN DE CONSOLA) ---
 st.sidebar.title("⚙️ CONFIGURACIÓN DE CONSOLA")
 
 # >>>>>>> ESTOS CONTROLES ESTÁN VISIBLES Y EN EL TOP <<<<<<<
-modo = st.sidebar.radio("MODO DE OPERACIÓN:", ("Demo (Simulación)", "LoRaWAN (Misión Real)"))
+modo = st.sidebar.radio("MODO DE OPERACIÓN:", ("Demo (Simulación)", "LoRaWAN (Misión Real)", "Replay (Grabación)"))
 refresh_rate = st.sidebar.slider("FRECUENCIA DE ACTUALIZACIÓN (s)", 1, 5, 2)
 # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
+# Reproducción: ventana grabada y velocidad (utils/replay.py). La reproducción
+# es de la sesión; el botón la (re)carga y la velocidad cambia en marcha.
+replay_error = None
+if modo == "Replay (Grabación)":
+    st.sidebar.markdown("---")
+    st.sidebar.subheader("⏪ REPRODUCCIÓN")
+    try:
+        replay_days = get_recordings().days()
+    except RuntimeError as e:  # sin pyarrow
+        replay_days, replay_error = [], f"ERROR: {e}"
+    if replay_days:
+        replay_day = st.sidebar.selectbox("DÍA GRABADO (UTC)", replay_days[::-1])
+        replay_hours = st.sidebar.slider("HORAS (UTC)", 0, 24, (0, 24))
+        replay_devices = st.sidebar.text_input("DISPOSITIVOS (vacío = toda la flota)",
+                                               placeholder="pulsera-0001, pulsera-0002")
+        replay_speed = st.sidebar.select_slider("VELOCIDAD", SPEEDS, value=10, format_func=lambda v: f"{v}×")
+        if st.sidebar.button("▶ REPRODUCIR"):
+            old = st.session_state.pop("replay", None)
+            if old is not None:
+                old.stop()
+            day0 = datetime.strptime(replay_day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+            ids = [d.strip() for d in replay_devices.split(",") if d.strip()]
+            with st.spinner("Cargando grabación..."):
+                st.session_state["replay"] = Replay(
+                    get_recordings(), day0 + replay_hours[0] * 3600, day0 + replay_hours[1] * 3600,
+                    ids or None, speed=replay_speed).start()
+        replay = st.session_state.get("replay")
+        if replay is not None:
+            replay.speed = replay_speed
+            st.sidebar.caption(f"{len(replay):,} registros cargados en {replay.load_seconds:.2f} s")
+        else:
+            replay_error = "Elige una ventana grabada y pulsa ▶ REPRODUCIR."
+    elif replay_error is None:
+        replay_error = "⚠ No hay grabaciones todavía: se graba lo que ingesta el servicio (utils/recorder.py)."
+
 # Control de Zoom/Filtro (Interactividad simulada)
 st.sidebar.markdown("---")
 st.sidebar.subheader("🎛 CONTROL DE PANTALLAS")
 zoom_level = st.sidebar.slider("Nivel de Zoom GPS", 14, 18, 16)
 st.sidebar.caption("Modifica la vista del mapa de rastreo.")
 
-# autorefresh
-st_autorefresh(interval=refresh_rate * 1000, key="autorefresh")
-
 # --- TÍTULO DE CONSOLA ---
 st.markdown(
     """
@@ -55,161 +145,285 @@ st.markdown(
 )
 st.markdown("---") 
 
+def get_source():
+    """Servicio de la fuente no demo: el del proceso (LoRaWAN) o el de la reproducción."""
+    if modo == "Replay (Grabación)":
+        return st.session_state["replay"].service
+    return get_ingestion()
+
+def clock():
+    """Hora actual de la fuente: en una reproducción, la del reloj virtual."""
+    if modo == "Replay (Grabación)":
+        return st.session_state["replay"].position
+    return time.time()
+
 # --- CARGA Y NORMALIZACIÓN DE DATOS (Lógica NO MODIFICADA) ---
-data = None
-if modo == "Demo (Simulación)":
-    data = get_demo_data()
-else:
-    lr = get_lorawan_data()
-    if lr is None:
-        st.warning("⚠ No se han recibido paquetes LoRaWAN todavía. Esperando conexión a la red de misión...")
-        st.stop()
-    
-    # Lógica de normalización de datos (completa y restaurada)
-    if isinstance(lr, dict) and "payload" in lr:
-        payload = lr["payload"]
-        if isinstance(payload, dict):
-            data = {}
-            for k in ("temperature","temp","t"):
-                if k in payload:
-                    data["temperature"] = payload[k]
-                    break
-            for k in ("heart_rate","hr","pulse"):
-                if k in payload:
-                    data["heart_rate"] = payload[k]
-                    break
-            for k in ("smoke","co","gas","air_quality"):
-                if k in payload:
-                    data["smoke"] = payload[k]
-                    break
-            if "lat" in payload and "lon" in payload:
-                data["lat"] = float(payload["lat"])
-                data["lon"] = float(payload["lon"])
-            else:
-                gps = payload.get("gps") or payload.get("location")
-                if isinstance(gps, dict):
-                    data["lat"] = float(gps.get("lat", 0))
-                    data["lon"] = float(gps.get("lon", 0))
-            for k in ("movement","motion","accel_mag"):
-                if k in payload:
-                    data["movement"] = payload[k]
-                    break
-            if "battery" in payload:
-                data["battery"] = payload["battery"]
-            data["timestamp"] = lr.get("timestamp", time.time())
-            if not data:
-                data = {"raw_payload": payload, "timestamp": lr.get("timestamp", time.time())}
-    else:
-        data = lr
+def load_data():
+    """
+    Devuelve (versión, data) de la fuente activa. La versión solo cambia
+    cuando hay un dato nuevo; los paneles la usan para no reconstruirse.
+    """
+    if modo == "Demo (Simulación)":
+        # un dato demo nuevo por periodo de refresco, compartido por los paneles
+        now = time.time()
+        if now - st.session_state.get("demo_ts", 0) >= refresh_rate * 0.9:
+            st.session_state["demo_data"] = get_demo_data()
+            st.session_state["demo_ts"] = now
+            st.session_state["demo_version"] = st.session_state.get("demo_version", 0) + 1
+        return ("demo", st.session_state["demo_version"]), st.session_state["demo_data"]
+
+    svc = get_source()
+    snap = svc.snapshot()
+    version = ("lora", snap.version) if modo == "LoRaWAN (Misión Real)" else ("replay", id(svc), snap.version)
+    # Solo se normaliza cuando llega un paquete nuevo (versión distinta)
+    if st.session_state.get("lr_version") != version:
+        st.session_state["lr_data"] = normalize_lorawan(snap.last)
+        st.session_state["lr_version"] = version
+        if version[0] == "lora" and isinstance(snap.last, dict):
+            measured = snap.last.get("device_time") or snap.last.get("timestamp")
+            if measured:
+                E2E_DELAY_SECONDS.observe(max(time.time() - measured, 0.0))
+    return version, st.session_state["lr_data"]
 
-if data is None:
+def memo(panel, version, build):
+    """Reutiliza el objeto construido por `build` mientras no cambie la versión."""
+    cache = st.session_state.setdefault("panel_memo", {})
+    hit = cache.get(panel)
+    if hit is None or hit[0] != version:
+        hit = (version, build())
+        cache[panel] = hit
+    return hit[1]
+
+if replay_error is not None:
+    st.info(replay_error)
+    st.stop()
+
+if modo != "Demo (Simulación)" and get_source().snapshot().last is None:
+    # sin datos todavía: refresco completo hasta que llegue el primer paquete
+    from streamlit_autorefresh import st_autorefresh
+    st_autorefresh(interval=refresh_rate * 1000, key="autorefresh")
+    st.warning("⚠ No se han recibido paquetes LoRaWAN todavía. Esperando conexión a la red de misión...")
+    st.stop()
+
+if load_data()[1] is None:
     st.warning("ERROR: Datos de misión no disponibles.")
     st.stop()
 
+# Cada panel es un fragmento que se refresca por su cuenta cada refresh_rate s
+# y solo reconstruye sus objetos cuando cambia la versión de sus datos.
 
 # --- ZONA SUPERIOR: MÉTRICAS CLAVE Y ALERTAS (LAYOUT PRO) ---
 st.subheader("📊 MÓDULOS DE VIGILANCIA")
 
-col_metrics, col_alerts = st.columns([3, 1])
+# Transiciones de alertas que se listan en el panel de estado
+ALERT_RECENT = int(os.environ.get("ALERT_RECENT", "10"))
+
+def format_transitions(events):
+    """Líneas markdown de las transiciones de alertas, la más nueva primero."""
+    lines = []
+    for ev in reversed(events):
+        hora = datetime.fromtimestamp(ev.timestamp, timezone.utc).strftime("%H:%M:%S")
+        marca = ("🔴" if ev.level == "danger" else "🟠") if ev.state == "raised" else "🟢"
+        lines.append(f"- `{hora}` {marca} **{ev.device_id}** — {ev.message}"
+                     f"{'' if ev.state == 'raised' else ' (normalizada)'}")
+    return lines
+
+@st.fragment(run_every=refresh_rate)
+@timed("status")
+def panel_status():
+    version, data = load_data()
+    if modo == "Replay (Grabación)":
+        replay = st.session_state["replay"]
+        st.caption(f"⏪ REPRODUCCIÓN {replay.speed:g}× — "
+                   f"{datetime.fromtimestamp(replay.position, timezone.utc):%Y-%m-%d %H:%M:%S} UTC "
+                   f"({replay.progress:.0%})")
+    col_metrics, col_alerts = st.columns([3, 1])
 
-with col_metrics:
-    kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-    
     temp = get_key(data, "temperature", "—")
     smoke = get_key(data, "smoke", "—")
     hr = get_key(data, "heart_rate", "—")
     bat = get_key(data, "battery", "—")
-    
-    kpi1.metric("🌡 TEMPERATURA", f"{temp}°C")
-    kpi2.metric("🌫 NIVEL DE HUMO", f"{smoke}%")
-    kpi3.metric("❤️ RITMO CARDIACO", f"{hr} bpm")
-    kpi4.metric("🔋 ENERGÍA RESTANTE", f"{bat}%")
-
-with col_alerts:
-    # Contenedor visual para el panel de estado (usa estilos CSS)
-    st.markdown(
-        """
-        <div style='background: rgba(4, 30, 60, 0.4); 
-                    padding: 10px; 
-                    border-radius: 8px; 
-                    height: 100%;
-                    border: 1px solid #00eaff55;
-                    box-shadow: 0 0 10px #00eaff33;'>
-            <p style='color: #5cd7ff; font-weight: bold; margin-bottom: 5px; font-size: 14px;'>ESTADO GENERAL DE LA UNIDAD:</p>
-        """, 
-        unsafe_allow_html=True
-    )
-    
-    alert_msgs = []
-    try:
-        if isinstance(temp,(int,float)) and float(temp) >= 50:
-            alert_msgs.append(("🔥 ADVERTENCIA: TEMPERATURA EXTREMADAMENTE ALTA", "danger"))
-        if isinstance(smoke,(int,float)) and float(smoke) >= 70:
-            alert_msgs.append(("☣ ALERTA: NIVELES ALTOS DE AGENTES TÓXICOS", "danger"))
-        if isinstance(hr,(int,float)) and (int(hr) >= 150 or int(hr) <= 40):
-            alert_msgs.append(("⚠ RITMO CARDIACO ANÓMALO", "warning"))
-        if isinstance(get_key(data,"movement", None), (int,float)) and int(get_key(data,"movement")) <= 1:
-            alert_msgs.append(("🟡 INMOVILIDAD DETECTADA", "warning"))
-    except Exception:
-        pass
-    
-    if not alert_msgs:
-        st.success("🟢 SISTEMA OPERATIVO: NORMAL")
-    else:
-        for m,level in alert_msgs:
-            if level=="danger":
-                st.error(m)
-            else:
-                st.warning(m)
-                
-    st.markdown("</div>", unsafe_allow_html=True)
-    st.markdown("<div style='height: 10px;'></div>", unsafe_allow_html=True) 
+
+    with col_metrics:
+        kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+        kpi1.metric("🌡 TEMPERATURA", f"{temp}°C")
+        kpi2.metric("🌫 NIVEL DE HUMO", f"{smoke}%")
+        kpi3.metric("❤️ RITMO CARDIACO", f"{hr} bpm")
+        kpi4.metric("🔋 ENERGÍA RESTANTE", f"{bat}%")
+
+    with col_alerts:
+        # Contenedor visual para el panel de estado (usa estilos CSS)
+        st.markdown(
+            """
+            <div style='background: rgba(4, 30, 60, 0.4); 
+                        padding: 10px; 
+                        border-radius: 8px; 
+                        height: 100%;
+                        border: 1px solid #00eaff55;
+                        box-shadow: 0 0 10px #00eaff33;'>
+                <p style='color: #5cd7ff; font-weight: bold; margin-bottom: 5px; font-size: 14px;'>ESTADO GENERAL DE LA UNIDAD:</p>
+            """, 
+            unsafe_allow_html=True
+        )
+
+        # Reglas declarativas de utils/alerts.py: en LoRa se muestran las alertas
+        # activas que el motor evalúa en la ingesta (con histéresis y debounce);
+        # en demo se evalúa la muestra mostrada.
+        engine = get_demo_alerts() if modo == "Demo (Simulación)" else get_source().alerts
+        if modo == "Demo (Simulación)":
+            alert_msgs = memo("alerts", version, lambda: engine.check(data))
+        else:
+            device_id = get_key(get_source().snapshot().last, "device_id")
+            alert_msgs = memo("alerts", (version, engine.version), lambda: engine.active(device_id))
+        if not alert_msgs:
+            st.success("🟢 SISTEMA OPERATIVO: NORMAL")
+        else:
+            for m,level in alert_msgs:
+                if level=="danger":
+                    st.error(m)
+                else:
+                    st.warning(m)
+
+        # Últimas transiciones de toda la flota (AlertEngine.events), la más nueva primero
+        if modo != "Demo (Simulación)":
+            transitions = memo("alert_events", (id(engine), engine.version),
+                               lambda: format_transitions(engine.recent(ALERT_RECENT)))
+            if transitions:
+                with st.expander(f"ÚLTIMAS TRANSICIONES ({len(transitions)})"):
+                    st.markdown("\n".join(transitions))
+                    
+        st.markdown("</div>", unsafe_allow_html=True)
+        st.markdown("<div style='height: 10px;'></div>", unsafe_allow_html=True) 
+
+panel_status()
 
 st.markdown("---")
 
 # --- ZONA MEDIA: PANTALLAS DE MONITOREO (MAPA Y GRÁFICO CON PLOTLY) ---
 col_map, col_chart = st.columns(2)
 
-with col_map:
-    st.subheader("📡 RASTREO GEOLOCALIZACIÓN")
+# Mapa de flota: solo se envían los puntos dentro del viewport (índice de
+# grilla sobre las últimas posiciones) y hasta MAP_MAX_POINTS; se dibuja con
+# capas deck.gl (WebGL). El viewport se calcula para un mapa de MAP_VIEW_PX.
+MAP_VIEW_PX = (800, 500)
+MAP_MAX_POINTS = int(os.environ.get("MAP_MAX_POINTS", "5000"))
+MAP_MAX_TRAILS = int(os.environ.get("MAP_MAX_TRAILS", "300"))
+COLOR_OK = [0, 234, 255]
+COLOR_ALERT = [255, 60, 60]
+FENCE_COLORS = {"safe": [0, 255, 140, 30], "hazard": [255, 60, 60, 70]}
+
+def build_fleet_deck(lat, lon):
+    import pydeck as pdk
+    bbox = viewport(lat, lon, zoom_level, *MAP_VIEW_PX)
+    if modo == "Demo (Simulación)":
+        fleet = get_demo_fleet()
+        index, fences = fleet.index, get_demo_geofences()
+        idx = index.query(bbox)[:MAP_MAX_POINTS]
+        alert = fleet.alert[idx]
+        trails = [fleet.trails[:, i, ::-1].tolist() for i in idx[:MAP_MAX_TRAILS]]
+    else:
+        svc = get_source()
+        index, fences = svc.spatial, svc.alerts.geofences
+        idx = index.query(bbox)[:MAP_MAX_POINTS]
+        ids, mask = svc.alerts.active_mask()
+        active = {d for d, on in zip(ids, mask.tolist()) if on}
+        alert = [index.ids[i] in active for i in idx]
+        trails = []
+        for i in idx[:MAP_MAX_TRAILS]:
+            rec = svc.store.last(index.ids[i], TRAIL_POINTS)
+            ok = ~(np.isnan(rec["lat"]) | np.isnan(rec["lon"]))
+            if ok.sum() > 1:
+                trails.append(list(zip(rec["lon"][ok].tolist(), rec["lat"][ok].tolist())))
+
+    points = [{"device_id": index.ids[i], "lat": la, "lon": lo, "color": COLOR_ALERT if a else COLOR_OK}
+              for i, la, lo, a in zip(idx, index.lat[idx].tolist(), index.lon[idx].tolist(), alert)]
+    layers = []
+    if fences is not None:
+        layers.append(pdk.Layer(
+            "PolygonLayer",
+            [{"name": n, "polygon": [[p[1], p[0]] for p in poly], "color": FENCE_COLORS[k]}
+             for n, k, poly in fences.polygons()],
+            get_polygon="polygon", get_fill_color="color", get_line_color=[0, 234, 255, 120],
+            line_width_min_pixels=1,
+        ))
+    layers += [
+        pdk.Layer("PathLayer", [{"path": t} for t in trails], get_path="path",
+                  get_color=[0, 234, 255, 90], width_min_pixels=1),
+        pdk.Layer("ScatterplotLayer", points, get_position=["lon", "lat"], get_fill_color="color",
+                  get_radius=4, radius_min_pixels=3, pickable=True),
+        # unidad mostrada en los KPIs
+        pdk.Layer("ScatterplotLayer", [{"lat": lat, "lon": lon}], get_position=["lon", "lat"],
+                  get_fill_color=[255, 255, 255], get_radius=6, radius_min_pixels=6),
+    ]
+    return pdk.Deck(
+        layers=layers,
+        initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=zoom_level),
+        tooltip={"text": "{device_id}"},
+        map_style=None,
+    ), len(points)
+
+@st.fragment(run_every=refresh_rate)
+@timed("map")
+def panel_map():
+    version, data = load_data()
     lat = get_key(data, "lat", None)
     lon = get_key(data, "lon", None)
 
     if lat and lon:
-        df_map = pd.DataFrame({"lat": [lat], "lon": [lon]})
+        # el mapa cambia con el dato mostrado, las posiciones de la flota y las alertas
+        if modo == "Demo (Simulación)":
+            fleet = get_demo_fleet()
+            index, fleet_version = fleet.index, fleet.version
+        else:
+            svc = get_source()
+            index, fleet_version = svc.spatial, (svc.spatial_version, svc.alerts.version)
+        deck, shown = memo("map", (version, zoom_level, fleet_version), lambda: build_fleet_deck(lat, lon))
         with st.container():
             # Usa el zoom controlado desde el sidebar
-            st.map(df_map, zoom=zoom_level, use_container_width=True)
-        st.markdown(f"**Coordenadas Actuales:** Lat: `{lat:.4f}`, Lon: `{lon:.4f}`")
+            st.pydeck_chart(deck, use_container_width=True)
+        st.markdown(f"**Coordenadas Actuales:** Lat: `{lat:.4f}`, Lon: `{lon:.4f}` — "
+                    f"unidades en vista: `{shown}` de `{len(index)}`")
     else:
         st.info("⚠ MÓDULO GPS: Señal no recibida. Mostrando última posición conocida o fallback.")
 
+# Rango del gráfico de pulso -> segundos; la serie se reduce en el servidor a
+# CHART_MAX_POINTS (utils/downsample.py) y se dibuja con WebGL si es larga.
+HR_RANGES = {"5 min": 300, "1 h": 3600, "6 h": 6 * 3600, "24 h": 24 * 3600, "7 d": 7 * 24 * 3600}
+CHART_MAX_POINTS = int(os.environ.get("CHART_MAX_POINTS", "1500"))
+SCATTERGL_MIN_POINTS = int(os.environ.get("SCATTERGL_MIN_POINTS", "1000"))
 
-with col_chart:
-    st.subheader("📈 TENDENCIA DE PULSO VITAL (PLOTLY PRO)")
-    
-    # Generación/Carga de serie histórica (Lógica NO MODIFICADA)
-    hr_series = None
+def build_hr_figure(data, seconds):
+    import plotly.graph_objects as go
+    # Historial real de la fuente activa en la ventana elegida
+    since = clock() - seconds
     if modo == "Demo (Simulación)":
-        import random
-        hr_series = [int(get_key(data,"heart_rate",80) + random.randint(-6,6)) for _ in range(30)]
-        x_values = list(range(1, 31))
+        ts, hr_series, _ = get_demo_history(since, max_points=CHART_MAX_POINTS)
     else:
+        device_id = get_key(get_source().snapshot().last, "device_id")
+        ts, hr_series, _ = get_source().history(device_id, "heart_rate", since,
+                                                max_points=CHART_MAX_POINTS)
+    x_values = (np.asarray(ts, dtype=np.float64) * 1000).astype("datetime64[ms]")
+    x_title = "Hora (UTC)"
+    if len(hr_series) < 2:
+        # sin historial: serie enviada por el dispositivo o valor actual
+        hr_series = None
         payload = get_key(data, "raw_payload", None) or get_key(data, "payload", None)
         if isinstance(payload, dict):
             hr_series = payload.get("hr_values") or payload.get("heart_history") or payload.get("hr_series")
         if not hr_series:
             hr_series = [int(get_key(data,"heart_rate",80))]*30
         x_values = list(range(1, len(hr_series) + 1))
-    
-    df_hr = pd.DataFrame({"Tiempo": x_values, "Ritmo Cardiaco (bpm)": hr_series})
-    
+        x_title = "Tiempo (Unidades)"
+
     # --- IMPLEMENTACIÓN PLOTLY CON ESTÉTICA NASA AZUL-CIAN ---
+    # WebGL para series largas; marcadores solo si hay pocos puntos
+    n = len(hr_series)
+    trace = go.Scattergl if n >= SCATTERGL_MIN_POINTS else go.Scatter
     fig = go.Figure(
-        data=[go.Scatter(
-            x=df_hr["Tiempo"], 
-            y=df_hr["Ritmo Cardiaco (bpm)"], 
-            mode='lines+markers',
+        data=[trace(
+            x=x_values, 
+            y=hr_series, 
+            mode='lines+markers' if n <= 120 else 'lines',
             line=dict(color='#00FFFF', width=3),
             marker=dict(color='#00FFFF', size=6, line=dict(width=1, color='#00FFFF'))
         )]
@@ -222,7 +436,7 @@ with col_chart:
         title=None,
         margin=dict(l=10, r=10, t=20, b=20),
         xaxis=dict(
-            title='Tiempo (Unidades)', 
+            title=x_title, 
             # Corrección del error: usar formato RGBA para transparencia en Plotly
             showgrid=True, gridcolor='rgba(0, 255, 255, 0.2)', 
             zerolinecolor='#00FFFF'
@@ -238,18 +452,58 @@ with col_chart:
             color="#E0F7FF"
         )
     )
-    
+    return fig
+
+def hr_figure_key(version, rango):
+    """
+    Clave del gráfico: dispositivo, rango y, en cubetas del ancho de un punto
+    (como mínimo el refresco), su último dato y el reloj. Un paquete de otro
+    dispositivo no lo reconstruye ni vuelve a leer el log.
+    """
+    if modo == "Demo (Simulación)":
+        return version, rango
+    svc = get_source()
+    device_id = get_key(svc.snapshot().last, "device_id")
+    res = max(HR_RANGES[rango] / CHART_MAX_POINTS, refresh_rate)
+    last = svc.store.latest(device_id)
+    last_ts = None if last is None else float(last["timestamp"]) // res
+    return device_id, rango, last_ts, clock() // res
+
+@st.fragment(run_every=refresh_rate)
+@timed("chart")
+def panel_chart():
+    version, data = load_data()
+    rango = st.radio("RANGO DE TIEMPO", list(HR_RANGES), index=1, horizontal=True,
+                     key="hr_range", label_visibility="collapsed")
+    fig = memo("hr_figure", hr_figure_key(version, rango), lambda: build_hr_figure(data, HR_RANGES[rango]))
     # Renderizar el gráfico Plotly (proporciona interactividad por defecto)
     st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
 
+with col_map:
+    st.subheader("📡 RASTREO GEOLOCALIZACIÓN")
+    panel_map()
+
+with col_chart:
+    st.subheader("📈 TENDENCIA DE PULSO VITAL (PLOTLY PRO)")
+    panel_chart()
+
 
 st.markdown("---")
 
 # --- ZONA INFERIOR: LOGS TÉCNICOS ---
 st.subheader("📦 LOG DE PAQUETE (TELEMETRÍA RAW)")
-# La línea corregida del error de sintaxis (language="json")
-st.code(json.dumps(data, indent=2, ensure_ascii=False), language="json")
+
+@st.fragment(run_every=refresh_rate)
+@timed("log")
+def panel_log():
+    version, data = load_data()
+    # La línea corregida del error de sintaxis (language="json")
+    st.code(memo("log", version, lambda: json.dumps(data, indent=2, ensure_ascii=False)), language="json")
+
+panel_log()
 
 # footer: instrucciones rápidas
 st.markdown("---")
-st.caption("PROTOCOLO DE TELEMETRÍA: Los datos se actualizan automáticamente cada **" + str(refresh_rate) + " segundos**.")
\ No newline at end of file
+st.caption("PROTOCOLO DE TELEMETRÍA: Los datos se actualizan automáticamente cada **" + str(refresh_rate) + " segundos**.")
+
+RENDER_SECONDS.observe(time.perf_counter() - _SCRIPT_T0, panel="script")
@@ -0,0 +1,58 @@
+# bench/bench_codec.py
+"""
+Decodificación de frm_payload: frame por frame (struct) vs en lote
+(np.frombuffer), y tamaño del frame frente al JSON equivalente.
+
+Uso:
+    python -m bench.bench_codec --frames 100000
+"""
+
+import argparse
+import json
+import random
+import time
+
+from utils.codec import DEFAULT_REGISTRY, PULSERA_V1
+
+
+def make_frames(n):
+    rows = [{
+        "temperature": round(36 + random.uniform(-1, 2), 1),
+        "heart_rate": random.randint(55, 120),
+        "smoke": random.randint(0, 30),
+        "movement": random.randint(0, 10),
+        "battery": random.randint(20, 100),
+        "lat": -2.146 + random.uniform(-0.01, 0.01),
+        "lon": -79.964 + random.uniform(-0.01, 0.01),
+    } for _ in range(n)]
+    return rows, [PULSERA_V1.encode(r) for r in rows]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="decodificación de frames binarios")
+    ap.add_argument("--frames", type=int, default=100000)
+    args = ap.parse_args(argv)
+    rows, frames = make_frames(args.frames)
+
+    t = time.perf_counter()
+    single = [DEFAULT_REGISTRY.decode(f) for f in frames]
+    t_single = time.perf_counter() - t
+    t = time.perf_counter()
+    cols, ok = DEFAULT_REGISTRY.decode_columns(frames)
+    t_cols = time.perf_counter() - t
+    t = time.perf_counter()
+    batch = DEFAULT_REGISTRY.decode_batch(frames)
+    t_batch = time.perf_counter() - t
+    assert ok.all() and single[0] == batch[0]
+
+    n = args.frames
+    json_bytes = sum(len(json.dumps(r, separators=(",", ":"))) for r in rows[:1000]) / 1000
+    print("frames: %d  tamaño: %d bytes (JSON equivalente ~%.0f bytes)" % (n, PULSERA_V1.size, json_bytes))
+    print("uno a uno (struct):          %8.0f frames/s" % (n / t_single))
+    print("lote a columnas (frombuffer): %8.0f frames/s" % (n / t_cols))
+    print("lote a dicts:                %8.0f frames/s" % (n / t_batch))
+    return {"single_fps": n / t_single, "columns_fps": n / t_cols, "batch_fps": n / t_batch}
+
+
+if __name__ == "__main__":
+    main()
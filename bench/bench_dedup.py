@@ -0,0 +1,84 @@
+# bench/bench_dedup.py
+"""
+Buffer de deduplicación y reordenamiento (utils/dedup.py).
+
+ - escenarios (tests/dedup_scenarios.py, los mismos que corre pytest):
+   duplicados multi-gateway (unidos antes de guardar), desorden, huecos,
+   paquetes tardíos (también un 0 tardío), desborde del f_cnt (32 y 16 bits)
+   y reinicio del dispositivo; cada uno imprime ok / FALLA y el script
+   termina con código 1 si alguno falla
+ - tasa: µs por paquete con flotas de distinto tamaño (debe ser ~constante),
+   con un 5% de duplicados y un 5% de pares intercambiados
+
+Uso:
+    python -m bench.bench_dedup
+    python -m bench.bench_dedup --packets 500000 --devices 1000 10000 100000
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from tests.dedup_scenarios import run
+from utils.dedup import UplinkDeduplicator
+from utils.fleet import make_uplink
+from utils.ttn import parse_uplink
+
+
+def scenarios():
+    results = []
+    for name, got, want in run():
+        results.append(got == want)
+        print("%-40s %s" % (name, "ok" if got == want else "FALLA: %r != %r" % (got, want)))
+    return all(results)
+
+
+def throughput(packets, devices, seed=3):
+    rng = random.Random(seed)
+    f_cnt = [0] * devices
+    raws = []
+    while len(raws) < packets:
+        i = rng.randrange(devices)
+        f_cnt[i] += 1
+        raws.append(make_uplink("dev-%06d" % i, f_cnt[i]))
+        r = rng.random()
+        if r < 0.05:
+            raws.append(raws[-1])                       # duplicado
+        elif r < 0.10 and len(raws) > 1:
+            raws[-1], raws[-2] = raws[-2], raws[-1]     # par intercambiado
+    pairs = [(raw, parse_uplink(raw)) for raw in raws]
+    dedup = UplinkDeduplicator(max_devices=devices)
+    t = time.perf_counter()
+    ready = []
+    for k in range(0, len(pairs), 500):                 # lotes como los de ingest_batch
+        now = k / 500 * 0.05                            # reloj simulado: un lote cada 50 ms
+        ready += dedup.push(pairs[k:k + 500], now=now)
+        ready += dedup.release(now=now)
+    ready += dedup.flush()
+    dt = time.perf_counter() - t
+    seen = {}
+    ordered = True
+    for out in ready:
+        prev = seen.get(out["device_id"], 0)
+        ordered &= out["f_cnt"] > prev
+        seen[out["device_id"]] = out["f_cnt"]
+    unique = sum(f_cnt)
+    print("%7d dispositivos: %8d paquetes  %.2f µs/paquete  entregados %d de %d únicos  en orden: %s" % (
+        devices, len(pairs), dt / len(pairs) * 1e6, len(ready), unique, "sí" if ordered else "NO"))
+    return ordered
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="deduplicación y reordenamiento de uplinks")
+    ap.add_argument("--packets", type=int, default=200000)
+    ap.add_argument("--devices", type=int, nargs="+", default=[100, 10000, 100000])
+    args = ap.parse_args(argv)
+    ok = scenarios()
+    for n in args.devices:
+        ok &= throughput(args.packets, n)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
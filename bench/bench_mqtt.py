@@ -0,0 +1,149 @@
+# bench/bench_mqtt.py
+"""
+Arnés del cliente MQTT de ingesta (utils/mqtt_ingest.py) contra el broker en
+proceso de bench/mqtt_broker.py: una flota simulada publica uplinks TTN v3
+en sus topics y se mide la tasa sostenida de ingesta (IngestionService real
+sobre un log temporal) y la pérdida (publicados - ingestados).
+
+ - --rate limita los mensajes/s del publicador (0 = lo más rápido posible)
+ - --kick corta todas las conexiones del broker a mitad de la corrida para
+   ejercitar la reconexión con espera exponencial (el publicador reenvía lo
+   que no recibió PUBACK; lo que el broker ya había aceptado y no entregó se
+   pierde, porque el broker de prueba no guarda sesiones)
+ - --shared N suscribe N clientes al mismo $share/<grupo>/ (el broker reparte)
+
+Publicador, broker e ingesta comparten un proceso (y el GIL): la tasa medida
+es una cota inferior de la de un despliegue con el broker aparte.
+
+Uso:
+    python -m bench.bench_mqtt
+    python -m bench.bench_mqtt --messages 100000 --devices 1000 --workers 4
+    python -m bench.bench_mqtt --rate 2000 --kick --shared 2
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from bench.mqtt_broker import MiniBroker
+from utils.fleet import FleetSimulator, publish_mqtt
+from utils.ingest import IngestionService
+from utils.metrics import REGISTRY
+from utils.mqtt_ingest import MqttIngestor
+from utils.store import TelemetryStore
+from utils.tslog import TimeSeriesLog
+
+
+def _value(name):
+    return sum(v for _, _, v in REGISTRY.counter(name, "").samples())
+
+
+def _publisher(port):
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="bench-pub")
+    client.max_inflight_messages_set(1000)
+    client.max_queued_messages_set(0)
+    client.reconnect_delay_set(1, 4)
+    client.connect("127.0.0.1", port, 60)
+    client.loop_start()
+    return client
+
+
+def run(messages, devices, qos, workers, rate=0, kick=False, shared=1, idle_s=3.0):
+    tmp = tempfile.mkdtemp(prefix="bench-mqtt-")
+    broker = MiniBroker().start()
+    ingestors = []
+    try:
+        svc = IngestionService(store=TelemetryStore(capacity=64, max_devices=max(devices, 16)),
+                               log=TimeSeriesLog(tmp), record=False)
+        ingested = [0]
+        last = [None]
+        lock = threading.Lock()
+
+        def on_batch(items, topics):
+            failed = svc.ingest_batch(items, topics)
+            with lock:
+                ingested[0] += len(items) - failed
+                last[0] = time.perf_counter()
+
+        group = "bench" if shared > 1 else None
+        for i in range(shared):
+            ing = MqttIngestor(on_batch, "127.0.0.1", broker.port, topics="v3/+/devices/+/up",
+                               qos=qos, share_group=group, client_id="bench-%d" % i,
+                               workers=workers, reconnect_min=1, reconnect_max=4).start()
+            ingestors.append(ing)
+        deadline = time.monotonic() + 10
+        while any(ing.connects == 0 for ing in ingestors) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.2)  # que lleguen los SUBACK
+
+        dropped0, reconnects0 = _value("mqtt_dropped_total"), _value("mqtt_reconnects_total")
+        pub = _publisher(broker.port)
+        sim = FleetSimulator(devices, seed=5)
+        sent = 0
+        t0 = time.perf_counter()
+        kicked = False
+        while sent < messages:
+            ups = sim.uplinks(sim.step(5.0))[:messages - sent]
+            publish_mqtt(pub, ups, qos=qos)
+            sent += len(ups)
+            if kick and not kicked and sent >= messages // 2:
+                broker.kick()  # publicador e ingesta reconectan solos
+                kicked = True
+            if rate:
+                time.sleep(max(0.0, sent / rate - (time.perf_counter() - t0)))
+        # esperar a que el publicador vacíe su cola y la ingesta se detenga
+        while pub.want_write() and time.perf_counter() - t0 < 600:
+            time.sleep(0.05)
+        t_pub = time.perf_counter() - t0
+        seen = -1
+        while ingested[0] != seen or sum(ing.pending for ing in ingestors):
+            seen = ingested[0]
+            time.sleep(idle_s)
+        pub.loop_stop()
+        pub.disconnect()
+        elapsed = (last[0] or time.perf_counter()) - t0
+        svc.log.close()
+        return {
+            "sent": sent,
+            "broker_published": broker.published,
+            "ingested": ingested[0],
+            "lost": sent - ingested[0],
+            "loss_pct": 100.0 * (sent - ingested[0]) / sent,
+            "dropped_queue_full": _value("mqtt_dropped_total") - dropped0,
+            "reconnects": _value("mqtt_reconnects_total") - reconnects0,
+            "publish_s": t_pub,
+            "elapsed_s": elapsed,
+            "msgs_per_s": ingested[0] / elapsed if elapsed > 0 else 0.0,
+        }
+    finally:
+        for ing in ingestors:
+            ing.stop()
+        broker.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="tasa sostenida y pérdida del cliente MQTT de ingesta")
+    ap.add_argument("--messages", type=int, default=20000)
+    ap.add_argument("--devices", type=int, default=500)
+    ap.add_argument("--qos", type=int, choices=(0, 1), default=1)
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("MQTT_WORKERS", "2")))
+    ap.add_argument("--rate", type=float, default=0, help="mensajes/s del publicador (0 = sin límite)")
+    ap.add_argument("--kick", action="store_true", help="cortar las conexiones a mitad de la corrida")
+    ap.add_argument("--shared", type=int, default=1, help="clientes en una suscripción compartida")
+    args = ap.parse_args(argv)
+
+    r = run(args.messages, args.devices, args.qos, args.workers, args.rate, args.kick, args.shared)
+    print("enviados %d  ingestados %d  perdidos %d (%.2f%%)  descartados (cola) %d  reconexiones %d" % (
+        r["sent"], r["ingested"], r["lost"], r["loss_pct"], r["dropped_queue_full"], r["reconnects"]))
+    print("publicación %.2f s  ingesta %.2f s  -> %.0f mensajes/s sostenidos" % (
+        r["publish_s"], r["elapsed_s"], r["msgs_per_s"]))
+    return r
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# bench/bench_recorder.py
+"""
+Benchmark de la grabación en Parquet (utils/recorder.py) y de la reproducción
+(utils/replay.py) con un día de la flota simulada:
+
+ - escritura: filas/s de append_many y de flush cada RECORDER_FLUSH_S de
+   tiempo simulado, y la compactación del día
+ - lectura: día completo, un dispositivo (poda por partición y row groups)
+   y una hora de toda la flota
+ - reproducción: carga de la ventana y filas/s de Replay.advance a 100x
+
+Uso:
+    python -m bench.bench_recorder
+    python -m bench.bench_recorder --devices 100 --hours 6
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from utils.fleet import FleetSimulator
+from utils.recorder import DAY_S, SessionRecorder
+from utils.replay import Replay
+
+
+def _timed(fn):
+    t = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="grabación Parquet y reproducción de un día de flota")
+    ap.add_argument("--devices", type=int, default=200)
+    ap.add_argument("--hours", type=float, default=24.0)
+    ap.add_argument("--interval", type=float, default=5.0, help="segundos entre muestras")
+    ap.add_argument("--flush-s", type=float, default=float(os.environ.get("RECORDER_FLUSH_S", "300")))
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="bench-rec-")
+    try:
+        # un día UTC completo que ya terminó, para que se compacte
+        day0 = (time.time() // DAY_S - 2) * DAY_S
+        rec = SessionRecorder(tmp)
+        sim = FleetSimulator(args.devices, seed=11, start=day0)
+        steps = int(args.hours * 3600 / args.interval)
+        per_flush = max(1, int(args.flush_s / args.interval))
+        t_append = t_flush = 0.0
+        for i in range(steps):
+            cols = sim.step(args.interval)
+            t = time.perf_counter()
+            rec.append_many(sim.device_ids, cols)
+            t_append += time.perf_counter() - t
+            if (i + 1) % per_flush == 0 or i == steps - 1:
+                t = time.perf_counter()
+                rec.flush()
+                t_flush += time.perf_counter() - t
+        _, t_compact = _timed(lambda: [rec.compact(d) for d in rec.days()])
+        rows = steps * args.devices
+        size = sum(os.path.getsize(os.path.join(r, f)) for r, _, fs in os.walk(tmp) for f in fs)
+        files = sum(len(fs) for _, _, fs in os.walk(tmp))
+        print("escritura: %d filas  append %.0f filas/s  flush %.2f s (%.0f filas/s)  "
+              "compactación %.2f s  %.1f MB en %d archivos" % (
+                  rows, rows / t_append, t_flush, rows / t_flush, t_compact, size / 1e6, files))
+
+        table, dt = _timed(lambda: rec.read(day0, day0 + DAY_S))
+        print("lectura día completo:   %9d filas  %.2f s" % (table.num_rows, dt))
+        table, dt = _timed(lambda: rec.read(day0, day0 + DAY_S, [sim.device_ids[0]]))
+        print("lectura un dispositivo: %9d filas  %.3f s" % (table.num_rows, dt))
+        h = day0 + min(args.hours, 13) * 3600
+        table, dt = _timed(lambda: rec.read(h - 3600, h))
+        print("lectura una hora:       %9d filas  %.3f s" % (table.num_rows, dt))
+
+        replay, dt = _timed(lambda: Replay(rec, h - 3600, h, speed=100))
+        print("replay (1 h): carga %.3f s" % dt)
+        t = time.perf_counter()
+        while not replay.finished:
+            replay.advance(0.2 * replay.speed)  # un paso del hilo de reproducción a 100x
+        dt = time.perf_counter() - t
+        print("replay (1 h) a 100x: %d filas en %.2f s de CPU (%.0f filas/s; tiempo real a 100x: %.0f s)" % (
+            len(replay), dt, len(replay) / dt, 3600 / 100))
+        replay.stop()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
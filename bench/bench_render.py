@@ -0,0 +1,206 @@
+# bench/bench_render.py
+"""
+CPU del servidor Streamlit por sesión y por minuto: antes y después del
+render por cambios (fragmentos).
+
+Levanta `streamlit run` en modo headless y abre varias sesiones por websocket
+(el mismo protocolo que usa el navegador). Cada "tick" de refresco se simula
+como lo haría el frontend:
+ - antes: un rerun completo del script (lo que hacía st_autorefresh)
+ - después: un rerun por cada fragmento con run_every (is_auto_rerun)
+
+El CPU se lee de /proc/<pid>/stat (solo Linux). El "antes" es app.py en la
+revisión --before-rev (por defecto el primer commit del repo) con
+runner.postScriptGC activado, como estaba configurado entonces.
+
+Uso:
+    python -m bench.bench_render --sessions 5 --ticks 20
+    python -m bench.bench_render --mode demo
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+try:
+    from websockets.asyncio.client import connect as ws_connect
+except ImportError:
+    sys.exit("bench_render requiere websockets (pip install websockets)")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODE_LABEL = "MODO DE OPERACIÓN:"
+MODE_INDEX = {"demo": 0, "lora": 1}
+
+
+def _cpu_seconds(pid):
+    with open("/proc/%d/stat" % pid) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Session:
+    """Cliente websocket mínimo que imita al frontend de Streamlit."""
+
+    def __init__(self, url):
+        self.url = url
+        self.ws = None
+        self.fragments = []    # ids de fragmentos con run_every
+        self.mode_widget = None
+        self.mode_options = []
+
+    async def connect(self):
+        self.ws = await ws_connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def _rerun(self, widget_states=None, fragment_id="", auto=False):
+        msg = BackMsg()
+        cs = msg.rerun_script
+        cs.query_string = ""
+        cs.page_script_hash = ""
+        if widget_states is not None:
+            cs.widget_states.CopyFrom(widget_states)
+        if fragment_id:
+            cs.fragment_id = fragment_id
+            cs.is_auto_rerun = auto
+        await self.ws.send(msg.SerializeToString())
+        while True:
+            raw = await self.ws.recv()
+            fwd = ForwardMsg()
+            fwd.ParseFromString(raw)
+            kind = fwd.WhichOneof("type")
+            if kind == "auto_rerun" and fwd.auto_rerun.fragment_id not in self.fragments:
+                self.fragments.append(fwd.auto_rerun.fragment_id)
+            elif kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                el = fwd.delta.new_element
+                if el.WhichOneof("type") == "radio" and el.radio.label == MODE_LABEL:
+                    self.mode_widget = el.radio.id
+                    self.mode_options = list(el.radio.options)
+            elif kind == "script_finished":
+                return
+
+    def _mode_state(self, mode):
+        from streamlit.proto.WidgetStates_pb2 import WidgetStates
+        states = WidgetStates()
+        if self.mode_widget:
+            w = states.widgets.add()
+            w.id = self.mode_widget
+            w.string_value = self.mode_options[MODE_INDEX[mode]]
+        return states
+
+    async def start(self, mode):
+        await self._rerun()
+        await self._rerun(self._mode_state(mode))
+        self.states = self._mode_state(mode)
+
+    async def tick(self, fragments):
+        if fragments and self.fragments:
+            for fid in self.fragments:
+                await self._rerun(self.states, fragment_id=fid, auto=True)
+        else:
+            await self._rerun(self.states)
+
+
+def _seed_log(log_dir):
+    """Un paquete LoRaWAN fijo, para medir reruns sin datos nuevos."""
+    from utils.tslog import TimeSeriesLog
+    log = TimeSeriesLog(log_dir)
+    rec = {"timestamp": time.time(), "temperature": 36.5, "heart_rate": 82, "smoke": 8,
+           "movement": 6, "battery": 88, "lat": -2.146, "lon": -79.964}
+    out = {"received_topic": "bench", "device_id": "pulsera-0001",
+           "payload": dict(rec), "timestamp": rec["timestamp"]}
+    log.append("pulsera-0001", rec, raw=out)
+    log.close()
+
+
+async def _measure(script, args, fragments, env, flags=()):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", script, "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false", *flags],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = "ws://127.0.0.1:%d/_stcore/stream" % port
+        sessions = [Session(url) for _ in range(args.sessions)]
+        for _ in range(100):
+            try:
+                await sessions[0].connect()
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        await asyncio.gather(*(s.connect() for s in sessions[1:]))
+        await asyncio.gather(*(s.start(args.mode) for s in sessions))
+        # calentamiento
+        await asyncio.gather(*(s.tick(fragments) for s in sessions))
+
+        cpu0, t0 = _cpu_seconds(proc.pid), time.perf_counter()
+        for _ in range(args.ticks):
+            await asyncio.gather(*(s.tick(fragments) for s in sessions))
+        cpu = _cpu_seconds(proc.pid) - cpu0
+        wall = time.perf_counter() - t0
+    finally:
+        for s in sessions:
+            if s.ws is not None:
+                await s.ws.close()
+        proc.terminate()
+        proc.wait()
+    ticks_per_min = 60.0 / args.refresh
+    return {
+        "cpu_s": cpu,
+        "wall_s": wall,
+        "cpu_ms_per_tick": cpu / (args.sessions * args.ticks) * 1000,
+        "cpu_s_per_session_min": cpu / (args.sessions * args.ticks) * ticks_per_min,
+    }
+
+
+async def main_async(args):
+    env = dict(os.environ, LORA_BACKEND="webhook", LOG_DIR=tempfile.mkdtemp(prefix="tslog-render-"))
+    _seed_log(env["LOG_DIR"])
+
+    before = os.path.join(ROOT, "._bench_app_before.py")
+    rev = args.before_rev or subprocess.check_output(
+        ["git", "rev-list", "--max-parents=0", "HEAD"], cwd=ROOT, text=True).split()[0]
+    with open(before, "w", encoding="utf-8") as f:
+        f.write(subprocess.check_output(["git", "show", "%s:app.py" % rev], cwd=ROOT, text=True))
+    try:
+        # el "antes" también usa la configuración anterior (gc.collect tras cada rerun)
+        res_before = await _measure(before, args, fragments=False, env=env,
+                                    flags=("--runner.postScriptGC", "true"))
+    finally:
+        os.remove(before)
+    res_after = await _measure("app.py", args, fragments=True, env=env)
+    return {"before": res_before, "after": res_after, "before_rev": rev}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="CPU del servidor por sesión/minuto")
+    ap.add_argument("--sessions", type=int, default=5)
+    ap.add_argument("--ticks", type=int, default=20)
+    ap.add_argument("--refresh", type=float, default=1.0, help="segundos por tick")
+    ap.add_argument("--mode", choices=sorted(MODE_INDEX), default="lora")
+    ap.add_argument("--before-rev", default=None)
+    args = ap.parse_args(argv)
+    res = asyncio.run(main_async(args))
+    print("sesiones: %d  ticks: %d  modo: %s  (antes = %s)" % (
+        args.sessions, args.ticks, args.mode, res["before_rev"][:10]))
+    for name in ("before", "after"):
+        r = res[name]
+        print("%-7s CPU/tick: %6.1f ms   CPU por sesión-minuto: %5.2f s" % (
+            name, r["cpu_ms_per_tick"], r["cpu_s_per_session_min"]))
+    return res
+
+
+if __name__ == "__main__":
+    main()
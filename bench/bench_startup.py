@@ -0,0 +1,121 @@
+# bench/bench_startup.py
+"""
+Arranque en frío de los puntos de entrada, con `python -X importtime` en un
+intérprete nuevo por medición:
+
+ - dashboard: los imports de nivel superior de app.py (se leen con ast, así
+   que siguen a app.py), más streamlit
+ - ingestor: ingestor.py (servicio de ingesta sin interfaz)
+ - receiver: receiver.py (webhook FastAPI)
+
+Para cada uno se informa el tiempo de import (mínimo de --repeat corridas) y
+los módulos más lentos, y se verifica que importar no tenga efectos:
+
+ - ningún módulo pesado que se carga al primer uso (pyarrow, pandas,
+   pydeck, streamlit_autorefresh, paho)
+ - ningún hilo además del principal
+ - ningún archivo ni directorio creado (LOG_DIR, RECORDER_DIR y METRICS_DIR
+   apuntan a un directorio temporal que debe seguir vacío)
+
+Termina con código 1 si alguna verificación falla o si un punto de entrada
+supera --max-ms (0 = sin límite de tiempo), para usarlo como control de
+regresiones.
+
+Uso:
+    python -m bench.bench_startup
+    python -m bench.bench_startup --repeat 5 --max-ms 1500
+"""
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# plotly.graph_objects no está: streamlit lo importa (sus clases se cargan al usarlas)
+LAZY_MODULES = ("pyarrow", "pandas", "pydeck", "streamlit_autorefresh", "paho")
+
+# lo que corre el intérprete medido después de los imports
+PROBE = """
+import sys, threading
+print("THREADS", threading.active_count())
+print("LAZY", ",".join(m for m in %r if m in sys.modules))
+"""
+
+
+def app_imports(path=os.path.join(ROOT, "app.py")):
+    """Sentencias import de nivel superior de app.py."""
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return "\n".join(ast.get_source_segment(source, node) for node in tree.body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+ENTRY_POINTS = {
+    "dashboard": app_imports,
+    "ingestor": lambda: "import ingestor",
+    "receiver": lambda: "import receiver",
+}
+
+
+def measure(code):
+    """Corre code con -X importtime; devuelve (ms, [(ms, módulo)], salida del probe)."""
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as tmp:
+        env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1",
+                   LOG_DIR=os.path.join(tmp, "tslog"), RECORDER_DIR=os.path.join(tmp, "recordings"),
+                   METRICS_DIR=os.path.join(tmp, "metrics"))
+        r = subprocess.run([sys.executable, "-X", "importtime", "-c", code + PROBE % (LAZY_MODULES,)],
+                           cwd=tmp, env=env, capture_output=True, text=True)
+        if r.returncode != 0:
+            raise RuntimeError(r.stderr[-2000:])
+        created = os.listdir(tmp)
+    total, top = 0, []
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # encabezado
+        total += int(self_us)
+        top.append((int(cumulative_us) / 1000.0, name.rstrip()))
+    probe = dict(line.split(" ", 1) if " " in line else (line, "") for line in r.stdout.splitlines())
+    probe["CREATED"] = ",".join(created)
+    return total / 1000.0, top, probe
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="tiempo de import y efectos al importar de los puntos de entrada")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--max-ms", type=float, default=0.0, help="límite por punto de entrada (0 = sin límite)")
+    ap.add_argument("--top", type=int, default=5, help="módulos más lentos a mostrar")
+    ap.add_argument("entries", nargs="*", default=list(ENTRY_POINTS))
+    args = ap.parse_args(argv)
+
+    ok = True
+    for name in args.entries:
+        code = ENTRY_POINTS[name]()
+        runs = [measure(code) for _ in range(args.repeat)]
+        ms, top, probe = min(runs, key=lambda r: r[0])
+        problems = []
+        if probe.get("THREADS") != "1":
+            problems.append("hilos al importar: %s" % probe.get("THREADS"))
+        if probe.get("LAZY"):
+            problems.append("módulos pesados al importar: %s" % probe["LAZY"])
+        if probe["CREATED"]:
+            problems.append("archivos creados al importar: %s" % probe["CREATED"])
+        if args.max_ms and ms > args.max_ms:
+            problems.append("%.0f ms > --max-ms %.0f" % (ms, args.max_ms))
+        ok &= not problems
+        print("%-10s %7.0f ms  %s" % (name, ms, "ok" if not problems else "FALLA: " + "; ".join(problems)))
+        # los de nivel superior (sin sangría) son lo que pidió el punto de entrada
+        roots = sorted((t for t in top if not t[1].startswith("  ")), reverse=True)[:args.top]
+        for cum, mod in roots:
+            print("    %7.1f ms  %s" % (cum, mod.strip()))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# bench/bench_storage.py
+"""
+Compara el camino anterior (reescribir last_lora.json con json.dump en cada
+paquete) con el log segmentado de utils/tslog.py.
+
+Uso:
+    python -m bench.bench_storage [n_paquetes] [n_dispositivos]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from utils.tslog import TimeSeriesLog
+
+
+def _packets(n, n_devices):
+    t0 = time.time() - n
+    for i in range(n):
+        dev = "pulsera-%04d" % (i % n_devices)
+        rec = {
+            "timestamp": t0 + i,
+            "temperature": 36 + random.random(),
+            "heart_rate": random.randint(60, 110),
+            "smoke": random.randint(0, 20),
+            "movement": random.randint(0, 10),
+            "battery": 90,
+            "lat": -2.146,
+            "lon": -79.964,
+        }
+        out = {"received_topic": "v3/app/devices/%s/up" % dev, "device_id": dev,
+               "payload": dict(rec), "timestamp": rec["timestamp"]}
+        yield dev, rec, out
+
+
+def bench_json_dump(path, packets):
+    t = time.perf_counter()
+    for _, _, out in packets:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(out, f)
+    return time.perf_counter() - t
+
+
+def bench_tslog(directory, packets):
+    log = TimeSeriesLog(directory, segment_bytes=4 * 1024 * 1024)
+    t = time.perf_counter()
+    for dev, rec, out in packets:
+        log.append(dev, rec, raw=out)
+    log.flush()
+    elapsed = time.perf_counter() - t
+    return log, elapsed
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    n_devices = int(argv[2]) if len(argv) > 2 else 100
+    packets = list(_packets(n, n_devices))
+    with tempfile.TemporaryDirectory() as tmp:
+        t_json = bench_json_dump(os.path.join(tmp, "last_lora.json"), packets)
+        log, t_log = bench_tslog(os.path.join(tmp, "tslog"), packets)
+
+        since = packets[-1][1]["timestamp"] - 600  # últimos 10 minutos
+        t = time.perf_counter()
+        reps = 50
+        for _ in range(reps):
+            rows = log.read("pulsera-0000", since=since)
+        t_query = (time.perf_counter() - t) / reps
+        log.close()
+
+    print("paquetes: %d  dispositivos: %d" % (n, n_devices))
+    print("json.dump (reescritura): %10.0f paquetes/s" % (n / t_json))
+    print("tslog (append):          %10.0f paquetes/s  (x%.1f)" % (n / t_log, t_json / t_log))
+    print("consulta 10 min de un dispositivo: %.2f ms (%d registros)" % (t_query * 1000, len(rows)))
+    return {"json_dump_per_s": n / t_json, "tslog_per_s": n / t_log, "query_ms": t_query * 1000}
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,231 @@
+# bench/bench_suite.py
+"""
+Benchmark de punta a punta con la flota simulada (utils/fleet.py), para
+10 / 100 / 1.000 / 10.000 dispositivos:
+
+ - ingest:  uplinks/s por IngestionService.ingest_batch en micro-lotes como
+            los del receptor (JSON con decoded_payload y frames binarios);
+            lo que el dedup retiene para unir gateways se guarda (drain)
+            antes de parar el reloj y se informa aparte (held_at_end)
+ - storage: registros/s y MB/s de TimeSeriesLog.append
+ - query:   latencia p50/p99 de store.window y log.read por dispositivo,
+            primera carga del historial reducido (gráfico) y evaluación de
+            alertas de toda la flota
+ - render:  ms por rerun del dashboard (AppTest, modo LoRa) tras un paquete nuevo
+
+Cada ejecución agrega una línea JSON a --out (por defecto
+bench/results/suite.jsonl) con la revisión de git, la máquina y los
+resultados, para comparar corridas en el tiempo.
+
+Uso:
+    python -m bench.bench_suite
+    python -m bench.bench_suite --devices 10 100 --no-render
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from utils.fleet import FleetSimulator
+from utils.ingest import IngestionService
+from utils.store import TelemetryStore
+from utils.tslog import TimeSeriesLog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BATCH = 500  # como RECEIVER_BATCH_MAX
+
+
+def _pct(values, p):
+    return float(np.percentile(values, p)) if len(values) else None
+
+
+def _timed(fn, reps):
+    out = []
+    for _ in range(reps):
+        t = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t)
+    return out
+
+
+def bench_ingest(n, target, capacity, binary):
+    """uplinks/s de ingest_batch (normalización + store + log)."""
+    tmp = tempfile.mkdtemp(prefix="suite-ingest-")
+    try:
+        svc = IngestionService(store=TelemetryStore(capacity=capacity, max_devices=max(n, 16)),
+                               log=TimeSeriesLog(tmp), record=False)
+        sim = FleetSimulator(n, seed=1)
+        steps = max(1, target // n)
+        batches = []
+        for _ in range(steps):
+            ups = sim.uplinks(sim.step(5.0), binary=binary)
+            batches += [ups[i:i + BATCH] for i in range(0, len(ups), BATCH)]
+        t = time.perf_counter()
+        for b in batches:
+            svc.ingest_batch(b)
+        held = svc.drain()  # lo retenido también cuenta como ingestado
+        svc.log.flush()
+        elapsed = time.perf_counter() - t
+        svc.log.close()
+        return {"uplinks": steps * n, "uplinks_per_s": steps * n / elapsed, "held_at_end": held}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_storage(n, target):
+    """registros/s y MB/s de TimeSeriesLog.append (sin el JSON original)."""
+    tmp = tempfile.mkdtemp(prefix="suite-log-")
+    try:
+        log = TimeSeriesLog(tmp)
+        sim = FleetSimulator(n, seed=2)
+        steps = max(1, target // n)
+        rows = []
+        for _ in range(steps):
+            cols = sim.step(5.0)
+            rows += list(zip(sim.device_ids, sim.records(cols)))
+        t = time.perf_counter()
+        for device_id, rec in rows:
+            log.append(device_id, rec)
+        log.flush()
+        elapsed = time.perf_counter() - t
+        log.close()
+        size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+        return {"records": len(rows), "records_per_s": len(rows) / elapsed,
+                "mb_per_s": size / elapsed / 1e6}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_query(n, capacity, steps=64):
+    """latencia de consultas sobre un store/log con `steps` muestras por dispositivo."""
+    tmp = tempfile.mkdtemp(prefix="suite-query-")
+    try:
+        svc = IngestionService(store=TelemetryStore(capacity=capacity, max_devices=max(n, 16)),
+                               log=TimeSeriesLog(tmp), record=False)
+        sim = FleetSimulator(n, seed=3, incident_rate=20.0)
+        for _ in range(steps):
+            cols = sim.step(5.0)
+            svc.store.append_many(sim.device_ids, cols)
+            for device_id, rec in zip(sim.device_ids, sim.records(cols)):
+                svc.log.append(device_id, rec)
+        svc.log.flush()
+        rng = np.random.default_rng(0)
+        since = sim.t - 60.0
+        devs = [sim.device_ids[i] for i in rng.integers(0, n, 200)]
+        it = iter(devs * 10)
+        window = _timed(lambda: svc.store.window(next(it), since), 1000)
+        it = iter(devs)
+        read = _timed(lambda: svc.log.read(next(it), since), min(200, len(devs)))
+        it = iter(devs)
+        history = _timed(lambda: svc.history(next(it), max_points=1500), min(50, len(devs)))
+        alerts = _timed(lambda: svc.alerts.evaluate(svc.store, sim.t), 20)
+        latest = _timed(svc.latest_per_device, 5)
+        svc.log.close()
+        ms = 1000.0
+        return {
+            "store_window_p50_ms": _pct(window, 50) * ms, "store_window_p99_ms": _pct(window, 99) * ms,
+            "log_read_p50_ms": _pct(read, 50) * ms, "log_read_p99_ms": _pct(read, 99) * ms,
+            "history_first_p50_ms": _pct(history, 50) * ms,
+            "alerts_eval_p50_ms": _pct(alerts, 50) * ms,
+            "latest_per_device_ms": _pct(latest, 50) * ms,
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_render(n, capacity, reruns=10):
+    """ms por rerun completo del dashboard en modo LoRa con un paquete nuevo por rerun."""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+    import utils.ingest as ingest
+
+    tmp = tempfile.mkdtemp(prefix="suite-render-")
+    try:
+        svc = IngestionService(store=TelemetryStore(capacity=capacity, max_devices=max(n, 16)),
+                               log=TimeSeriesLog(tmp), record=False)
+        sim = FleetSimulator(n, seed=4)
+        svc.ingest_batch(sim.uplinks(sim.step(5.0)))
+        svc.drain()
+        ingest._SERVICE = svc
+        st.cache_resource.clear()
+        at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+        at.run()
+        at.sidebar.radio[0].set_value("LoRaWAN (Misión Real)").run()
+        times = []
+        for _ in range(reruns):
+            svc.ingest_batch(sim.uplinks(sim.step(5.0))[-BATCH:])
+            svc.drain()  # sin el tick en marcha nada entrega lo retenido
+            t = time.perf_counter()
+            at.run()
+            times.append(time.perf_counter() - t)
+        svc.stop()
+        svc.log.close()
+        return {"rerun_p50_ms": _pct(times, 50) * 1000, "rerun_max_ms": max(times) * 1000}
+    finally:
+        ingest._SERVICE = None
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="benchmark de punta a punta con la flota simulada")
+    ap.add_argument("--devices", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    ap.add_argument("--uplinks", type=int, default=20000, help="uplinks por medición de ingesta")
+    ap.add_argument("--capacity", type=int, default=64, help="registros por dispositivo en memoria")
+    ap.add_argument("--no-render", action="store_true", help="omite la medición del dashboard")
+    ap.add_argument("--out", default=os.path.join(ROOT, "bench", "results", "suite.jsonl"))
+    args = ap.parse_args(argv)
+    os.environ.setdefault("LORA_BACKEND", "webhook")  # el dashboard no abre MQTT
+
+    results = {}
+    for n in args.devices:
+        target = max(args.uplinks, n)
+        r = {
+            "ingest_json": bench_ingest(n, target, args.capacity, binary=False),
+            "ingest_binary": bench_ingest(n, target, args.capacity, binary=True),
+            "storage": bench_storage(n, target),
+            "query": bench_query(n, args.capacity),
+        }
+        if not args.no_render:
+            r["render"] = bench_render(n, args.capacity)
+        results[str(n)] = r
+        print("%6d disp.  ingesta %7.0f/s (binario %7.0f/s, %d retenidos al final)  log %7.0f reg/s  "
+              "window p99 %.3f ms  alertas %.2f ms%s" % (
+                  n, r["ingest_json"]["uplinks_per_s"], r["ingest_binary"]["uplinks_per_s"],
+                  r["ingest_json"]["held_at_end"],
+                  r["storage"]["records_per_s"], r["query"]["store_window_p99_ms"],
+                  r["query"]["alerts_eval_p50_ms"],
+                  "" if "render" not in r else "  rerun %.1f ms" % r["render"]["rerun_p50_ms"]))
+
+    run = {
+        "timestamp": time.time(),
+        "git_rev": _git_rev(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k != "out"},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+    print("resultados agregados a", args.out)
+    return run
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# bench/load_receiver.py
+"""
+Prueba de carga del receptor webhook (receiver.py).
+
+Envía uplinks TTN v3 sintéticos con varias corrutinas concurrentes y reporta
+latencia p50/p99, peticiones/s y respuestas 503 (contrapresión).
+
+Uso:
+    python -m bench.load_receiver                      # en proceso (ASGI)
+    python -m bench.load_receiver --url http://localhost:8000
+    python -m bench.load_receiver --requests 5000 --concurrency 64 --batch 10
+    python -m bench.load_receiver --binary   # solo frm_payload (utils/codec.py)
+
+Requiere httpx.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("load_receiver requiere httpx (pip install httpx)")
+
+from utils.codec import encode_b64
+
+
+def make_uplink(device_id, f_cnt, binary=False):
+    """
+    Uplink TTN v3 mínimo: frm_payload con un frame real (utils/codec.py) y,
+    salvo binary=True, también decoded_payload como si hubiera formatter.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    values = {
+        "temperature": round(36 + random.uniform(-1, 2), 1),
+        "heart_rate": random.randint(55, 120),
+        "smoke": random.randint(0, 30),
+        "movement": random.randint(0, 10),
+        "battery": random.randint(20, 100),
+        "lat": -2.146 + random.uniform(-0.01, 0.01),
+        "lon": -79.964 + random.uniform(-0.01, 0.01),
+    }
+    up = {
+        "end_device_ids": {
+            "device_id": device_id,
+            "application_ids": {"application_id": "pulsera-guardian"},
+            "dev_eui": "70B3D57ED0%06X" % (hash(device_id) & 0xFFFFFF),
+        },
+        "received_at": now,
+        "uplink_message": {
+            "f_port": 1,
+            "f_cnt": f_cnt,
+            "frm_payload": encode_b64(values),
+            "rx_metadata": [{"gateway_ids": {"gateway_id": "gw-1"}, "rssi": -90, "snr": 7.5}],
+            "received_at": now,
+        },
+    }
+    if not binary:
+        up["uplink_message"]["decoded_payload"] = values
+    return up
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+async def run(client, n_requests, concurrency, batch, n_devices, binary=False):
+    latencies, status = [], {}
+    counter = iter(range(n_requests))
+
+    async def worker():
+        for i in counter:
+            items = [make_uplink("pulsera-%04d" % ((i * batch + j) % n_devices), i, binary)
+                     for j in range(batch)]
+            body = items if batch > 1 else items[0]
+            t = time.perf_counter()
+            r = await client.post("/ttn/uplink", json=body)
+            latencies.append(time.perf_counter() - t)
+            status[r.status_code] = status.get(r.status_code, 0) + 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    return {
+        "requests": n_requests,
+        "uplinks": n_requests * batch,
+        "elapsed_s": elapsed,
+        "rps": n_requests / elapsed,
+        "uplinks_per_s": n_requests * batch / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "status": status,
+    }
+
+
+async def main_async(args):
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+            return await run(client, args.requests, args.concurrency, args.batch, args.devices, args.binary)
+
+    # en proceso: log, grabación y métricas en un directorio temporal y lifespan manual
+    os.environ.setdefault("LORA_BACKEND", "webhook")
+    tmp = tempfile.mkdtemp(prefix="receiver-bench-")
+    os.environ["LOG_DIR"] = os.path.join(tmp, "tslog")
+    os.environ["RECORDER_DIR"] = os.path.join(tmp, "recordings")
+    os.environ["METRICS_DIR"] = os.path.join(tmp, "metrics")
+    import receiver
+
+    async with receiver.app.router.lifespan_context(receiver.app):
+        transport = httpx.ASGITransport(app=receiver.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run(client, args.requests, args.concurrency, args.batch, args.devices, args.binary)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--url", help="URL del receptor; si se omite se prueba en proceso")
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--batch", type=int, default=1, help="uplinks por petición")
+    ap.add_argument("--devices", type=int, default=100)
+    ap.add_argument("--binary", action="store_true", help="sin decoded_payload (decodifica el receptor)")
+    args = ap.parse_args(argv)
+    res = asyncio.run(main_async(args))
+    print("peticiones: %(requests)d  uplinks: %(uplinks)d  en %(elapsed_s).2f s" % res)
+    print("req/s: %(rps).0f  uplinks/s: %(uplinks_per_s).0f" % res)
+    print("latencia p50: %(p50_ms).2f ms  p99: %(p99_ms).2f ms" % res)
+    print("códigos HTTP:", res["status"])
+    return res
+
+
+if __name__ == "__main__":
+    main()
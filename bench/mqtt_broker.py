@@ -0,0 +1,192 @@
+# bench/mqtt_broker.py
+"""
+Broker MQTT 3.1.1 mínimo, en proceso, para probar el cliente de ingesta
+(utils/mqtt_ingest.py) sin un broker real.
+
+Soporta CONNECT, SUBSCRIBE (comodines + y #, y $share/<grupo>/<filtro> con
+reparto round-robin), PUBLISH con QoS 0 y 1 (PUBACK al publicador; a los
+suscriptores se entrega con QoS min(pub, sub) sin reintentos), PINGREQ y
+DISCONNECT. No guarda sesiones ni mensajes retenidos: lo que está en vuelo
+cuando se corta una conexión se pierde, como con clean_session.
+
+    broker = MiniBroker().start()      # hilo propio con su event loop
+    ... conectar clientes a ("127.0.0.1", broker.port) ...
+    broker.kick()                      # corta todas las conexiones
+    broker.stop()
+"""
+
+import asyncio
+import itertools
+import struct
+import threading
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(filt, topic):
+    """True si el topic coincide con el filtro (comodines + y #)."""
+    fparts, tparts = filt.split("/"), topic.split("/")
+    for i, f in enumerate(fparts):
+        if f == "#":
+            return True
+        if i >= len(tparts) or (f != "+" and f != tparts[i]):
+            return False
+    return len(fparts) == len(tparts)
+
+
+def _packet(ptype, body, flags=0):
+    n, rem = len(body), bytearray()
+    while True:
+        n, digit = n // 128, n % 128
+        rem.append(digit | (0x80 if n else 0))
+        if not n:
+            break
+    return bytes([(ptype << 4) | flags]) + bytes(rem) + body
+
+
+def _string(data, pos):
+    (n,) = struct.unpack_from("!H", data, pos)
+    return data[pos + 2:pos + 2 + n].decode("utf-8"), pos + 2 + n
+
+
+class _Session:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.ids = itertools.cycle(range(1, 65536))
+
+
+class MiniBroker:
+    """Broker de prueba (ver docstring del módulo)."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.published = 0
+        self.delivered = 0
+        self._subs = []        # (filtro, qos, sesión) sin grupo
+        self._shared = {}      # (grupo, filtro) -> [[(qos, sesión)], contador]
+        self._sessions = set()
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    # ---- ciclo de vida (desde otro hilo) ----
+    def start(self):
+        threading.Thread(target=self._run, name="mini-broker", daemon=True).start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def kick(self):
+        """Cierra todas las conexiones de clientes (simula una caída del broker)."""
+        def _close():
+            for s in list(self._sessions):
+                s.writer.close()
+        self._loop.call_soon_threadsafe(_close)
+
+    def stop(self):
+        self.kick()
+        self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # ---- protocolo ----
+    async def _read_packet(self, reader):
+        head = await reader.readexactly(1)
+        mult, length = 1, 0
+        while True:
+            (b,) = await reader.readexactly(1)
+            length += (b & 0x7F) * mult
+            if not b & 0x80:
+                break
+            mult *= 128
+        body = await reader.readexactly(length) if length else b""
+        return head[0] >> 4, head[0] & 0x0F, body
+
+    async def _handle(self, reader, writer):
+        s = _Session(reader, writer)
+        self._sessions.add(s)
+        try:
+            while True:
+                ptype, flags, body = await self._read_packet(reader)
+                if ptype == CONNECT:
+                    _, pos = _string(body, 0)          # nombre del protocolo
+                    pos += 4                           # nivel, flags, keepalive
+                    s.client_id, _ = _string(body, pos)
+                    writer.write(_packet(CONNACK, b"\x00\x00"))
+                elif ptype == SUBSCRIBE:
+                    (pid,) = struct.unpack_from("!H", body, 0)
+                    pos, granted = 2, bytearray()
+                    while pos < len(body):
+                        filt, pos = _string(body, pos)
+                        qos = min(body[pos] & 0x03, 1)
+                        pos += 1
+                        self._subscribe(s, filt, qos)
+                        granted.append(qos)
+                    writer.write(_packet(SUBACK, struct.pack("!H", pid) + bytes(granted)))
+                elif ptype == UNSUBSCRIBE:
+                    (pid,) = struct.unpack_from("!H", body, 0)
+                    writer.write(_packet(UNSUBACK, struct.pack("!H", pid)))
+                elif ptype == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic, pos = _string(body, 0)
+                    if qos:
+                        (pid,) = struct.unpack_from("!H", body, pos)
+                        pos += 2
+                        writer.write(_packet(PUBACK, struct.pack("!H", pid)))
+                    self.published += 1
+                    await self._route(topic, body[pos:], qos)
+                elif ptype == PINGREQ:
+                    writer.write(_packet(PINGRESP, b""))
+                elif ptype == DISCONNECT:
+                    break
+                # PUBACK de los suscriptores: sin reintentos, se ignora
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._drop(s)
+            writer.close()
+
+    def _subscribe(self, s, filt, qos):
+        if filt.startswith("$share/"):
+            _, group, real = filt.split("/", 2)
+            members = self._shared.setdefault((group, real), [[], 0])[0]
+            members.append((qos, s))
+        else:
+            self._subs.append((filt, qos, s))
+
+    def _drop(self, s):
+        self._sessions.discard(s)
+        self._subs = [sub for sub in self._subs if sub[2] is not s]
+        for entry in self._shared.values():
+            entry[0] = [m for m in entry[0] if m[1] is not s]
+
+    async def _route(self, topic, payload, qos):
+        targets = [(q, s) for filt, q, s in self._subs if topic_matches(filt, topic)]
+        for (group, filt), entry in self._shared.items():
+            members = entry[0]
+            if members and topic_matches(filt, topic):
+                targets.append(members[entry[1] % len(members)])
+                entry[1] += 1
+        for sub_qos, s in targets:
+            q = min(qos, sub_qos)
+            head = struct.pack("!H", len(topic.encode("utf-8"))) + topic.encode("utf-8")
+            if q:
+                head += struct.pack("!H", next(s.ids))
+            s.writer.write(_packet(PUBLISH, head + payload, flags=q << 1))
+            self.delivered += 1
+            try:
+                await s.writer.drain()  # contrapresión: un suscriptor lento frena al publicador
+            except ConnectionError:
+                pass
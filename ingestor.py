@@ -0,0 +1,50 @@
+# ingestor.py
+"""
+Servicio de ingesta sin interfaz: cliente MQTT (utils/mqtt_ingest.py),
+deduplicación, log, grabación y tick de alertas, sin importar Streamlit ni las
+librerías de gráficos.
+
+Con varios workers de dashboard (autoescalado) la conexión MQTT la mantiene un
+solo proceso, este; los dashboards se lanzan con LORA_BACKEND=log y siguen el
+log que escribe (igual que con el receptor webhook), así un worker nuevo
+arranca sin conectarse al broker ni abrir el log como escritor.
+
+Ejecutar:
+    LORA_BACKEND=mqtt MQTT_HOST=broker python ingestor.py
+    LORA_BACKEND=log streamlit run app.py
+
+SIGTERM o SIGINT detienen el cliente y vuelcan el log y la grabación.
+"""
+
+import os
+import signal
+import sys
+import threading
+
+from utils.ingest import get_service
+from utils.metrics import REGISTRY
+
+
+def main():
+    if "METRICS_PROCESS" not in os.environ:
+        REGISTRY.process = "ingestor"
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    svc = get_service().start()
+    if svc.mqtt_client is None:
+        if os.environ.get("LORA_BACKEND", "mqtt").lower() == "mqtt" and not svc.log.writing:
+            print("Otro proceso ya escribe en %s: nada que ingestar." % svc.log.directory)
+        else:
+            print("Sin cliente MQTT (LORA_BACKEND=mqtt y paho-mqtt instalado): nada que ingestar.")
+        svc.stop()
+        return 1
+    print("Ingesta MQTT en marcha; log en", svc.log.directory)
+    stop.wait()
+    svc.stop()
+    svc.log.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
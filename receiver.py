@@ -0,0 +1,164 @@
+# receiver.py
+"""
+Receptor webhook de TTN v3 (FastAPI + asyncio).
+
+El endpoint solo valida la forma del cuerpo (un uplink o una lista de uplinks)
+y los encola; una tarea en segundo plano vacía la cola en micro-lotes y los
+procesa en un hilo con utils.ttn.ingest_batch (normalización + STORE + LOG),
+fuera del event loop.
+
+Si la cola no tiene espacio para la petición completa se responde 503 con
+Retry-After (contrapresión explícita) en lugar de aceptar y perder datos.
+
+Ejecutar:
+    LORA_BACKEND=webhook uvicorn receiver:app --host 0.0.0.0 --port 8000
+
+GET /metrics expone las métricas en formato Prometheus: las de este proceso
+y las que vuelcan los demás (p. ej. el dashboard) en METRICS_DIR; ver
+utils/metrics.py. Con PROFILER_ENDPOINTS=1 se habilita el perfilador por
+muestreo en caliente:
+    POST /debug/profiler/start | /debug/profiler/stop   (todos los procesos)
+    GET  /debug/profiler          pilas colapsadas de este proceso
+
+CONFIGURACIÓN (variables de entorno):
+- RECEIVER_QUEUE_MAX   (10000)  uplinks en espera como máximo
+- RECEIVER_BATCH_MAX   (500)    uplinks por micro-lote
+- RECEIVER_BATCH_WAIT  (0.02)   segundos que se espera para juntar un lote
+- METRICS_DIR          (data/metrics)  volcados de métricas entre procesos
+"""
+
+import asyncio
+import contextlib
+import os
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from utils import metrics, ttn
+from utils.ingest import get_service
+from utils.metrics import PROFILER, REGISTRY
+
+QUEUE_MAX = int(os.environ.get("RECEIVER_QUEUE_MAX", "10000"))
+BATCH_MAX = int(os.environ.get("RECEIVER_BATCH_MAX", "500"))
+BATCH_WAIT_S = float(os.environ.get("RECEIVER_BATCH_WAIT", "0.02"))
+PROFILER_ENDPOINTS = os.environ.get("PROFILER_ENDPOINTS", "0") == "1"
+
+if "METRICS_PROCESS" not in os.environ:
+    REGISTRY.process = "receiver"
+RECEIVED = REGISTRY.counter("receiver_uplinks_received_total", "Uplinks aceptados por el webhook")
+REJECTED = REGISTRY.counter("receiver_rejected_total", "Peticiones rechazadas", ("reason",))
+QUEUE_DEPTH = REGISTRY.gauge("receiver_queue_depth", "Uplinks en la cola de ingesta")
+REQUEST_SECONDS = REGISTRY.histogram("receiver_request_seconds", "Duración de POST /ttn/uplink")
+BATCH_ERRORS = REGISTRY.counter("receiver_batch_errors_total", "Micro-lotes que fallaron al ingestar")
+
+
+async def _drain(queue):
+    """Consume la cola en micro-lotes y los escribe fuera del event loop."""
+    while True:
+        batch = [await queue.get()]
+        if queue.qsize() < BATCH_MAX:
+            # dejar que se acumulen algunos uplinks más antes de escribir
+            await asyncio.sleep(BATCH_WAIT_S)
+        while len(batch) < BATCH_MAX and not queue.empty():
+            batch.append(queue.get_nowait())
+        QUEUE_DEPTH.set(queue.qsize())
+        try:
+            await asyncio.to_thread(ttn.ingest_batch, batch)
+        except Exception as e:
+            # un lote fallido no puede terminar la única tarea que vacía la cola
+            BATCH_ERRORS.inc()
+            print("Error ingesting batch:", e)
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    svc = get_service()
+    if not svc.log.acquire_writer():
+        # un segundo receptor no puede ingestar: fallar al arrancar, no en cada lote
+        raise RuntimeError("otro proceso ya escribe en %s (un solo receptor o ingestor por LOG_DIR)"
+                           % svc.log.directory)
+    svc.start(ingest_mqtt=False)  # tick de alertas sobre lo que se ingesta aquí
+    app.state.queue = asyncio.Queue(maxsize=QUEUE_MAX)
+    task = asyncio.create_task(_drain(app.state.queue))
+    try:
+        yield
+    finally:
+        # procesar lo pendiente antes de salir
+        await app.state.queue.join()
+        task.cancel()
+        get_service().log.flush()
+
+
+app = FastAPI(title="Pulsera Guardián - receptor TTN", lifespan=lifespan)
+
+
+@app.post("/ttn/uplink", status_code=202)
+async def ttn_uplink(request: Request):
+    """Acepta un uplink TTN v3 (objeto JSON) o un lote (lista de objetos)."""
+    with REQUEST_SECONDS.time():
+        try:
+            body = await request.json()
+        except ValueError:
+            REJECTED.inc(reason="bad_json")
+            raise HTTPException(status_code=400, detail="JSON inválido")
+        items = body if isinstance(body, list) else [body]
+        if not items or not all(isinstance(it, dict) for it in items):
+            REJECTED.inc(reason="bad_shape")
+            raise HTTPException(status_code=422, detail="se esperaba un objeto o una lista de objetos")
+
+        queue = request.app.state.queue
+        if queue.maxsize - queue.qsize() < len(items):
+            REJECTED.inc(reason="queue_full")
+            raise HTTPException(status_code=503, detail="cola llena", headers={"Retry-After": "1"})
+        for it in items:
+            queue.put_nowait(it)
+        RECEIVED.inc(len(items))
+        QUEUE_DEPTH.set(queue.qsize())
+        return {"accepted": len(items)}
+
+
+@app.get("/health")
+async def health(request: Request):
+    queue = request.app.state.queue
+    return {"status": "ok", "queue_depth": queue.qsize(), "queue_max": queue.maxsize}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(request: Request):
+    """Métricas en formato de texto de Prometheus (este proceso + volcados recientes)."""
+    QUEUE_DEPTH.set(request.app.state.queue.qsize())
+    others = await asyncio.to_thread(REGISTRY.collect)
+    return PlainTextResponse(REGISTRY.render(others), media_type="text/plain; version=0.0.4")
+
+
+def _require_profiler():
+    if not PROFILER_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="perfilador deshabilitado (PROFILER_ENDPOINTS=1)")
+
+
+@app.post("/debug/profiler/{action}")
+async def profiler_toggle(action: str):
+    """Activa o detiene el perfilador aquí y, vía METRICS_DIR/profile.on, en los demás procesos."""
+    _require_profiler()
+    flag = os.path.join(os.environ.get("METRICS_DIR", metrics.DEFAULT_METRICS_DIR), metrics.PROFILE_FLAG)
+    if action == "start":
+        os.makedirs(os.path.dirname(flag), exist_ok=True)
+        open(flag, "w").close()
+        PROFILER.start()
+    elif action == "stop":
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(flag)
+        PROFILER.stop()
+    else:
+        raise HTTPException(status_code=404, detail="acción desconocida: %s" % action)
+    return {"running": PROFILER.running, "samples": PROFILER.samples}
+
+
+@app.get("/debug/profiler", response_class=PlainTextResponse)
+async def profiler_dump(limit: int = 200):
+    """Pilas colapsadas de este proceso (flamegraph.pl / speedscope)."""
+    _require_profiler()
+    return PlainTextResponse(PROFILER.collapsed(limit))
@@ -0,0 +1,64 @@
+# tests/dedup_scenarios.py
+"""
+Escenarios de deduplicación y reordenamiento (utils/dedup.py), compartidos
+por tests/test_dedup.py y bench/bench_dedup.py.
+
+run() ejecuta los escenarios en orden (varios comparten el estado de un mismo
+buffer) y devuelve [(nombre, obtenido, esperado)].
+"""
+
+from utils.dedup import FCNT_MOD, UplinkDeduplicator
+from utils.fleet import make_uplink
+from utils.ttn import parse_uplink
+
+
+def push(dedup, raws, now=0.0):
+    """f_cnt de los paquetes que entrega dedup.push() para los uplinks crudos."""
+    return [out["f_cnt"] for out in dedup.push([(raw, parse_uplink(raw)) for raw in raws], now=now)]
+
+
+def run():
+    up = make_uplink
+    out = []
+
+    # merge=0: los escenarios de orden sin la espera para unir gateways
+    d = UplinkDeduplicator(window=16, merge=0, hold=2.0)
+    out.append(("en orden", push(d, [up("a", i) for i in range(1, 4)]), [1, 2, 3]))
+    out.append(("duplicado ya guardado", push(d, [up("a", 3, gateway="gw-2", rssi=-70)]), []))
+    out.append(("desorden (5 antes que 4)", push(d, [up("a", 5), up("a", 4)]), [4, 5]))
+    out.append(("hueco retenido", push(d, [up("a", 7)], now=10.0), []))
+    out.append(("hueco vencido", [o["f_cnt"] for o in d.release(now=12.5)], [7]))
+    out.append(("tardío (6 después de 7)", push(d, [up("a", 6)], now=13.0), []))
+    out.append(("0 tardío no es reinicio", push(d, [up("a", 0, "r0")], now=14.0), []))
+    out.append(("reinicio tras un hueco > ventana",
+                push(d, [up("a", 40), up("a", 0, "r0"), up("a", 1, "r1")], now=15.0), [40, 0, 1]))
+
+    d = UplinkDeduplicator(window=16, merge=0)
+    got = [push(d, [up("z", 1)]), push(d, [up("z", 0)]), push(d, [up("z", 1)])]
+    out.append(("1, 0 tardío, reentrega de 1", got, [[1], [], []]))
+
+    d = UplinkDeduplicator(window=16, merge=0.5)
+    got = push(d, [up("g", 1), up("g", 1, gateway="gw-2", rssi=-70, snr=9.0)], now=0.0)
+    rel = d.release(now=0.6)
+    out.append(("duplicado multi-gateway (unión)",
+                (got, [o["f_cnt"] for o in rel], len(rel[0]["gateways"]), rel[0]["rssi"], rel[0]["snr"]),
+                ([], [1], 2, -70, 9.0)))
+    out.append(("duplicado después de guardado", push(d, [up("g", 1, gateway="gw-3", rssi=-50)], now=0.7), []))
+    out.append(("lo guardado no cambia", len(rel[0]["gateways"]), 2))
+
+    d = UplinkDeduplicator(window=16, merge=0)
+    push(d, [up("b", i) for i in range(1, 4)])
+    out.append(("reinicio temprano (otra huella)", push(d, [up("b", 1, "otro"), up("b", 2, "otro")]), [1, 2]))
+    out.append(("reentrega de antes del reinicio", push(d, [up("b", 3)]), []))
+
+    d = UplinkDeduplicator(window=16, merge=0)
+    top = FCNT_MOD - 1
+    out.append(("desborde 32 bits", push(d, [up("c", top - 1), up("c", top), up("c", 0, "w")]),
+                [top - 1, top, 0]))
+    out.append(("duplicado tras el desborde", push(d, [up("c", top)]), []))
+
+    d = UplinkDeduplicator(window=16, merge=0)
+    out.append(("desborde 16 bits", push(d, [up("e", 65534), up("e", 65535), up("e", 0, "w")]),
+                [65534, 65535, 0]))
+    out.append(("viejo fuera de la ventana", push(d, [up("e", 65500)]), []))
+    return out
@@ -0,0 +1,84 @@
+# tests/test_dedup.py
+"""Deduplicación y reordenamiento de uplinks (utils/dedup.py)."""
+
+import pytest
+
+from tests.dedup_scenarios import push, run
+from utils.dedup import FCNT_MOD, UplinkDeduplicator
+from utils.fleet import make_uplink
+
+SCENARIOS = run()
+
+
+@pytest.mark.parametrize("name, got, want", SCENARIOS, ids=[s[0] for s in SCENARIOS])
+def test_scenario(name, got, want):
+    assert got == want
+
+
+def test_in_order_and_reordered():
+    d = UplinkDeduplicator(window=16, merge=0)
+    assert push(d, [make_uplink("a", 1), make_uplink("a", 3), make_uplink("a", 2)]) == [1, 2, 3]
+
+
+def test_gap_released_after_hold():
+    d = UplinkDeduplicator(window=16, merge=0, hold=2.0)
+    assert push(d, [make_uplink("a", 1)], now=0.0) == [1]
+    assert push(d, [make_uplink("a", 3)], now=1.0) == []
+    assert d.release(now=2.5) == []
+    assert [o["f_cnt"] for o in d.release(now=3.0)] == [3]
+    assert push(d, [make_uplink("a", 2)], now=3.5) == []  # tardío
+
+
+def test_gateways_merged_before_release():
+    d = UplinkDeduplicator(window=16, merge=0.2)
+    assert push(d, [make_uplink("a", 1, rssi=-110)], now=0.0) == []
+    assert push(d, [make_uplink("a", 1, gateway="gw-2", rssi=-80)], now=0.1) == []
+    out = d.release(now=0.2)
+    assert [o["f_cnt"] for o in out] == [1]
+    assert sorted(g["gateway_id"] for g in out[0]["gateways"]) == ["gw-1", "gw-2"]
+    assert out[0]["rssi"] == -80
+    # un duplicado que llega después de guardado no toca el paquete publicado
+    assert push(d, [make_uplink("a", 1, gateway="gw-3", rssi=-50)], now=0.3) == []
+    assert len(out[0]["gateways"]) == 2 and out[0]["rssi"] == -80
+
+
+def test_late_zero_is_not_a_reset():
+    d = UplinkDeduplicator(window=16, merge=0)
+    assert push(d, [make_uplink("a", 1)]) == [1]
+    assert push(d, [make_uplink("a", 0)]) == []
+    assert push(d, [make_uplink("a", 1)]) == []
+
+
+def test_reset_after_long_gap():
+    d = UplinkDeduplicator(window=16, merge=0)
+    assert push(d, [make_uplink("a", 100)]) == [100]
+    assert push(d, [make_uplink("a", 0, "r0"), make_uplink("a", 1, "r1")]) == [0, 1]
+
+
+def test_reset_with_other_fingerprint_keeps_old_ring():
+    d = UplinkDeduplicator(window=16, merge=0)
+    assert push(d, [make_uplink("a", i) for i in range(1, 4)]) == [1, 2, 3]
+    assert push(d, [make_uplink("a", 1, "nuevo")]) == [1]
+    assert push(d, [make_uplink("a", 3)]) == []  # reentrega de antes del reinicio
+
+
+def test_rollover_32_bits():
+    d = UplinkDeduplicator(window=16, merge=0)
+    top = FCNT_MOD - 1
+    assert push(d, [make_uplink("a", top), make_uplink("a", 0, "w"), make_uplink("a", 1, "w")]) == [top, 0, 1]
+    assert push(d, [make_uplink("a", top)]) == []
+
+
+def test_rollover_16_bits():
+    d = UplinkDeduplicator(window=16, merge=0)
+    assert push(d, [make_uplink("a", 65535), make_uplink("a", 0, "w")]) == [65535, 0]
+    assert push(d, [make_uplink("a", 65520)]) == []
+
+
+def test_max_held_releases_oldest_only():
+    d = UplinkDeduplicator(window=64, merge=0, hold=10.0, max_held=4)
+    assert push(d, [make_uplink("a", 1)]) == [1]
+    assert push(d, [make_uplink("a", i) for i in (3, 5, 7, 9, 11)]) == [3]
+    assert d.pending == 4
+    assert push(d, [make_uplink("a", 2)]) == []  # el hueco ya se dio por perdido
+    assert push(d, [make_uplink("a", 4)]) == [4, 5]
@@ -0,0 +1,19 @@
+# tests/test_startup.py
+"""
+Importar los puntos de entrada no carga módulos pesados, ni lanza hilos ni
+crea archivos, y no tarda más que su presupuesto.
+"""
+
+import pytest
+
+from bench.bench_startup import main
+
+# ms de import por punto de entrada: ~4x lo medido (dashboard ~400 ms,
+# ingestor ~100 ms, receiver ~350 ms); una regresión de arranque (un import
+# pesado que vuelve al nivel superior) los supera
+BUDGET_MS = {"dashboard": 1600, "ingestor": 400, "receiver": 1400}
+
+
+@pytest.mark.parametrize("entry", sorted(BUDGET_MS))
+def test_entry_point_import(entry):
+    assert main(["--repeat", "2", "--max-ms", str(BUDGET_MS[entry]), entry]) == 0
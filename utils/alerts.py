@@ -0,0 +1,239 @@
+# utils/alerts.py
+"""
+Motor de alertas en streaming para toda la flota.
+
+Las reglas son declarativas (dicts o Rule) y se evalúan en cada tick sobre
+todos los dispositivos del TelemetryStore con una pasada NumPy por regla:
+
+    {"name": "hr_high", "field": "heart_rate", "op": ">=", "value": 150,
+     "stat": "mean", "window_s": 60,    # estadístico en ventana móvil
+     "clear": 140,                      # histéresis: se apaga por debajo de 140
+     "for_s": 10,                       # debounce: debe sostenerse 10 s
+     "level": "warning", "message": "⚠ RITMO CARDIACO ANÓMALO"}
+
+stat: "last" (último valor), "mean", "var", "std", "min" o "max" sobre los
+últimos window_s segundos. Cada cambio de estado (raised/cleared) se agrega a
+AlertEngine.events, una cola acotada que lee el dashboard.
+
+Las geocercas (utils/geo.py) se evalúan en el mismo tick sobre la última
+posición de cada dispositivo y generan reglas "geofence:<nombre>". Un frame
+sin fix GPS (lat/lon NaN) no cambia el estado de las geocercas.
+"""
+
+import json
+import os
+import threading
+import time
+import warnings
+from collections import deque, namedtuple
+
+import numpy as np
+
+_OPS = {
+    ">=": np.greater_equal,
+    ">": np.greater,
+    "<=": np.less_equal,
+    "<": np.less,
+}
+_STATS = {
+    "mean": np.nanmean,
+    "var": np.nanvar,
+    "std": np.nanstd,
+    "min": np.nanmin,
+    "max": np.nanmax,
+}
+
+# Transición de estado de una alerta
+AlertEvent = namedtuple("AlertEvent", ["timestamp", "device_id", "rule", "state", "level", "message", "value"])
+
+
+class Rule:
+    """Regla declarativa (ver docstring del módulo)."""
+
+    def __init__(self, name, field, op, value, stat="last", window_s=None, clear=None,
+                 for_s=0.0, level="warning", message=None):
+        if op not in _OPS:
+            raise ValueError("operador no soportado: %r" % op)
+        if stat != "last" and stat not in _STATS:
+            raise ValueError("estadístico no soportado: %r" % stat)
+        if stat != "last" and not window_s:
+            raise ValueError("la regla %r necesita window_s" % name)
+        self.name = name
+        self.field = field
+        self.op = op
+        self.value = float(value)
+        self.stat = stat
+        self.window_s = window_s
+        self.clear = self.value if clear is None else float(clear)
+        self.for_s = float(for_s)
+        self.level = level
+        self.message = message or name
+
+    def check(self, value):
+        """Evaluación instantánea de un valor suelto (sin ventana ni estado)."""
+        try:
+            return bool(_OPS[self.op](float(value), self.value))
+        except (TypeError, ValueError):
+            return False
+
+
+# Las mismas condiciones que evaluaba app.py sobre la muestra mostrada
+DEFAULT_RULES = (
+    {"name": "temp_high", "field": "temperature", "op": ">=", "value": 50,
+     "level": "danger", "message": "🔥 ADVERTENCIA: TEMPERATURA EXTREMADAMENTE ALTA"},
+    {"name": "smoke_high", "field": "smoke", "op": ">=", "value": 70,
+     "level": "danger", "message": "☣ ALERTA: NIVELES ALTOS DE AGENTES TÓXICOS"},
+    {"name": "hr_high", "field": "heart_rate", "op": ">=", "value": 150,
+     "level": "warning", "message": "⚠ RITMO CARDIACO ANÓMALO"},
+    {"name": "hr_low", "field": "heart_rate", "op": "<=", "value": 40,
+     "level": "warning", "message": "⚠ RITMO CARDIACO ANÓMALO"},
+    {"name": "immobile", "field": "movement", "op": "<=", "value": 1,
+     "level": "warning", "message": "🟡 INMOVILIDAD DETECTADA"},
+)
+
+
+def load_rules():
+    """Reglas del archivo JSON indicado en ALERT_RULES_FILE (lista de dicts) o DEFAULT_RULES."""
+    path = os.environ.get("ALERT_RULES_FILE")
+    if not path:
+        return DEFAULT_RULES
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class AlertEngine:
+    """Estado de alertas por (regla, dispositivo) y cola de transiciones."""
+
+    def __init__(self, rules=DEFAULT_RULES, maxlen=1000, geofences=None):
+        self.rules = [r if isinstance(r, Rule) else Rule(**r) for r in rules]
+        # las reglas de geocerca van al final y toman sus valores de geofences.evaluate()
+        self.geofences = geofences
+        self._n_field_rules = len(self.rules)
+        if geofences is not None:
+            self.rules += [Rule(**r) for r in geofences.rules()]
+        self.events = deque(maxlen=maxlen)
+        self.version = 0  # se incrementa con cada transición
+        self._lock = threading.Lock()
+        self._ids = []
+        self._active = np.zeros((len(self.rules), 0), dtype=bool)
+        self._since = np.zeros((len(self.rules), 0))
+
+    def _sync_devices(self, ids):
+        n_old, n = len(self._ids), len(ids)
+        if n > n_old:
+            pad = n - n_old
+            self._active = np.pad(self._active, ((0, 0), (0, pad)))
+            self._since = np.pad(self._since, ((0, 0), (0, pad)), constant_values=np.nan)
+        # filas reutilizadas por otro dispositivo: empezar de cero
+        for row in range(min(n_old, n)):
+            if self._ids[row] != ids[row]:
+                self._active[:, row] = False
+                self._since[:, row] = np.nan
+        self._ids = list(ids)
+
+    def _values(self, rule, view, latest, now):
+        if rule.stat == "last":
+            return latest[rule.field].astype(np.float64)
+        col = view[rule.field].astype(np.float64)
+        col[~(view["timestamp"] >= now - rule.window_s)] = np.nan
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # filas sin muestras
+            return _STATS[rule.stat](col, axis=1)
+
+    def evaluate(self, store, now=None):
+        """Un tick: evalúa todas las reglas en todos los dispositivos."""
+        now = time.time() if now is None else now
+        ids, view, latest = store.fleet_view()
+        if not ids:
+            return []
+        fences = None
+        if len(self.rules) > self._n_field_rules:
+            fences = self.geofences.evaluate(latest["lat"], latest["lon"])
+        new_events = []
+        with self._lock:
+            if ids != self._ids:
+                self._sync_devices(ids)
+            for k, rule in enumerate(self.rules):
+                if k < self._n_field_rules:
+                    vals = self._values(rule, view, latest, now)
+                else:
+                    vals = fences[k - self._n_field_rules]
+                active = self._active[k]
+                op = _OPS[rule.op]
+                with np.errstate(invalid="ignore"):
+                    # histéresis: una alerta activa se mantiene hasta cruzar `clear`
+                    cond = np.where(active, op(vals, rule.clear), op(vals, rule.value))
+                since = self._since[k]
+                started = np.where(cond, np.where(np.isnan(since), now, since), np.nan)
+                if k >= self._n_field_rules:
+                    # sin fix GPS (NaN) la geocerca no se evalúa: se mantiene el estado
+                    hold = np.isnan(vals)
+                    cond = np.where(hold, active, cond)
+                    started = np.where(hold, since, started)
+                since[:] = started
+                # debounce: la condición debe sostenerse for_s segundos
+                new_active = cond & (active | (now - since >= rule.for_s))
+                changed = np.nonzero(new_active != active)[0]
+                for row in changed:
+                    state = "raised" if new_active[row] else "cleared"
+                    v = float(vals[row])
+                    new_events.append(AlertEvent(now, ids[row], rule.name, state, rule.level,
+                                                 rule.message, None if v != v else v))
+                self._active[k] = new_active
+            if new_events:
+                self.events.extend(new_events)
+                self.version += 1
+        return new_events
+
+    def active(self, device_id):
+        """[(mensaje, nivel)] de las alertas activas de un dispositivo."""
+        with self._lock:
+            try:
+                row = self._ids.index(device_id)
+            except ValueError:
+                return []
+            out = []
+            for k, rule in enumerate(self.rules):
+                item = (rule.message, rule.level)
+                if self._active[k, row] and item not in out:
+                    out.append(item)
+            return out
+
+    def active_mask(self):
+        """(device_ids, máscara de dispositivos con alguna alerta activa)."""
+        with self._lock:
+            return list(self._ids), self._active.any(axis=0)
+
+    def check(self, record):
+        """
+        Evaluación instantánea de un registro suelto (p. ej. el modo demo): solo
+        reglas "last", sin histéresis ni debounce. Devuelve [(mensaje, nivel)].
+        """
+        out = []
+        if not isinstance(record, dict):
+            return out
+        fences = None
+        if len(self.rules) > self._n_field_rules:
+            try:
+                fences = self.geofences.evaluate([float(record["lat"])], [float(record["lon"])])[:, 0]
+            except (KeyError, TypeError, ValueError):
+                pass
+        for k, rule in enumerate(self.rules):
+            if k >= self._n_field_rules:
+                v = None if fences is None else fences[k - self._n_field_rules]
+                if v is not None and rule.check(v) and (rule.message, rule.level) not in out:
+                    out.append((rule.message, rule.level))
+                continue
+            if rule.stat != "last":
+                continue
+            v = record.get(rule.field)
+            if isinstance(v, (int, float)) and rule.check(v):
+                item = (rule.message, rule.level)
+                if item not in out:
+                    out.append(item)
+        return out
+
+    def recent(self, n=20):
+        """Últimas n transiciones (la más nueva al final)."""
+        with self._lock:
+            return list(self.events)[-n:]
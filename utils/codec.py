@@ -0,0 +1,208 @@
+# utils/codec.py
+"""
+Codificación binaria de los frames de la pulsera (frm_payload de LoRaWAN).
+
+En lugar de un payload formatter en TTN, la pulsera envía frames compactos
+que se decodifican aquí. Cada formato (FrameCodec) es una lista de campos
+(nombre, formato struct, divisor) que se compila una sola vez en un
+struct.Struct (un frame) y en un dtype NumPy equivalente (lotes con
+np.frombuffer). Los valores se guardan como enteros: valor = entero / divisor.
+El máximo entero de cada tipo está reservado para "sin dato" (sensor ausente o
+NaN): se decodifica como NaN (o se omite del dict), no como un 0 real que
+dispararía las reglas de inmovilidad o de pulso bajo.
+
+Los formatos con `version` llevan ese número en el primer byte del frame; los
+que no, se identifican por el fPort con el que se registraron:
+
+    registry.register(FrameCodec("sensor-x", [("smoke", "H", 10)]), f_port=7)
+
+Formatos por defecto (little-endian):
+  v1 (15 bytes): versión, temperatura i16 /100, pulso u8, humo u8,
+                 movimiento u8, batería u8, lat i32 /1e7, lon i32 /1e7
+  v2 (7 bytes):  v1 sin GPS (cuando no hay fix)
+"""
+
+import base64
+import binascii
+import struct
+
+import numpy as np
+
+from utils.store import FIELDS
+
+# formato struct -> (tipo NumPy, mínimo, máximo)
+_TYPES = {
+    "b": ("i1", -2 ** 7, 2 ** 7 - 1),
+    "B": ("u1", 0, 2 ** 8 - 1),
+    "h": ("<i2", -2 ** 15, 2 ** 15 - 1),
+    "H": ("<u2", 0, 2 ** 16 - 1),
+    "i": ("<i4", -2 ** 31, 2 ** 31 - 1),
+    "I": ("<u4", 0, 2 ** 32 - 1),
+}
+
+
+class FrameCodec:
+    """Formato de frame compilado (ver docstring del módulo)."""
+
+    def __init__(self, name, fields, version=None):
+        for field, fmt, _ in fields:
+            if fmt not in _TYPES:
+                raise ValueError("formato no soportado para %r: %r" % (field, fmt))
+        self.name = name
+        self.version = version
+        self.fields = tuple((field, fmt, float(div)) for field, fmt, div in fields)
+        head = "B" if version is not None else ""
+        self.struct = struct.Struct("<" + head + "".join(fmt for _, fmt, _ in self.fields))
+        dt = [("_version", "u1")] if version is not None else []
+        dt += [(field, _TYPES[fmt][0]) for field, fmt, _ in self.fields]
+        self.dtype = np.dtype(dt)
+        self.size = self.struct.size
+        self._skip = 1 if version is not None else 0
+        # entero reservado para "sin dato": el máximo del tipo
+        self._missing = tuple(_TYPES[fmt][2] for _, fmt, _ in self.fields)
+
+    def decode(self, frame):
+        """
+        bytes -> dict {campo: valor}, sin los campos "sin dato". Lanza
+        ValueError si el largo no coincide.
+        """
+        if len(frame) != self.size:
+            raise ValueError("%s: se esperaban %d bytes, llegaron %d" % (self.name, self.size, len(frame)))
+        vals = self.struct.unpack(frame)[self._skip:]
+        return {field: v / div for (field, _, div), v, missing in zip(self.fields, vals, self._missing)
+                if v != missing}
+
+    def decode_many(self, frames):
+        """Lista de frames (todos de self.size bytes) -> dict campo -> float64 (NaN = sin dato)."""
+        arr = np.frombuffer(b"".join(frames), dtype=self.dtype)
+        return {field: np.where(arr[field] == missing, np.nan, arr[field] / div)
+                for (field, _, div), missing in zip(self.fields, self._missing)}
+
+    def encode(self, values):
+        """dict {campo: valor} -> bytes. Los faltantes o NaN se envían como "sin dato"."""
+        ints = [] if self.version is None else [self.version]
+        for field, fmt, div in self.fields:
+            v = values.get(field)
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                v = float("nan")
+            _, lo, hi = _TYPES[fmt]
+            ints.append(hi if v != v else min(hi - 1, max(lo, int(round(v * div)))))
+        return self.struct.pack(*ints)
+
+    def encode_many(self, columns, n):
+        """dict campo -> arreglo (largo n) -> lista de n frames."""
+        arr = np.zeros(n, dtype=self.dtype)
+        if self.version is not None:
+            arr["_version"] = self.version
+        for field, fmt, div in self.fields:
+            _, lo, hi = _TYPES[fmt]
+            col = columns.get(field)
+            if col is None:
+                arr[field] = hi
+                continue
+            scaled = np.asarray(col, dtype=np.float64) * div
+            arr[field] = np.where(np.isnan(scaled), hi, np.clip(np.rint(np.nan_to_num(scaled)), lo, hi - 1))
+        buf = arr.tobytes()
+        size = self.size
+        return [buf[i:i + size] for i in range(0, n * size, size)]
+
+
+PULSERA_V1 = FrameCodec("pulsera-v1", [
+    ("temperature", "h", 100),
+    ("heart_rate", "B", 1),
+    ("smoke", "B", 1),
+    ("movement", "B", 1),
+    ("battery", "B", 1),
+    ("lat", "i", 1e7),
+    ("lon", "i", 1e7),
+], version=1)
+
+PULSERA_V2 = FrameCodec("pulsera-v2", PULSERA_V1.fields[:5], version=2)
+
+
+class CodecRegistry:
+    """Formatos disponibles, por fPort (sin versión) o por byte de versión."""
+
+    def __init__(self, codecs=()):
+        self.by_port = {}
+        self.by_version = {}
+        for codec in codecs:
+            self.register(codec)
+
+    def register(self, codec, f_port=None):
+        if f_port is not None:
+            self.by_port[int(f_port)] = codec
+        elif codec.version is not None:
+            self.by_version[codec.version] = codec
+        else:
+            raise ValueError("%s: un formato sin versión necesita f_port" % codec.name)
+        return codec
+
+    def lookup(self, frame, f_port=None):
+        """Formato que corresponde al frame, o None."""
+        codec = self.by_port.get(f_port)
+        if codec is None and frame:
+            codec = self.by_version.get(frame[0])
+        if codec is None or len(frame) != codec.size:
+            return None
+        return codec
+
+    def decode(self, frame, f_port=None):
+        """bytes -> dict, o None si ningún formato registrado corresponde."""
+        codec = self.lookup(frame, f_port)
+        return None if codec is None else codec.decode(frame)
+
+    def decode_b64(self, frm_payload, f_port=None):
+        """frm_payload en base64 (como lo envía TTN) -> dict o None."""
+        try:
+            frame = base64.b64decode(frm_payload, validate=True)
+        except (binascii.Error, TypeError, ValueError):
+            return None
+        return self.decode(frame, f_port)
+
+    def _group(self, frames, f_ports):
+        groups = {}
+        for i, frame in enumerate(frames):
+            codec = self.lookup(frame, None if f_ports is None else f_ports[i])
+            if codec is not None:
+                groups.setdefault(codec, []).append(i)
+        return groups
+
+    def decode_columns(self, frames, f_ports=None):
+        """
+        Decodifica un lote: frames (bytes) y f_ports opcionales -> (columnas,
+        ok). columnas: dict campo -> float64 con NaN donde el formato no tiene
+        el campo o el frame no se reconoció; ok: máscara de frames decodificados.
+        Cada formato se decodifica en bloque con np.frombuffer.
+        """
+        n = len(frames)
+        cols = {name: np.full(n, np.nan) for name in FIELDS}
+        ok = np.zeros(n, dtype=bool)
+        for codec, idx in self._group(frames, f_ports).items():
+            for name, values in codec.decode_many([frames[i] for i in idx]).items():
+                cols[name][idx] = values
+            ok[idx] = True
+        return cols, ok
+
+    def decode_batch(self, frames, f_ports=None):
+        """Como decode_columns pero devuelve una lista de dicts (None si no se reconoció)."""
+        out = [None] * len(frames)
+        for codec, idx in self._group(frames, f_ports).items():
+            part = codec.decode_many([frames[i] for i in idx])
+            names = list(part)
+            for i, row in zip(idx, zip(*(part[name].tolist() for name in names))):
+                out[i] = {name: v for name, v in zip(names, row) if v == v}  # sin "sin dato"
+        return out
+
+
+DEFAULT_REGISTRY = CodecRegistry([PULSERA_V1, PULSERA_V2])
+
+
+def encode_b64(values, codec=None):
+    """dict -> frm_payload en base64; sin GPS usa v2 y con GPS v1 (por defecto)."""
+    if codec is None:
+        has_gps = values.get("lat") is not None and values.get("lon") is not None
+        codec = PULSERA_V1 if has_gps else PULSERA_V2
+    return base64.b64encode(codec.encode(values)).decode("ascii")
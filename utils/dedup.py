@@ -0,0 +1,296 @@
+# utils/dedup.py
+"""
+Deduplicación y reordenamiento de uplinks por (device_id, f_cnt).
+
+TTN puede entregar el mismo uplink más de una vez (varios gateways, reintentos
+QoS 1 del broker o del webhook) y los paquetes pueden llegar desordenados.
+Entre el parseo y la normalización (IngestionService.ingest_batch e
+ingest_uplink) cada paquete pasa por UplinkDeduplicator.push(), que devuelve
+los que ya se pueden guardar, en orden de f_cnt por dispositivo:
+
+ - Duplicados: cada dispositivo recuerda los últimos DEDUP_WINDOW contadores
+   en un anillo (slot f_cnt % ventana) con una huella del frame (crc32 de
+   frm_payload). Mismo contador y misma huella es un duplicado. Cada paquete
+   se retiene DEDUP_MERGE_S s antes de salir: los duplicados que llegan en
+   ese plazo (otros gateways) suman sus gateways al paquete retenido (rssi/
+   snr: el mejor) antes de que se guarde. Los que llegan después se
+   descartan sin tocar lo ya guardado (log, grabación y snapshot).
+ - Orden: el contador esperado sale al vencer su plazo de unión (con
+   DEDUP_MERGE_S=0, enseguida). Uno adelantado espera hasta DEDUP_REORDER_S
+   s a que se llene el hueco; vencido el plazo el hueco se da por perdido y
+   sale lo retenido. Los plazos los revisa release(), desde el tick del
+   servicio. Uno que llega después de que salió un contador mayor se
+   descarta (dedup_late_total): guardarlo pisaría el último paquete del
+   dispositivo con un valor viejo.
+ - Desborde y reinicio: el contador se compara con aritmética de números de
+   serie de 32 bits (2**32 - 1 -> 0 sigue en orden). Un contador repetido
+   con otra huella, o uno menor que la ventana que llega desde más lejos que
+   la ventana (reinicio del dispositivo o desborde de un contador de 16
+   bits), empieza una secuencia nueva. El 0 no es especial: dentro de la
+   ventana es un paquete tardío. El anillo de la secuencia anterior se
+   conserva para seguir descartando reentregas de antes del reinicio.
+ - Memoria acotada: el estado por dispositivo vive en un LRU de
+   DEDUP_MAX_DEVICES entradas y cada paquete cuesta O(1) (salvo ordenar lo
+   retenido de un dispositivo, a lo sumo DEDUP_MAX_HELD paquetes).
+
+Los paquetes sin f_cnt (JSON que no es de TTN) pasan sin tocar.
+
+    dedup = UplinkDeduplicator.from_env()
+    ready = dedup.push([(raw, parse_uplink(raw, topic))])   # paquetes a guardar
+    ready += dedup.release()                                # plazos vencidos (tick)
+
+CONFIGURACIÓN (variables de entorno):
+- DEDUP_ENABLED (1), DEDUP_WINDOW (64), DEDUP_MERGE_S (0.2), DEDUP_REORDER_S (2.0),
+  DEDUP_MAX_HELD (32), DEDUP_MAX_DEVICES (STORE_MAX_DEVICES o 10000)
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+from utils.metrics import REGISTRY
+
+FCNT_MOD = 1 << 32
+
+DUPLICATES = REGISTRY.counter("dedup_duplicates_total", "Uplinks duplicados descartados")
+LATE = REGISTRY.counter("dedup_late_total", "Uplinks descartados por llegar después de un f_cnt mayor")
+RESETS = REGISTRY.counter("dedup_resets_total", "Reinicios o desbordes del f_cnt de un dispositivo")
+REORDERED = REGISTRY.counter("dedup_reordered_total", "Uplinks retenidos a la espera de un f_cnt anterior")
+HELD = REGISTRY.gauge("dedup_held", "Uplinks retenidos en el buffer de reordenamiento")
+
+
+def serial_diff(a, b):
+    """a - b con aritmética de números de serie de 32 bits (RFC 1982)."""
+    d = (a - b) % FCNT_MOD
+    return d - FCNT_MOD if d >= FCNT_MOD // 2 else d
+
+
+def fingerprint(raw):
+    """Huella del frame de un uplink TTN (crc32 de frm_payload o del payload decodificado)."""
+    up = raw.get("uplink_message") if isinstance(raw, dict) else None
+    if not isinstance(up, dict):
+        return 0
+    frm = up.get("frm_payload")
+    if isinstance(frm, str):
+        return zlib.crc32(frm.encode("utf-8"))
+    return zlib.crc32(json.dumps(up.get("decoded_payload"), sort_keys=True, default=str).encode("utf-8"))
+
+
+def gateway_metadata(up):
+    """[{gateway_id, rssi, snr}] del rx_metadata de un uplink_message."""
+    out = []
+    for md in up.get("rx_metadata") or ():
+        if not isinstance(md, dict):
+            continue
+        ids = md.get("gateway_ids")
+        out.append({"gateway_id": ids.get("gateway_id") if isinstance(ids, dict) else None,
+                    "rssi": md.get("rssi", md.get("channel_rssi")), "snr": md.get("snr")})
+    return out
+
+
+def set_gateways(out, gateways):
+    """Guarda los gateways en el paquete con el mejor rssi y snr."""
+    out["gateways"] = gateways
+    rssi = [g["rssi"] for g in gateways if isinstance(g.get("rssi"), (int, float))]
+    snr = [g["snr"] for g in gateways if isinstance(g.get("snr"), (int, float))]
+    out["rssi"] = max(rssi) if rssi else None
+    out["snr"] = max(snr) if snr else None
+
+
+def merge_gateways(dst, src):
+    """Suma a dst los gateways de src (un duplicado del mismo frame)."""
+    if not src.get("gateways"):
+        return
+    merged = {g["gateway_id"]: g for g in dst.get("gateways") or ()}
+    for g in src["gateways"]:
+        cur = merged.get(g["gateway_id"])
+        if cur is None or (g.get("rssi") or float("-inf")) > (cur.get("rssi") or float("-inf")):
+            merged[g["gateway_id"]] = g
+    set_gateways(dst, list(merged.values()))
+
+
+class _Device:
+    __slots__ = ("next", "ring", "prev", "held", "last_ts")
+
+    def __init__(self, f_cnt, window):
+        self.next = f_cnt            # próximo f_cnt a entregar
+        self.ring = [None] * window  # (f_cnt, huella) de lo entregado
+        self.prev = None             # anillo de la secuencia anterior a un reinicio
+        self.held = {}               # f_cnt -> (sale, se da por perdido el hueco, huella, paquete)
+        self.last_ts = None
+
+
+class UplinkDeduplicator:
+    """Buffer de deduplicación y reordenamiento (ver docstring del módulo)."""
+
+    def __init__(self, window=64, merge=0.2, hold=2.0, max_held=32, max_devices=10000):
+        self.window = int(window)
+        self.merge = float(merge)
+        self.hold = max(float(hold), self.merge)
+        self.max_held = int(max_held)
+        self.max_devices = int(max_devices)
+        self._lock = threading.Lock()
+        self._devices = OrderedDict()  # device_id -> _Device (LRU)
+        # (plazo, device_id) en orden de llegada: con merge y hold fijos los
+        # plazos de cada cola crecen, así release() solo mira el frente
+        self._due_merge = deque()
+        self._due_hold = deque()
+        self._held = 0
+
+    @classmethod
+    def from_env(cls):
+        """Buffer configurado por DEDUP_*; None si DEDUP_ENABLED=0."""
+        if os.environ.get("DEDUP_ENABLED", "1") != "1":
+            return None
+        return cls(window=int(os.environ.get("DEDUP_WINDOW", "64")),
+                   merge=float(os.environ.get("DEDUP_MERGE_S", "0.2")),
+                   hold=float(os.environ.get("DEDUP_REORDER_S", "2.0")),
+                   max_held=int(os.environ.get("DEDUP_MAX_HELD", "32")),
+                   max_devices=int(os.environ.get("DEDUP_MAX_DEVICES",
+                                                  os.environ.get("STORE_MAX_DEVICES", "10000"))))
+
+    @property
+    def pending(self):
+        return self._held
+
+    def push(self, pairs, now=None):
+        """
+        Recibe (uplink crudo, paquete de parse_uplink) y devuelve los paquetes
+        listos para guardar, en orden de f_cnt por dispositivo (incluidos los
+        retenidos antes cuyo plazo venció).
+        """
+        now = time.monotonic() if now is None else now
+        prints = [fingerprint(raw) for raw, _ in pairs]
+        ready = []
+        with self._lock:
+            self._release_due(now, ready)
+            for (_, out), fp in zip(pairs, prints):
+                f_cnt = out.get("f_cnt")
+                if f_cnt is None:
+                    ready.append(out)
+                else:
+                    self._push(out["device_id"], f_cnt % FCNT_MOD, fp, out, now, ready)
+            HELD.set(self._held)
+        return ready
+
+    def release(self, now=None):
+        """Entrega lo retenido cuyo plazo venció (los huecos vencidos se dan por perdidos)."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        with self._lock:
+            self._release_due(now, ready)
+            HELD.set(self._held)
+        return ready
+
+    def flush(self):
+        """Entrega todo lo retenido (al detener el servicio)."""
+        ready = []
+        with self._lock:
+            for st in self._devices.values():
+                self._settle(st, float("inf"), ready)
+            self._due_merge.clear()
+            self._due_hold.clear()
+            HELD.set(self._held)
+        return ready
+
+    # ---- interno (con self._lock tomado) ----
+    def _release_due(self, now, ready):
+        touched = set()
+        for due in (self._due_merge, self._due_hold):
+            while due and due[0][0] <= now:
+                touched.add(due.popleft()[1])
+        for device_id in touched:
+            st = self._devices.get(device_id)
+            if st is not None and st.held:
+                self._settle(st, now, ready)
+
+    def _push(self, device_id, f_cnt, fp, out, now, ready):
+        st = self._devices.get(device_id)
+        if st is None:
+            st = self._devices[device_id] = _Device(f_cnt, self.window)
+            if len(self._devices) > self.max_devices:
+                _, old = self._devices.popitem(last=False)
+                self._settle(old, float("inf"), ready)
+        else:
+            self._devices.move_to_end(device_id)
+
+        reset = False
+        i = f_cnt % self.window
+        held = st.held.get(f_cnt)
+        slot = st.ring[i]
+        if held is not None:
+            if held[2] == fp:
+                # todavía no se guardó: se le suman los gateways del duplicado
+                merge_gateways(held[3], out)
+                DUPLICATES.inc()
+                return
+            reset = True  # mismo contador, otro frame: el dispositivo empezó de nuevo
+        elif slot is not None and slot[0] == f_cnt:
+            if slot[1] == fp:
+                DUPLICATES.inc()  # ya guardado: no se toca lo publicado
+                return
+            reset = True
+        elif st.prev is not None and st.prev[i] == (f_cnt, fp):
+            DUPLICATES.inc()  # reentrega de un frame anterior al reinicio
+            return
+        d = serial_diff(f_cnt, st.next)
+        if d < 0 and not reset:
+            # hacia atrás dentro de la ventana (desde el mayor contador visto)
+            # es un paquete tardío, también el 0; solo un contador bajo desde
+            # más lejos que la ventana reinicia
+            newest = (max(st.held, key=lambda c: serial_diff(c, st.next)) if st.held
+                      else (st.next - 1) % FCNT_MOD)
+            if -serial_diff(f_cnt, newest) <= self.window or f_cnt >= self.window:
+                LATE.inc()
+                return
+            reset = True
+        if reset:
+            RESETS.inc()
+            self._settle(st, float("inf"), ready)
+            st.prev, st.ring = st.ring, [None] * self.window
+            st.next, d = f_cnt, 0
+
+        st.held[f_cnt] = (now + self.merge, now + self.hold, fp, out)
+        self._held += 1
+        if self.merge > 0:
+            self._due_merge.append((now + self.merge, device_id))
+        if d > 0:
+            REORDERED.inc()
+            self._due_hold.append((now + self.hold, device_id))
+        if self.merge <= 0 or len(st.held) > self.max_held:
+            self._settle(st, now, ready)
+        # con merge > 0 lo recién llegado no puede salir todavía: lo entrega release()
+
+    def _settle(self, st, now, ready):
+        """
+        Entrega en orden de f_cnt lo retenido que ya puede salir: el contador
+        esperado pasado su plazo de unión, o lo que está detrás de un hueco
+        vencido (el hueco se da por perdido). Con más de max_held retenidos
+        salen los más viejos aunque no haya vencido nada.
+        """
+        if not st.held:
+            return
+        order = sorted(st.held, key=lambda c: serial_diff(c, st.next))
+        expired = [c for c in order if st.held[c][1] <= now]
+        for c in order:
+            ready_at, _, fp, out = st.held[c]
+            if len(st.held) <= self.max_held:  # si no, sale el más viejo igual
+                if ready_at > now:
+                    break  # todavía juntando duplicados de otros gateways
+                if c != st.next and not (expired and serial_diff(c, expired[-1]) <= 0):
+                    break  # hueco que todavía se espera
+            del st.held[c]
+            self._held -= 1
+            self._emit(st, c, fp, out, ready)
+
+    def _emit(self, st, f_cnt, fp, out, ready):
+        # el tiempo de llegada no retrocede aunque el orden de llegada fuera otro
+        if st.last_ts is not None and out.get("timestamp", st.last_ts) < st.last_ts:
+            out["timestamp"] = st.last_ts
+        st.last_ts = out.get("timestamp", st.last_ts)
+        st.ring[f_cnt % self.window] = (f_cnt, fp)
+        st.next = (f_cnt + 1) % FCNT_MOD
+        ready.append(out)
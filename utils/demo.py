@@ -1,30 +1,130 @@
 # utils/demo.py
-import random
+import os
+import threading
 import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from utils.alerts import AlertEngine, load_rules
+from utils.downsample import Rollup
+from utils.fleet import BASE_POSITION, FleetSimulator
+from utils.geo import Geofences, GridIndex, load_geofences
+
+# Una pulsera simulada con estado: cada llamada avanza la simulación el tiempo
+# real transcurrido, de modo que la serie es continua y no ruido independiente.
+# Al crearla se simula la última hora (cada 5 s) para que haya historial.
+BACKFILL_S = 3600
+_SIM = None
+_HISTORY = Rollup(max_raw=100000)
+_LOCK = threading.Lock()
+
+
+def _simulator(now):
+    global _SIM
+    if _SIM is None:
+        _SIM = FleetSimulator(1, spread=0.0, incident_rate=6.0, start=now - BACKFILL_S)
+        for _ in range(int(BACKFILL_S // 5) - 1):
+            cols = _SIM.step(5.0)
+            _HISTORY.extend(cols["timestamp"], cols["heart_rate"])
+    return _SIM
+
 
 def get_demo_data():
     """
     Genera datos demo realistas para la pulsera:
-    - lat/lon se mueven levemente
-    - temperatura, humo, ritmo cardíaco, movimiento
+    - lat/lon se mueven como una caminata desde la posición anterior
+    - temperatura, humo, ritmo cardíaco y movimiento evolucionan desde el
+      último valor, con incidentes ocasionales (ver utils/fleet.py)
+    - la batería se descarga lentamente
     """
-    base = {
-        "lat": -2.1460,
-        "lon": -79.9640,
-        "temperature": 36.0,
-        "smoke": 10,
-        "heart_rate": 80,
-        "movement": 8,
-        "battery": 90,
-        "timestamp": time.time()
+    now = time.time()
+    with _LOCK:
+        sim = _simulator(now)
+        cols = sim.step(min(max(now - sim.t, 0.1), 60.0))
+        _HISTORY.extend(cols["timestamp"], cols["heart_rate"])
+    return {
+        "lat": float(cols["lat"][0]),
+        "lon": float(cols["lon"][0]),
+        "temperature": float(cols["temperature"][0]),
+        "smoke": int(cols["smoke"][0]),
+        "heart_rate": int(cols["heart_rate"][0]),
+        "movement": int(cols["movement"][0]),
+        "battery": int(cols["battery"][0]),
+        "timestamp": now,
     }
 
-    # pequeñas variaciones para simular tiempo real
-    base["lat"] += random.uniform(-0.0008, 0.0008)
-    base["lon"] += random.uniform(-0.0008, 0.0008)
-    base["temperature"] = round(base["temperature"] + random.uniform(-1.5, 2.5), 1)
-    base["smoke"] = int(max(0, min(100, base["smoke"] + random.randint(-5, 10))))
-    base["heart_rate"] = int(max(40, min(190, base["heart_rate"] + random.randint(-6, 8))))
-    base["movement"] = int(max(0, min(10, base["movement"] + random.randint(-2, 2))))
-    base["battery"] = int(max(0, min(100, base["battery"] + random.randint(-1, 0))))
-    return base
\ No newline at end of file
+
+def get_demo_history(since=None, until=None, max_points=1000):
+    """Historial de ritmo cardiaco de la pulsera demo: (timestamps, valores, fuente)."""
+    with _LOCK:
+        _simulator(time.time())
+        return _HISTORY.query(since, until, max_points)
+
+
+# Flota demo para el mapa: DEMO_FLEET_SIZE pulseras alrededor de la base,
+# compartida por todas las sesiones y con las últimas TRAIL_POINTS posiciones.
+DEMO_FLEET_SIZE = int(os.environ.get("DEMO_FLEET_SIZE", "500"))
+TRAIL_POINTS = 20
+# index: GridIndex de las posiciones; alert: incidente o geocerca violada;
+# trails: arreglo (puntos, dispositivos, 2) de (lat, lon), del más viejo al actual;
+# version: cuenta los pasos de la simulación (cambia con cada estado nuevo)
+DemoFleet = namedtuple("DemoFleet", ["index", "alert", "trails", "version"])
+_FLEET = None
+_FLEET_STATE = None
+_TRAILS = deque(maxlen=TRAIL_POINTS)
+_GEOFENCES = None
+_ALERTS = None
+
+# Geocercas de ejemplo alrededor de la posición base de la demo (la ingesta
+# real solo usa las de GEOFENCES_FILE)
+DEMO_GEOFENCES = (
+    {"name": "base", "kind": "safe", "polygon": [
+        (BASE_POSITION[0] - 0.02, BASE_POSITION[1] - 0.02),
+        (BASE_POSITION[0] - 0.02, BASE_POSITION[1] + 0.02),
+        (BASE_POSITION[0] + 0.02, BASE_POSITION[1] + 0.02),
+        (BASE_POSITION[0] + 0.02, BASE_POSITION[1] - 0.02)]},
+    {"name": "sector-quimico", "kind": "hazard", "polygon": [
+        (BASE_POSITION[0] + 0.004, BASE_POSITION[1] + 0.004),
+        (BASE_POSITION[0] + 0.004, BASE_POSITION[1] + 0.008),
+        (BASE_POSITION[0] + 0.008, BASE_POSITION[1] + 0.008),
+        (BASE_POSITION[0] + 0.008, BASE_POSITION[1] + 0.004)]},
+)
+
+
+def get_demo_geofences():
+    """Geocercas de GEOFENCES_FILE o, si no hay, las de ejemplo de la demo."""
+    global _GEOFENCES
+    if _GEOFENCES is None:
+        _GEOFENCES = load_geofences() or Geofences(DEMO_GEOFENCES)
+    return _GEOFENCES
+
+
+def get_demo_alerts():
+    """Motor de alertas de la demo (reglas de ALERT_RULES_FILE y geocercas de la demo)."""
+    global _ALERTS
+    if _ALERTS is None:
+        _ALERTS = AlertEngine(load_rules(), geofences=get_demo_geofences())
+    return _ALERTS
+
+
+def get_demo_fleet():
+    """Avanza la flota demo (como mucho una vez por segundo) y devuelve DemoFleet."""
+    global _FLEET, _FLEET_STATE
+    now = time.time()
+    with _LOCK:
+        if _FLEET is None:
+            _FLEET = FleetSimulator(DEMO_FLEET_SIZE, seed=7, spread=0.015, incident_rate=2.0,
+                                    start=now - 5.0 * TRAIL_POINTS, prefix="demo-")
+            for _ in range(TRAIL_POINTS - 1):
+                _FLEET.step(5.0)
+                _TRAILS.append(np.column_stack((_FLEET.lat, _FLEET.lon)))
+        if _FLEET_STATE is None or now - _FLEET.t >= 1.0:
+            _FLEET.step(min(max(now - _FLEET.t, 0.1), 60.0))
+            _TRAILS.append(np.column_stack((_FLEET.lat, _FLEET.lon)))
+            fences = get_demo_geofences().evaluate(_FLEET.lat, _FLEET.lon)
+            alert = (_FLEET.incident != 0) | (fences >= 1).any(axis=0)
+            _FLEET_STATE = DemoFleet(GridIndex(_FLEET.device_ids, _FLEET.lat, _FLEET.lon),
+                                     alert, np.stack(_TRAILS),
+                                     _FLEET_STATE.version + 1 if _FLEET_STATE is not None else 1)
+        return _FLEET_STATE
@@ -0,0 +1,210 @@
+# utils/downsample.py
+"""
+Reducción de series largas (p. ej. horas de ritmo cardiaco) a los puntos que
+el gráfico puede mostrar.
+
+ - lttb(x, y, n): Largest-Triangle-Three-Buckets; conserva la forma visual
+ - minmax(x, y, n): mínimo y máximo de cada cubeta; conserva los picos
+ - Rollup: series ya agregadas (mín, máx, media) en cubetas de 10 s, 1 min,
+   5 min, 15 min y 1 h, que se actualizan solo en la cola cuando llegan datos
+   nuevos; alejar el zoom a días no recorre las muestras crudas (que se
+   conservan hasta max_raw; los agregados, siempre)
+ - HistoryCache: Rollups de los últimos dispositivos consultados (LRU), que
+   se cargan del log la primera vez y luego solo leen lo nuevo
+
+Rollup.query(since, until, max_points) elige sola la resolución: crudo si
+cabe, LTTB sobre el crudo si no es demasiado, o la envolvente mín/máx del
+nivel agregado más fino que quepa.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+LEVELS = (10, 60, 300, 900, 3600)  # ancho de cubeta en segundos
+LTTB_MAX_RATIO = 50  # se reduce el crudo directamente hasta max_points * 50
+
+
+def lttb(x, y, n_out):
+    """Índices de los n_out puntos elegidos por LTTB (x ascendente)."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # cubetas interiores (el primer y el último punto se conservan siempre)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    counts = ends - starts
+    csx = np.concatenate(([0.0], np.cumsum(x)))
+    csy = np.concatenate(([0.0], np.cumsum(y)))
+    # promedio de la cubeta siguiente (la última usa el punto final)
+    avg_x = np.append((csx[ends[1:]] - csx[starts[1:]]) / counts[1:], x[-1])
+    avg_y = np.append((csy[ends[1:]] - csy[starts[1:]]) / counts[1:], y[-1])
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        s, e = starts[i], ends[i]
+        xs, ys = x[s:e], y[s:e]
+        area = np.abs((x[a] - avg_x[i]) * (ys - y[a]) - (x[a] - xs) * (avg_y[i] - y[a]))
+        a = s + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax(x, y, n_out):
+    """Índices del mínimo y el máximo de n_out // 2 cubetas, en orden temporal."""
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    buckets = max(1, n_out // 2)
+    starts = (np.arange(buckets) * n) // buckets
+    bucket = np.repeat(np.arange(buckets), np.diff(np.r_[starts, n]))
+    out = []
+    for reduce in (np.minimum, np.maximum):
+        hits = np.flatnonzero(y == reduce.reduceat(y, starts)[bucket])
+        # primera coincidencia de cada cubeta
+        out.append(hits[np.searchsorted(bucket[hits], np.arange(buckets))])
+    return np.unique(np.concatenate(out))  # ordena por posición (= tiempo)
+
+
+def _aggregate(ts, y, width):
+    """(inicio de cubeta, mín, máx, media) de muestras ordenadas por ts."""
+    b = np.floor(ts / width)
+    starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+    counts = np.diff(np.r_[starts, len(ts)])
+    return (b[starts] * width,
+            np.minimum.reduceat(y, starts),
+            np.maximum.reduceat(y, starts),
+            np.add.reduceat(y, starts) / counts)
+
+
+class Rollup:
+    """Serie cruda + agregados por nivel de una sola variable (ver módulo)."""
+
+    def __init__(self, levels=LEVELS, max_raw=500000):
+        self.levels = tuple(levels)
+        self.max_raw = max_raw
+        self.ts = np.empty(0)
+        self.y = np.empty(0)
+        self._agg = {w: (np.empty(0),) * 4 for w in self.levels}
+
+    @property
+    def last_ts(self):
+        return float(self.ts[-1]) if len(self.ts) else None
+
+    def extend(self, ts, y):
+        """Agrega muestras más nuevas que last_ts y recalcula solo la cola."""
+        ts = np.asarray(ts, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        keep = ~np.isnan(y) & ~np.isnan(ts)
+        if self.last_ts is not None:
+            keep &= ts > self.last_ts
+        ts, y = ts[keep], y[keep]
+        if not len(ts):
+            return 0
+        order = np.argsort(ts, kind="stable")
+        self.ts = np.concatenate((self.ts, ts[order]))
+        self.y = np.concatenate((self.y, y[order]))
+        first = ts.min()
+        for w in self.levels:
+            b0 = np.floor(first / w) * w
+            bt, mn, mx, mean = self._agg[w]
+            cut = int(np.searchsorted(bt, b0, side="left"))
+            r0 = int(np.searchsorted(self.ts, b0, side="left"))
+            nbt, nmn, nmx, nmean = _aggregate(self.ts[r0:], self.y[r0:], w)
+            self._agg[w] = (np.concatenate((bt[:cut], nbt)), np.concatenate((mn[:cut], nmn)),
+                            np.concatenate((mx[:cut], nmx)), np.concatenate((mean[:cut], nmean)))
+        if len(self.ts) > self.max_raw:
+            self.ts, self.y = self.ts[-self.max_raw:], self.y[-self.max_raw:]
+        return len(ts)
+
+    def query(self, since=None, until=None, max_points=1000, method="lttb"):
+        """
+        (x, y, fuente) con a lo sumo ~max_points puntos en [since, until].
+        method: "lttb" o "minmax" para reducir las muestras crudas.
+        """
+        lo = 0 if since is None else int(np.searchsorted(self.ts, since, side="left"))
+        hi = len(self.ts) if until is None else int(np.searchsorted(self.ts, until, side="right"))
+        n = hi - lo
+        ts, y = self.ts[lo:hi], self.y[lo:hi]
+        if n <= max_points:
+            return ts, y, "raw"
+        if n <= max_points * LTTB_MAX_RATIO:
+            idx = (minmax if method == "minmax" else lttb)(ts, y, max_points)
+            return ts[idx], y[idx], method
+        for w in self.levels:
+            bt, mn, mx, _ = self._agg[w]
+            b_lo = 0 if since is None else int(np.searchsorted(bt, np.floor(since / w) * w, side="left"))
+            b_hi = len(bt) if until is None else int(np.searchsorted(bt, until, side="right"))
+            if 2 * (b_hi - b_lo) <= max_points or w == self.levels[-1]:
+                bt, mn, mx = bt[b_lo:b_hi], mn[b_lo:b_hi], mx[b_lo:b_hi]
+                # envolvente: mínimo al inicio de la cubeta y máximo a la mitad
+                x = np.column_stack((bt, bt + w / 2)).ravel()
+                v = np.column_stack((mn, mx)).ravel()
+                if len(x) > max_points:
+                    idx = lttb(x, v, max_points)
+                    x, v = x[idx], v[idx]
+                return x, v, "rollup-%ds" % w
+        return ts, y, "raw"  # sin niveles
+
+
+class _Series:
+    __slots__ = ("roll", "lock", "loaded")
+
+    def __init__(self, roll):
+        self.roll = roll
+        self.lock = threading.Lock()  # carga de esta serie (no del cache entero)
+        self.loaded = False
+
+
+class HistoryCache:
+    """
+    Rollups por (dispositivo, campo) de los últimos `max_series` consultados.
+    `loader(device_id, since)` devuelve un arreglo con campos timestamp y el
+    campo pedido (p. ej. TimeSeriesLog.read).
+
+    La lectura del log se hace fuera del lock del cache: la primera carga de
+    una serie (todo su historial) solo la esperan quienes piden esa serie, y
+    una actualización que ya está en curso no se repite (se devuelve el
+    rollup como está).
+    """
+
+    def __init__(self, loader, max_series=64, levels=LEVELS):
+        self.loader = loader
+        self.max_series = max_series
+        self.levels = levels
+        self._lock = threading.Lock()
+        self._series = OrderedDict()
+
+    def get(self, device_id, field, refresh=True):
+        """Rollup actualizado con lo que haya llegado desde la última consulta."""
+        key = (device_id, field)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(Rollup(self.levels))
+                if len(self._series) > self.max_series:
+                    self._series.popitem(last=False)
+            else:
+                self._series.move_to_end(key)
+        if not series.loaded:
+            with series.lock:
+                if not series.loaded:
+                    self._load(series, device_id, field)
+                    series.loaded = True
+        elif refresh and series.lock.acquire(blocking=False):
+            try:
+                self._load(series, device_id, field)
+            finally:
+                series.lock.release()
+        return series.roll
+
+    def _load(self, series, device_id, field):
+        recs = self.loader(device_id, series.roll.last_ts)
+        if len(recs):
+            series.roll.extend(recs["timestamp"], recs[field])
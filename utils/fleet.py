@@ -0,0 +1,266 @@
+# utils/fleet.py
+"""
+Simulador vectorizado de una flota de pulseras.
+
+FleetSimulator avanza N dispositivos a la vez con arreglos NumPy:
+ - posición: caminata aleatoria con velocidad persistente alrededor de una base
+ - ritmo cardiaco, temperatura, humo y movimiento: procesos que vuelven a su
+   valor basal (Ornstein-Uhlenbeck) con ruido
+ - batería: descarga lineal con una tasa distinta por dispositivo
+ - incidentes: cada dispositivo puede iniciar uno (incendio, evento cardiaco o
+   caída) con probabilidad `incident_rate` por hora; dura entre 30 s y 5 min y
+   desplaza los valores basales mientras está activo
+
+step() devuelve columnas (campo -> arreglo, como Normalizer.normalize_batch) y
+uplinks() las convierte en uplinks TTN v3 con frm_payload real (utils/codec.py).
+make_uplink() arma un uplink suelto con f_cnt y gateway a elección.
+
+Enviar la flota al receptor webhook o a un broker MQTT:
+    python -m utils.fleet --devices 1000 --interval 5 --webhook http://localhost:8000/ttn/uplink
+    python -m utils.fleet --devices 100 --mqtt localhost:1883 --binary
+"""
+
+import argparse
+import base64
+import json
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+import numpy as np
+
+from utils.codec import PULSERA_V1
+
+BASE_POSITION = (-2.1460, -79.9640)
+
+# tipos de incidente (0 = ninguno)
+NONE, FIRE, CARDIAC, FALL = 0, 1, 2, 3
+INCIDENTS = {FIRE: "fire", CARDIAC: "cardiac", FALL: "fall"}
+
+
+class FleetSimulator:
+    """Estado de N pulseras que avanza en bloque (ver docstring del módulo)."""
+
+    def __init__(self, n_devices, seed=None, base=BASE_POSITION, spread=0.01,
+                 incident_rate=0.5, start=None, prefix="pulsera-"):
+        n = int(n_devices)
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        rng = self.rng
+        self.t = time.time() if start is None else float(start)
+        self.incident_rate = float(incident_rate)
+        width = max(4, len(str(n - 1)))
+        self.device_ids = ["%s%0*d" % (prefix, width, i) for i in range(n)]
+        self.f_cnt = np.zeros(n, dtype=np.int64)
+
+        self.lat = base[0] + rng.uniform(-spread, spread, n)
+        self.lon = base[1] + rng.uniform(-spread, spread, n)
+        self.vel = np.zeros((n, 2))
+        self.hr_base = rng.uniform(65, 90, n)
+        self.hr = self.hr_base.copy()
+        self.temperature = rng.normal(36.5, 0.3, n)
+        self.smoke = rng.uniform(5, 15, n)
+        self.movement = rng.uniform(5, 9, n)
+        self.battery = rng.uniform(70, 100, n)
+        self.drain = rng.uniform(0.5, 2.0, n) / 3600.0  # % por segundo
+        self.incident = np.zeros(n, dtype=np.int8)
+        self.incident_end = np.zeros(n)
+
+    def _incidents(self, dt):
+        rng = self.rng
+        self.incident[self.incident_end <= self.t] = NONE
+        idle = self.incident == NONE
+        start = idle & (rng.random(self.n) < self.incident_rate * dt / 3600.0)
+        k = int(start.sum())
+        if k:
+            self.incident[start] = rng.integers(FIRE, FALL + 1, k)
+            self.incident_end[start] = self.t + rng.uniform(30, 300, k)
+
+    @staticmethod
+    def _ou(x, target, theta, sigma, dt, noise):
+        """Un paso de Ornstein-Uhlenbeck: x vuelve a `target` con ruido."""
+        return x + theta * (target - x) * dt + sigma * np.sqrt(dt) * noise
+
+    def step(self, dt=1.0):
+        """Avanza dt segundos y devuelve las columnas del nuevo muestreo."""
+        dt = max(float(dt), 1e-3)
+        rng = self.rng
+        n = self.n
+        self.t += dt
+        self._incidents(dt)
+        fire = self.incident == FIRE
+        cardiac = self.incident == CARDIAC
+        fall = self.incident == FALL
+
+        # a paso de caminata (~1.4 m/s ≈ 1.3e-5 °/s); quieto tras una caída
+        self.vel = 0.9 * self.vel + rng.normal(0, 4e-6, (n, 2)) * np.sqrt(dt)
+        self.vel[fall] = 0.0
+        self.lat += self.vel[:, 0] * dt
+        self.lon += self.vel[:, 1] * dt
+
+        noise = rng.standard_normal((4, n))
+        hr_target = np.where(cardiac, 170.0, np.where(fire, 120.0, self.hr_base))
+        self.hr = np.clip(self._ou(self.hr, hr_target, 0.2, 3.0, dt, noise[0]), 30, 220)
+        temp_target = np.where(fire, 58.0, 36.5)
+        self.temperature = self._ou(self.temperature, temp_target, 0.1, 0.4, dt, noise[1])
+        smoke_target = np.where(fire, 85.0, 10.0)
+        self.smoke = np.clip(self._ou(self.smoke, smoke_target, 0.1, 2.0, dt, noise[2]), 0, 100)
+        move_target = np.where(fall, 0.0, 7.0)
+        self.movement = np.clip(self._ou(self.movement, move_target, 0.3, 1.0, dt, noise[3]), 0, 10)
+        self.battery = np.maximum(self.battery - self.drain * dt, 0.0)
+        self.f_cnt += 1
+
+        return {
+            "timestamp": np.full(n, self.t),
+            "temperature": np.round(self.temperature, 1),
+            "heart_rate": np.rint(self.hr),
+            "smoke": np.rint(self.smoke),
+            "movement": np.rint(self.movement),
+            "battery": np.rint(self.battery),
+            "lat": self.lat.copy(),
+            "lon": self.lon.copy(),
+        }
+
+    def records(self, cols):
+        """Columnas de step() -> lista de dicts (uno por dispositivo)."""
+        names = list(cols)
+        return [dict(zip(names, row)) for row in zip(*(cols[k].tolist() for k in names))]
+
+    def uplinks(self, cols, binary=False, application_id="pulsera-guardian"):
+        """
+        Columnas de step() -> uplinks TTN v3. frm_payload siempre lleva el frame
+        binario v1; con binary=False también se incluye decoded_payload.
+        """
+        frames = PULSERA_V1.encode_many(cols, self.n)
+        received_at = datetime.fromtimestamp(self.t, timezone.utc).isoformat()
+        decoded = None if binary else self.records(
+            {k: v for k, v in cols.items() if k != "timestamp"})
+        out = []
+        for i, device_id in enumerate(self.device_ids):
+            up = {
+                "f_port": 1,
+                "f_cnt": int(self.f_cnt[i]),
+                "frm_payload": base64.b64encode(frames[i]).decode("ascii"),
+                "rx_metadata": [{"gateway_ids": {"gateway_id": "gw-sim"}, "rssi": -90, "snr": 7.5}],
+                "received_at": received_at,
+            }
+            if decoded is not None:
+                up["decoded_payload"] = decoded[i]
+            out.append({
+                "end_device_ids": {
+                    "device_id": device_id,
+                    "application_ids": {"application_id": application_id},
+                },
+                "received_at": received_at,
+                "uplink_message": up,
+            })
+        return out
+
+    def active_incidents(self):
+        """{device_id: tipo} de los incidentes en curso."""
+        idx = np.nonzero(self.incident)[0]
+        return {self.device_ids[i]: INCIDENTS[int(self.incident[i])] for i in idx}
+
+
+# ---- salidas ----
+def make_uplink(device_id, f_cnt, frame=None, gateway="gw-1", rssi=-100, snr=2.0):
+    """
+    Uplink TTN v3 mínimo de un solo gateway (pruebas y benchmarks de
+    deduplicación): frm_payload es `frame` o "frame-<f_cnt>", así el mismo
+    contador con otro frame tiene otra huella.
+    """
+    return {
+        "end_device_ids": {"device_id": device_id},
+        "uplink_message": {
+            "f_port": 1,
+            "f_cnt": f_cnt,
+            "frm_payload": frame if frame is not None else "frame-%d" % f_cnt,
+            "decoded_payload": {"heart_rate": 70},
+            "rx_metadata": [{"gateway_ids": {"gateway_id": gateway}, "rssi": rssi, "snr": snr}],
+        },
+    }
+
+
+def post_webhook(url, uplinks, batch=100, timeout=10.0):
+    """
+    Envía los uplinks al receptor (receiver.py) en lotes; respeta Retry-After
+    cuando responde 503. Devuelve {código HTTP: cantidad de peticiones}.
+    """
+    status = {}
+    for i in range(0, len(uplinks), batch):
+        body = json.dumps(uplinks[i:i + batch]).encode("utf-8")
+        while True:
+            req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(req, timeout=timeout) as r:
+                    code = r.status
+            except urllib.error.HTTPError as e:
+                code = e.code
+                if code == 503:
+                    status[code] = status.get(code, 0) + 1
+                    time.sleep(float(e.headers.get("Retry-After", "1")))
+                    continue
+            break
+        status[code] = status.get(code, 0) + 1
+    return status
+
+
+def publish_mqtt(client, uplinks, topic="v3/{application_id}@ttn/devices/{device_id}/up", qos=0):
+    """Publica cada uplink en su topic TTN v3 con un cliente paho-mqtt conectado."""
+    for up in uplinks:
+        ids = up["end_device_ids"]
+        t = topic.format(device_id=ids["device_id"],
+                         application_id=ids["application_ids"]["application_id"])
+        client.publish(t, json.dumps(up), qos=qos)
+
+
+def _mqtt_client(address):
+    import paho.mqtt.client as mqtt
+    host, _, port = address.partition(":")
+    if hasattr(mqtt, "CallbackAPIVersion"):  # paho-mqtt >= 2
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    else:
+        client = mqtt.Client()
+    client.connect(host, int(port or 1883), 60)
+    client.loop_start()
+    return client
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="simulador de flota de pulseras")
+    ap.add_argument("--devices", type=int, default=100)
+    ap.add_argument("--interval", type=float, default=5.0, help="segundos entre muestreos")
+    ap.add_argument("--duration", type=float, default=None, help="segundos (por defecto sin fin)")
+    ap.add_argument("--incident-rate", type=float, default=0.5, help="incidentes por dispositivo y hora")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--binary", action="store_true", help="solo frm_payload, sin decoded_payload")
+    out = ap.add_mutually_exclusive_group()
+    out.add_argument("--webhook", default="http://localhost:8000/ttn/uplink")
+    out.add_argument("--mqtt", help="host[:puerto] del broker")
+    args = ap.parse_args(argv)
+
+    sim = FleetSimulator(args.devices, seed=args.seed, incident_rate=args.incident_rate)
+    client = _mqtt_client(args.mqtt) if args.mqtt else None
+    t_end = None if args.duration is None else time.monotonic() + args.duration
+    try:
+        while t_end is None or time.monotonic() < t_end:
+            t0 = time.monotonic()
+            ups = sim.uplinks(sim.step(args.interval), binary=args.binary)
+            if client is not None:
+                publish_mqtt(client, ups)
+                status = "mqtt"
+            else:
+                status = post_webhook(args.webhook, ups)
+            print("%d uplinks (%s)  incidentes: %d" % (len(ups), status, len(sim.active_incidents())))
+            time.sleep(max(0.0, args.interval - (time.monotonic() - t0)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if client is not None:
+            client.loop_stop()
+            client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# utils/geo.py
+"""
+Utilidades geográficas para la flota: índice espacial, viewport y geocercas.
+
+ - GridIndex: índice de grilla (celdas de `cell_deg` grados) sobre las
+   últimas posiciones; query(bbox) solo mira las celdas que cubre el bbox.
+ - viewport(lat, lon, zoom): bbox visible de un mapa web (Web Mercator) de
+   width x height píxeles centrado en (lat, lon).
+ - Geofences: zonas seguras y de peligro (polígonos). evaluate() hace el
+   punto-en-polígono de toda la flota con NumPy (un bucle por arista, no por
+   dispositivo). Se configuran con un JSON (variable GEOFENCES_FILE):
+
+    [{"name": "base", "kind": "safe", "polygon": [[-2.15, -79.97], ...]},
+     {"name": "bodega", "kind": "hazard", "polygon": [[lat, lon], ...],
+      "level": "danger", "message": "☢ ZONA DE PELIGRO: BODEGA"}]
+
+   Un dispositivo está en falta si está dentro de una zona de peligro o fuera
+   de todas las zonas seguras. Sin GEOFENCES_FILE no hay geocercas (las de
+   ejemplo son solo de la demo: utils/demo.py).
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+
+
+class GridIndex:
+    """Índice de grilla inmutable sobre (lat, lon); se reconstruye por tick."""
+
+    def __init__(self, ids, lat, lon, cell_deg=0.005):
+        self.ids = list(ids)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell_deg = float(cell_deg)
+        valid = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lon)))
+        ci = np.floor(self.lat[valid] / cell_deg).astype(np.int64)
+        cj = np.floor(self.lon[valid] / cell_deg).astype(np.int64)
+        order = np.lexsort((cj, ci))
+        self._order = valid[order]
+        keys = np.column_stack((ci[order], cj[order]))
+        # celda -> rango [inicio, fin) dentro de _order
+        self._cells = {}
+        if len(keys):
+            bounds = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+            starts = np.r_[0, bounds]
+            ends = np.r_[bounds, len(keys)]
+            for s, e in zip(starts.tolist(), ends.tolist()):
+                self._cells[(int(keys[s, 0]), int(keys[s, 1]))] = (s, e)
+
+    def __len__(self):
+        return len(self._order)
+
+    def query(self, bbox):
+        """Índices (en ids/lat/lon) de los puntos dentro de bbox = (lat0, lon0, lat1, lon1)."""
+        lat0, lon0, lat1, lon1 = bbox
+        c = self.cell_deg
+        i0, i1 = math.floor(lat0 / c), math.floor(lat1 / c)
+        j0, j1 = math.floor(lon0 / c), math.floor(lon1 / c)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+            cand = self._order  # bbox más grande que la flota: recorrer celdas no ayuda
+        else:
+            parts = [self._order[s:e] for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)
+                     for s, e in (self._cells.get((i, j), (0, 0)),) if e > s]
+            cand = np.concatenate(parts) if parts else self._order[:0]
+        lat, lon = self.lat[cand], self.lon[cand]
+        inside = (lat >= lat0) & (lat <= lat1) & (lon >= lon0) & (lon <= lon1)
+        return np.sort(cand[inside])
+
+
+def viewport(lat, lon, zoom, width=800, height=500):
+    """(lat0, lon0, lat1, lon1) visible en un mapa de width x height px al zoom dado."""
+    deg_per_px = 360.0 / (256.0 * 2 ** zoom)
+    half_lon = deg_per_px * width / 2
+    half_lat = deg_per_px * height / 2 * math.cos(math.radians(lat))
+    return (lat - half_lat, lon - half_lon, lat + half_lat, lon + half_lon)
+
+
+def points_in_polygon(lat, lon, polygon):
+    """Máscara booleana de los puntos dentro del polígono [(lat, lon), ...] (par-impar)."""
+    poly = np.asarray(polygon, dtype=np.float64)
+    inside = np.zeros(len(lat), dtype=bool)
+    plat, plon = poly[:, 0], poly[:, 1]
+    # solo los puntos dentro del bbox del polígono
+    cand = np.flatnonzero((lat >= plat.min()) & (lat <= plat.max()) &
+                          (lon >= plon.min()) & (lon <= plon.max()))
+    if not len(cand):
+        return inside
+    y, x = lat[cand], lon[cand]
+    hit = np.zeros(len(cand), dtype=bool)
+    for k in range(len(poly)):
+        y1, x1 = plat[k - 1], plon[k - 1]
+        y2, x2 = plat[k], plon[k]
+        if y1 == y2:
+            continue
+        crosses = (y1 > y) != (y2 > y)
+        x_at = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        hit ^= crosses & (x < x_at)
+    inside[cand] = hit
+    return inside
+
+
+class Geofences:
+    """Zonas seguras y de peligro (ver docstring del módulo)."""
+
+    def __init__(self, fences):
+        self.safe = []
+        self.hazard = []
+        for f in fences:
+            kind = f.get("kind")
+            if kind not in ("safe", "hazard"):
+                raise ValueError("geocerca %r: kind debe ser 'safe' o 'hazard'" % f.get("name"))
+            if len(f["polygon"]) < 3:
+                raise ValueError("geocerca %r: el polígono necesita 3 vértices" % f.get("name"))
+            (self.safe if kind == "safe" else self.hazard).append(dict(f))
+
+    def rules(self):
+        """Reglas (dicts de utils/alerts.py) que corresponden a evaluate()."""
+        out = []
+        if self.safe:
+            out.append({"name": "geofence:safe", "field": "geofence", "op": ">=", "value": 1,
+                        "level": "warning", "message": "🚧 FUERA DE ZONA SEGURA"})
+        for f in self.hazard:
+            out.append({"name": "geofence:" + f["name"], "field": "geofence", "op": ">=", "value": 1,
+                        "level": f.get("level", "danger"),
+                        "message": f.get("message", "☢ ZONA DE PELIGRO: " + f["name"].upper())})
+        return out
+
+    def evaluate(self, lat, lon):
+        """
+        Matriz (len(rules()), n) de 0/1: fila 0 fuera de toda zona segura (si
+        hay zonas seguras), luego una fila por zona de peligro. NaN sin GPS.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        rows = []
+        if self.safe:
+            in_safe = np.zeros(len(lat), dtype=bool)
+            for f in self.safe:
+                in_safe |= points_in_polygon(lat, lon, f["polygon"])
+            rows.append(~in_safe)
+        for f in self.hazard:
+            rows.append(points_in_polygon(lat, lon, f["polygon"]))
+        out = np.array(rows, dtype=np.float64).reshape(len(rows), len(lat))
+        out[:, np.isnan(lat) | np.isnan(lon)] = np.nan
+        return out
+
+    def polygons(self):
+        """[(nombre, tipo, [(lat, lon), ...])] para dibujar en el mapa."""
+        return [(f["name"], "safe", f["polygon"]) for f in self.safe] + \
+               [(f["name"], "hazard", f["polygon"]) for f in self.hazard]
+
+
+def load_geofences():
+    """Geocercas del archivo GEOFENCES_FILE; None si no está configurado."""
+    path = os.environ.get("GEOFENCES_FILE")
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return Geofences(json.load(f))
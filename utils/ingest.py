@@ -0,0 +1,450 @@
+# utils/ingest.py
+"""
+Servicio de ingesta compartido por todo el proceso.
+
+Un único IngestionService por proceso (get_service()) es dueño de:
+ - la conexión MQTT (si LORA_BACKEND=mqtt)
+ - el almacén en memoria (TelemetryStore) y el log en disco (TimeSeriesLog)
+ - el último paquete por dispositivo
+
+Las sesiones de Streamlit leen a través de snapshot(): un objeto inmutable con
+un número de versión. Mientras no llegue un paquete nuevo se devuelve el mismo
+snapshot, de modo que un rerun sin datos nuevos no lee disco ni parsea nada.
+
+Con LORA_BACKEND=webhook los paquetes los escribe otro proceso (receiver.py);
+en ese caso el servicio consulta el log como mucho cada `poll_interval` s.
+El log admite un solo escritor: start() lo toma antes de conectar el cliente
+MQTT y, si otro proceso ya escribe, no se conecta y sigue ese log. Ingestar
+sin poder escribir el log falla (RuntimeError) antes de tocar el store.
+
+start() también lanza un hilo que cada `tick_interval` s evalúa las reglas de
+alerta y las geocercas (utils/alerts.py, utils/geo.py) sobre toda la flota, haya
+o no un dashboard abierto, y actualiza el índice espacial que usa el mapa.
+
+Antes de normalizar, los uplinks pasan por el buffer de deduplicación y
+reordenamiento por (device_id, f_cnt) de utils/dedup.py (salvo
+DEDUP_ENABLED=0): se guardan una vez y en orden de f_cnt; el tick entrega lo
+retenido cuyo plazo de reordenamiento venció.
+
+Lo que ingesta este proceso también se graba en Parquet (utils/recorder.py,
+salvo RECORDER_ENABLED=0); el tick vuelca la grabación a disco.
+"""
+
+import base64
+import binascii
+import os
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+import numpy as np
+
+from utils.alerts import AlertEngine, load_rules
+from utils.codec import DEFAULT_REGISTRY
+from utils.dedup import UplinkDeduplicator
+from utils.downsample import HistoryCache
+from utils.geo import GridIndex, load_geofences
+from utils.metrics import REGISTRY
+from utils.normalize import get_normalizer
+from utils.recorder import SessionRecorder
+from utils.store import FIELDS, TelemetryStore, record_to_dict
+from utils.tslog import TimeSeriesLog
+
+DEFAULT_LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "tslog")
+
+PACKETS = REGISTRY.counter("ingest_packets_total", "Uplinks guardados en store y log", ("path",))
+FAILED = REGISTRY.counter("ingest_failed_total", "Uplinks descartados por error al parsear", ("path",))
+STAGE_SECONDS = REGISTRY.histogram("ingest_stage_seconds", "Duración de cada etapa de la ingesta",
+                                   ("path", "stage"))
+BATCH_SIZE = REGISTRY.histogram("ingest_batch_size", "Uplinks por lote de ingest_batch",
+                                buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+TICK_SECONDS = REGISTRY.histogram("ingest_tick_seconds", "Duración del tick (alertas, geocercas, índice)")
+ALERT_EVENTS = REGISTRY.counter("alert_events_total", "Transiciones de alertas", ("rule", "state"))
+
+# version: contador de paquetes; last: último paquete (cualquier dispositivo);
+# devices: device_id -> último paquete de ese dispositivo
+Snapshot = namedtuple("Snapshot", ["version", "last", "devices"])
+
+
+class IngestionService:
+    """Ingesta + vista en memoria de la telemetría (ver docstring del módulo)."""
+
+    def __init__(self, store=None, log=None, poll_interval=0.5, tick_interval=None, record=True):
+        self.store = store if store is not None else TelemetryStore(
+            capacity=int(os.environ.get("STORE_CAPACITY", "256")),
+            max_devices=int(os.environ.get("STORE_MAX_DEVICES", "10000")),
+        )
+        if log is None:
+            log = TimeSeriesLog(
+                os.environ.get("LOG_DIR", DEFAULT_LOG_DIR),
+                retention_seconds=float(os.environ.get("LOG_RETENTION_S", str(7 * 24 * 3600))),
+            )
+        # log=False: sin log en disco (reproducción: utils/replay.py pone su
+        # propio history_cache e ingesta solo con to_log=False)
+        self.log = None if log is False else log
+        self.poll_interval = poll_interval
+        self.tick_interval = tick_interval if tick_interval is not None else float(
+            os.environ.get("ALERT_TICK_S", "1.0"))
+        self.alerts = AlertEngine(load_rules(), geofences=load_geofences())
+        self.spatial = GridIndex([], [], [])
+        self.spatial_version = 0
+        self.history_cache = HistoryCache(self.log.read) if self.log is not None else None
+        self.recorder = SessionRecorder.from_env() if record else None
+        self.dedup = UplinkDeduplicator.from_env()
+        self.mqtt_client = None
+        self._lock = threading.Lock()
+        self._started = False
+        self._stopped = threading.Event()
+        self._version = 0
+        self._last = None
+        self._devices = {}
+        self._snapshot = Snapshot(0, None, MappingProxyType({}))
+        self._last_poll = 0.0
+        self._poll_lock = threading.Lock()  # _last_poll y _log_pos
+        self._log_pos = None
+
+    # ---- ciclo de vida ----
+    def start(self, ingest_mqtt=True):
+        """
+        Arranca el cliente MQTT (si está configurado y ingest_mqtt) y el tick
+        de alertas (idempotente). El receptor webhook pasa ingest_mqtt=False:
+        ingesta por HTTP y ya tiene el log como escritor.
+        """
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+        from utils.ttn import _start_mqtt_client_if_needed
+        if self.log is None or not ingest_mqtt or os.environ.get("LORA_BACKEND", "mqtt").lower() != "mqtt":
+            pass
+        elif self.log.writing:
+            self.mqtt_client = _start_mqtt_client_if_needed(self.ingest_batch)
+        elif not self.log.acquire_writer():
+            # otro proceso (ingestor.py u otro worker) ya ingesta: seguir su log
+            print("Log %s en uso por otro proceso: sin cliente MQTT, siguiendo el log." % self.log.directory)
+        else:
+            self.mqtt_client = _start_mqtt_client_if_needed(self.ingest_batch)
+            if self.mqtt_client is None:
+                # sin broker configurado: soltar el log que se tomó aquí
+                self.log.close()
+        threading.Thread(target=self._tick_loop, daemon=True).start()
+        return self
+
+    def tick(self, now=None):
+        """
+        Incorpora datos de otro proceso (si aplica), evalúa alertas y geocercas
+        y, si llegaron datos, reconstruye el índice espacial de las últimas
+        posiciones (spatial_version: versión de los datos con que se armó).
+        """
+        with TICK_SECONDS.time():
+            if self.dedup is not None and self.dedup.pending:
+                self._ingest_parsed(self.dedup.release())
+            self._poll_log()
+            events = self.alerts.evaluate(self.store, now)
+            version = self._version
+            if version != self.spatial_version:
+                # últimas posiciones conocidas: un frame sin fix GPS no saca al dispositivo del mapa
+                self.spatial = GridIndex(*self.store.positions())
+                self.spatial_version = version
+        for ev in events:
+            ALERT_EVENTS.inc(rule=ev.rule, state=ev.state)
+        return events
+
+    def _tick_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print("Error evaluating alerts:", e)
+            if self.recorder is not None:
+                try:
+                    self.recorder.flush_if_due()
+                except Exception as e:
+                    print("Error writing recording:", e)
+            REGISTRY.dump_if_due()
+            self._wait_tick()
+
+    def _wait_tick(self):
+        """Espera al próximo tick; entretanto entrega lo que el dedup retuvo para unir gateways."""
+        deadline = time.monotonic() + self.tick_interval
+        while not self._stopped.is_set():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            if self.dedup is None:
+                self._stopped.wait(left)
+                return
+            self._stopped.wait(min(left, max(self.dedup.merge, 0.05)))
+            try:
+                if self.dedup.pending:
+                    self._ingest_parsed(self.dedup.release())
+            except Exception as e:
+                print("Error ingesting held uplinks:", e)
+
+    def stop(self):
+        """Detiene el tick de alertas y el cliente MQTT, y sincroniza log y grabación."""
+        self._stopped.set()
+        if self.mqtt_client is not None:
+            self.mqtt_client.stop()
+        self.drain()
+        if self.log is not None:
+            self.log.flush()
+        if self.recorder is not None:
+            self.recorder.flush()
+
+    def drain(self):
+        """Guarda ya todo lo que el dedup tiene retenido; devuelve cuántos paquetes eran."""
+        if self.dedup is None or not self.dedup.pending:
+            return 0
+        outs = self.dedup.flush()
+        self._ingest_parsed(outs)
+        return len(outs)
+
+    # ---- escritura ----
+    def ingest_uplink(self, raw, topic=None):
+        """
+        Normaliza y guarda un uplink ya parseado; devuelve el paquete
+        enriquecido (aunque sea un duplicado o quede retenido para reordenar).
+        """
+        from utils.ttn import parse_uplink
+        self._require_writer()
+        t0 = time.perf_counter()
+        try:
+            out = parse_uplink(raw, topic)
+        except Exception:
+            FAILED.inc(path="single")
+            raise
+        STAGE_SECONDS.observe(time.perf_counter() - t0, path="single", stage="parse")
+        ready = self.dedup.push([(raw, out)]) if self.dedup is not None else [out]
+        if len(ready) == 1 and ready[0] is out:
+            self._ingest_one(out)
+        else:
+            self._ingest_parsed(ready)  # junto con lo que estaba retenido
+        return out
+
+    def _require_writer(self):
+        """
+        Falla (RuntimeError) si otro proceso escribe el log, antes de tocar el
+        dedup o el store: store, log y snapshot no deben divergir.
+        """
+        if self.log is None:
+            raise RuntimeError("servicio sin log: solo ingest_columns(to_log=False)")
+        if not self.log.acquire_writer():
+            raise RuntimeError("otro proceso ya escribe en %s" % self.log.directory)
+
+    def _ingest_one(self, out):
+        t1 = time.perf_counter()
+        device_id = out["device_id"]
+        rec = get_normalizer(out.get("model_id")).normalize(out.get("payload"))
+        rec["timestamp"] = out["timestamp"]
+        t2 = time.perf_counter()
+        self.store.append(device_id, rec)
+        t3 = time.perf_counter()
+        self.log.append(device_id, rec, raw=out)
+        if self.recorder is not None:
+            self.recorder.append(device_id, rec)
+        t4 = time.perf_counter()
+        with self._lock:
+            self._devices[device_id] = out
+            self._last = out
+            self._version += 1
+        PACKETS.inc(path="single")
+        for stage, dt in (("normalize", t2 - t1), ("store", t3 - t2), ("log", t4 - t3)):
+            STAGE_SECONDS.observe(dt, path="single", stage=stage)
+
+    def ingest_batch(self, items, topic=None):
+        """
+        Procesa una lista de uplinks con normalización por columnas (una pasada
+        por modelo de dispositivo); devuelve cuántos fallaron. Los frames
+        binarios sin decoded_payload se decodifican en bloque. `topic` es uno
+        para todo el lote o una lista alineada con items (cliente MQTT).
+        """
+        from utils.ttn import parse_uplink
+        self._require_writer()
+        BATCH_SIZE.observe(len(items))
+        t0 = time.perf_counter()
+        topics = topic if isinstance(topic, (list, tuple)) else [topic] * len(items)
+        pairs, failed = [], 0
+        for raw, tp in zip(items, topics):
+            try:
+                pairs.append((raw, parse_uplink(raw, tp, decode=False)))
+            except Exception as e:
+                failed += 1
+                print("Error processing uplink:", e)
+        if failed:
+            FAILED.inc(failed, path="batch")
+        t1 = time.perf_counter()
+        outs = self.dedup.push(pairs) if self.dedup is not None else [out for _, out in pairs]
+        t2 = time.perf_counter()
+        STAGE_SECONDS.observe(t1 - t0, path="batch", stage="parse")
+        STAGE_SECONDS.observe(t2 - t1, path="batch", stage="dedup")
+        self._ingest_parsed(outs)
+        return failed
+
+    def _ingest_parsed(self, outs):
+        """Decodifica, normaliza por columnas y guarda paquetes de parse_uplink(decode=False)."""
+        if not outs:
+            return
+        t1 = time.perf_counter()
+        self._decode_frames(outs)
+        t2 = time.perf_counter()
+
+        by_model = {}
+        for i, out in enumerate(outs):
+            by_model.setdefault(out.get("model_id"), []).append(i)
+        n = len(outs)
+        cols = {name: np.full(n, np.nan) for name in FIELDS}
+        for model_id, idx in by_model.items():
+            part = get_normalizer(model_id).normalize_batch(
+                [outs[i].get("payload") for i in idx], [outs[i]["timestamp"] for i in idx])
+            for name in FIELDS:
+                cols[name][idx] = part[name]
+        t3 = time.perf_counter()
+        self.ingest_columns([out["device_id"] for out in outs], cols, outs)
+        for stage, dt in (("decode", t2 - t1), ("normalize", t3 - t2)):
+            STAGE_SECONDS.observe(dt, path="batch", stage=stage)
+
+    def ingest_columns(self, device_ids, cols, outs=None, path="batch", to_log=True):
+        """
+        Guarda registros ya normalizados (columnas de FIELDS alineadas con
+        device_ids) en store, log y grabación. `outs` son los paquetes
+        enriquecidos (el raw del log y del snapshot); sin ellos el snapshot
+        recibe un paquete mínimo con el último registro de cada dispositivo.
+        to_log=False no escribe el log (reproducción: utils/replay.py).
+        """
+        n = len(device_ids)
+        if not n:
+            return
+        if to_log:
+            self._require_writer()
+        t0 = time.perf_counter()
+        self.store.append_many(device_ids, cols)
+        t1 = time.perf_counter()
+        if to_log:
+            rows = np.column_stack([cols[name] for name in FIELDS]).tolist()
+            raws = outs if outs is not None else [None] * n
+            for device_id, row, raw in zip(device_ids, rows, raws):
+                self.log.append(device_id, dict(zip(FIELDS, row)), raw=raw)
+        if self.recorder is not None:
+            self.recorder.append_many(device_ids, cols)
+        t2 = time.perf_counter()
+        if outs is None:
+            last = sorted({device_id: i for i, device_id in enumerate(device_ids)}.values())
+            vals = np.column_stack([cols[name][last] for name in FIELDS]).tolist()
+            pairs = []
+            for i, row in zip(last, vals):
+                rec = dict(zip(FIELDS, row))
+                ts = rec.pop("timestamp")
+                pairs.append((device_ids[i], {
+                    "received_topic": None, "device_id": device_ids[i], "timestamp": ts,
+                    "payload": {k: v for k, v in rec.items() if v == v}}))  # sin NaN
+        else:
+            pairs = list(zip(device_ids, outs))
+        with self._lock:
+            for device_id, out in pairs:
+                self._devices[device_id] = out
+            self._last = pairs[-1][1]
+            self._version += n
+        PACKETS.inc(n, path=path)
+        STAGE_SECONDS.observe(t1 - t0, path=path, stage="store")
+        if to_log:
+            STAGE_SECONDS.observe(t2 - t1, path=path, stage="log")
+
+    @staticmethod
+    def _decode_frames(outs):
+        """Decodifica en un lote los frm_payload que llegaron sin decoded_payload."""
+        idx, frames, ports = [], [], []
+        for i, out in enumerate(outs):
+            up = out["payload"].get("raw_uplink") if isinstance(out["payload"], dict) else None
+            if not isinstance(up, dict) or not up.get("frm_payload"):
+                continue
+            try:
+                frames.append(base64.b64decode(up["frm_payload"], validate=True))
+            except (binascii.Error, TypeError, ValueError):
+                continue
+            idx.append(i)
+            ports.append(up.get("f_port"))
+        if not idx:
+            return
+        for i, dec in zip(idx, DEFAULT_REGISTRY.decode_batch(frames, ports)):
+            if dec is not None:
+                outs[i]["payload"] = dec
+
+    # ---- lectura ----
+    @property
+    def version(self):
+        return self._version
+
+    def _poll_log(self):
+        """
+        Incorpora los paquetes escritos en el log por otro proceso (webhook).
+        Lo llaman las sesiones (snapshot()) y el tick: si otro hilo ya está
+        leyendo, se vuelve sin esperar (ese hilo trae lo nuevo).
+        """
+        if self.log is None or self.mqtt_client is not None or self.log.writing:
+            return
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            self._poll_log_locked()
+        finally:
+            self._poll_lock.release()
+
+    def _poll_log_locked(self):
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return
+        self._last_poll = now
+        with STAGE_SECONDS.time(path="follow", stage="read"):
+            rows, self._log_pos = self.log.read_since(self._log_pos)
+        if not rows:
+            return
+        with STAGE_SECONDS.time(path="follow", stage="store"):
+            for device_id, vals, _ in rows:
+                self.store.append(device_id, dict(zip(FIELDS, vals)))
+        PACKETS.inc(len(rows), path="follow")
+        with self._lock:
+            for device_id, _, raw in rows:
+                if raw is not None:
+                    self._devices[device_id] = raw
+            self._last = rows[-1][2]
+            self._version += 1
+
+    def snapshot(self):
+        """Snapshot versionado; se reconstruye solo si cambió la versión."""
+        self._poll_log()
+        snap = self._snapshot
+        if snap.version == self._version:
+            return snap
+        with self._lock:
+            snap = Snapshot(self._version, self._last, MappingProxyType(dict(self._devices)))
+            self._snapshot = snap
+        return snap
+
+    def history(self, device_id, field="heart_rate", since=None, until=None, max_points=1000,
+                method="lttb"):
+        """
+        Historial de un campo desde el log, reducido a ~max_points puntos
+        (utils/downsample.py). Devuelve (timestamps, valores, fuente).
+        """
+        return self.history_cache.get(device_id, field).query(since, until, max_points, method)
+
+    def latest_per_device(self):
+        """Dict device_id -> último registro normalizado (campos de FIELDS)."""
+        ids, recs = self.store.latest_all()
+        return {d: record_to_dict(r) for d, r in zip(ids, recs)}
+
+
+_SERVICE = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_service():
+    """Devuelve el IngestionService del proceso (lo crea la primera vez)."""
+    global _SERVICE
+    if _SERVICE is None:
+        with _SERVICE_LOCK:
+            if _SERVICE is None:
+                _SERVICE = IngestionService()
+    return _SERVICE
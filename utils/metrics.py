@@ -0,0 +1,332 @@
+# utils/metrics.py
+"""
+Instrumentación de bajo costo: contadores, gauges e histogramas en memoria,
+exportados en el formato de texto de Prometheus.
+
+    from utils.metrics import REGISTRY
+    PACKETS = REGISTRY.counter("ingest_packets_total", "Paquetes guardados", ("source",))
+    PACKETS.inc(10, source="webhook")
+    with REGISTRY.histogram("ingest_stage_seconds", "...", ("stage",)).time(stage="parse"):
+        ...
+
+Cada proceso (receptor FastAPI, dashboard Streamlit) tiene su REGISTRY con
+las etiquetas `process` y `pid` (varios workers del dashboard comparten el
+nombre de proceso; el pid separa sus series). Los procesos vuelcan su estado cada METRICS_DUMP_S
+segundos a METRICS_DIR (JSON) y el /metrics del receptor une el propio con
+los volcados recientes de los demás, así un solo endpoint cubre ingesta y
+render.
+
+SamplingProfiler: muestreo de pilas de todos los hilos (sys._current_frames)
+que se puede activar y desactivar en caliente; produce pilas colapsadas
+(formato de flamegraph.pl / speedscope). Mientras exista METRICS_DIR/profile.on
+(lo crea POST /debug/profiler/start del receptor) todos los procesos perfilan
+y vuelcan sus pilas a METRICS_DIR/<process>-<pid>.folded junto a las métricas.
+"""
+
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+
+DEFAULT_METRICS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "metrics")
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Timer:
+    """Context manager que observa la duración en un histograma."""
+
+    __slots__ = ("hist", "labels", "t0")
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("%s espera las etiquetas %r" % (self.name, self.labelnames))
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self):
+        """[(sufijo, {etiqueta: valor}, valor)]"""
+        with self._lock:
+            items = list(self._values.items())
+        return [("", dict(zip(self.labelnames, k)), v) for k, v in items]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, n=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, n=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """with hist.time(etiqueta=...): observa la duración del bloque."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self._values.items()]
+        out = []
+        for key, (counts, total, n) in items:
+            labels = dict(zip(self.labelnames, key))
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                out.append(("_bucket", dict(labels, le=_fmt(le)), acc))
+            out.append(("_sum", labels, total))
+            out.append(("_count", labels, n))
+        return out
+
+
+def _fmt(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    """Métricas de un proceso (ver docstring del módulo)."""
+
+    def __init__(self, process=None):
+        self.process = process or "pid-%d" % os.getpid()
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._last_dump = 0.0
+
+    def _get(self, cls, name, help, labelnames, **kw):
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = cls(name, help, labelnames, **kw)
+            elif not isinstance(m, cls):
+                raise ValueError("la métrica %r ya existe como %s" % (name, m.kind))
+            return m
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        """Estado serializable: {nombre: {kind, help, samples}} con las etiquetas process y pid."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        pid = str(os.getpid())
+        out = {}
+        for m in metrics:
+            samples = [[suffix, dict(labels, process=self.process, pid=pid), value]
+                       for suffix, labels, value in m.samples()]
+            out[m.name] = {"kind": m.kind, "help": m.help, "samples": samples}
+        return out
+
+    def render(self, others=()):
+        """Texto de Prometheus con este proceso y los snapshots `others`."""
+        families = {}
+        for snap in (self.snapshot(),) + tuple(others):
+            for name, fam in snap.items():
+                f = families.setdefault(name, {"kind": fam["kind"], "help": fam["help"], "samples": []})
+                f["samples"].extend(fam["samples"])
+        lines = []
+        for name in sorted(families):
+            f = families[name]
+            lines.append("# HELP %s %s" % (name, f["help"]))
+            lines.append("# TYPE %s %s" % (name, f["kind"]))
+            for suffix, labels, value in f["samples"]:
+                lab = ",".join('%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items()))
+                lines.append("%s%s{%s} %s" % (name, suffix, lab, _fmt(value)))
+        return "\n".join(lines) + "\n"
+
+    # ---- volcado entre procesos ----
+    def _dump_path(self, directory):
+        return os.path.join(directory, "%s-%d.json" % (self.process, os.getpid()))
+
+    def dump(self, directory=None):
+        """
+        Escribe el snapshot en METRICS_DIR (reemplazo atómico) y sincroniza el
+        perfilador con METRICS_DIR/profile.on.
+        """
+        directory = directory or os.environ.get("METRICS_DIR", DEFAULT_METRICS_DIR)
+        os.makedirs(directory, exist_ok=True)
+        path = self._dump_path(directory)
+        _write_atomic(path, json.dumps(self.snapshot()))
+        if os.path.exists(os.path.join(directory, PROFILE_FLAG)):
+            PROFILER.start(reset=False)
+        elif PROFILER.running:
+            PROFILER.stop()
+        if PROFILER.samples:
+            _write_atomic(path[:-5] + ".folded", PROFILER.collapsed())
+        self._last_dump = time.monotonic()
+
+    def dump_if_due(self, interval=None):
+        interval = float(os.environ.get("METRICS_DUMP_S", "5")) if interval is None else interval
+        if time.monotonic() - self._last_dump >= interval:
+            try:
+                self.dump()
+            except OSError as e:
+                print("Error dumping metrics:", e)
+
+    def collect(self, directory=None, max_age=60.0):
+        """Snapshots de los otros procesos volcados hace menos de max_age s."""
+        directory = directory or os.environ.get("METRICS_DIR", DEFAULT_METRICS_DIR)
+        own = self._dump_path(directory)
+        out = []
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return out
+        now = time.time()
+        for name in names:
+            path = os.path.join(directory, name)
+            if not name.endswith(".json") or path == own:
+                continue
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    continue
+                with open(path, "r", encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return out
+
+
+def _write_atomic(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+PROFILE_FLAG = "profile.on"
+REGISTRY = Registry(os.environ.get("METRICS_PROCESS"))
+
+
+class SamplingProfiler:
+    """
+    Muestrea las pilas de todos los hilos cada `interval` s en un hilo propio.
+    collapsed() devuelve "marco;marco;marco N" por línea (pila más frecuente
+    primero). start()/stop() se pueden llamar en cualquier momento.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks = _Tally()
+        self._lock = threading.Lock()  # _stacks: lo escribe _run y lo lee collapsed()
+        self._thread = None
+        self._stop = threading.Event()
+        self.samples = 0
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, reset=True):
+        if self.running:
+            return self
+        if reset:
+            with self._lock:
+                self._stacks = _Tally()
+                self.samples = 0
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def collapsed(self, limit=None):
+        with self._lock:
+            stacks = self._stacks.copy()
+        return "\n".join("%s %d" % (s, n) for s, n in stacks.most_common(limit)) + "\n"
+
+
+PROFILER = SamplingProfiler(float(os.environ.get("PROFILER_INTERVAL_S", "0.005")))
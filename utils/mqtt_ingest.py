@@ -0,0 +1,188 @@
+# utils/mqtt_ingest.py
+"""
+Cliente MQTT de ingesta (LORA_BACKEND=mqtt).
+
+El hilo de red de paho solo encola los mensajes; nunca parsea ni escribe a
+disco, así los keepalives no se atrasan durante una ráfaga:
+
+    broker ──> hilo de red (paho) ──> colas acotadas ──> workers ──> on_batch(items, topics)
+
+ - Reconexión: paho reintenta solo con espera exponencial entre
+   MQTT_RECONNECT_MIN y MQTT_RECONNECT_MAX segundos (también la primera
+   conexión) y al reconectar se vuelven a pedir las suscripciones.
+ - Varios topics (MQTT_TOPIC separado por comas) con la QoS de MQTT_QOS.
+ - Suscripciones compartidas: con MQTT_SHARE_GROUP=g cada topic se pide como
+   $share/g/<topic> y el broker reparte los mensajes entre los procesos del
+   grupo (cada proceso necesita su propio LOG_DIR: el log tiene un solo
+   escritor).
+ - Cada worker tiene su cola; los mensajes se reparten por hash del topic
+   (en TTN, un topic por dispositivo), así que el orden por dispositivo se
+   mantiene. Si una cola se llena, el hilo de red espera como mucho
+   MQTT_ENQUEUE_TIMEOUT s y después descarta el mensaje (mqtt_dropped_total).
+ - Los workers juntan hasta MQTT_BATCH_MAX mensajes por llamada a on_batch
+   (IngestionService.ingest_batch).
+
+CONFIGURACIÓN (variables de entorno):
+- MQTT_HOST, MQTT_PORT (1883), MQTT_USER, MQTT_PASS, MQTT_CLIENT_ID
+- MQTT_TOPIC ("#"), MQTT_QOS (1), MQTT_SHARE_GROUP, MQTT_KEEPALIVE (60)
+- MQTT_RECONNECT_MIN (1), MQTT_RECONNECT_MAX (60)
+- MQTT_WORKERS (2), MQTT_QUEUE_MAX (20000), MQTT_BATCH_MAX (500),
+  MQTT_ENQUEUE_TIMEOUT (1.0)
+"""
+
+import json
+import os
+import queue
+import threading
+import zlib
+
+from utils.metrics import REGISTRY
+
+MQTT_MESSAGES = REGISTRY.counter("mqtt_messages_total", "Mensajes MQTT recibidos")
+MQTT_DROPPED = REGISTRY.counter("mqtt_dropped_total", "Mensajes MQTT descartados con la cola llena")
+MQTT_ERRORS = REGISTRY.counter("mqtt_errors_total", "Errores del cliente MQTT", ("kind",))
+MQTT_RECONNECTS = REGISTRY.counter("mqtt_reconnects_total", "Reconexiones al broker MQTT")
+MQTT_CONNECTED = REGISTRY.gauge("mqtt_connected", "1 si hay conexión con el broker")
+MQTT_QUEUE_DEPTH = REGISTRY.gauge("mqtt_queue_depth", "Mensajes en espera por worker", ("worker",))
+
+
+def subscription_topics(topics, share_group=None):
+    """Topics a pedir al broker, con el prefijo $share/<grupo>/ si corresponde."""
+    if isinstance(topics, str):
+        topics = topics.split(",")
+    out = [t.strip() for t in topics if t.strip()]
+    if share_group:
+        out = ["$share/%s/%s" % (share_group, t) for t in out]
+    return out
+
+
+class MqttIngestor:
+    """Cliente MQTT con reconexión, colas acotadas y workers (ver docstring del módulo)."""
+
+    def __init__(self, on_batch, host, port=1883, topics="#", qos=1, share_group=None,
+                 username=None, password=None, client_id="", keepalive=60,
+                 reconnect_min=1, reconnect_max=60, workers=2, queue_max=20000,
+                 batch_max=500, enqueue_timeout=1.0):
+        self.on_batch = on_batch
+        self.host = host
+        self.port = int(port)
+        self.topics = subscription_topics(topics, share_group)
+        self.qos = int(qos)
+        self.keepalive = int(keepalive)
+        self.batch_max = int(batch_max)
+        self.enqueue_timeout = float(enqueue_timeout)
+        self.connects = 0
+        self._stop = threading.Event()
+        n = max(1, int(workers))
+        self._queues = [queue.Queue(maxsize=max(1, int(queue_max) // n)) for _ in range(n)]
+        self._workers = []
+
+        import paho.mqtt.client as mqtt
+        if hasattr(mqtt, "CallbackAPIVersion"):  # paho-mqtt >= 2
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        else:
+            self.client = mqtt.Client(client_id=client_id)
+        if username:
+            self.client.username_pw_set(username, password or None)
+        self.client.reconnect_delay_set(int(reconnect_min), int(reconnect_max))
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+
+    @classmethod
+    def from_env(cls, on_batch):
+        """Instancia configurada con las variables MQTT_* o None si falta MQTT_HOST."""
+        env = os.environ.get
+        if not env("MQTT_HOST"):
+            return None
+        return cls(on_batch, env("MQTT_HOST"), port=env("MQTT_PORT", "1883"),
+                   topics=env("MQTT_TOPIC", "#"),  # suscribir por defecto a todo
+                   qos=env("MQTT_QOS", "1"), share_group=env("MQTT_SHARE_GROUP"),
+                   username=env("MQTT_USER"), password=env("MQTT_PASS"),
+                   client_id=env("MQTT_CLIENT_ID", ""), keepalive=env("MQTT_KEEPALIVE", "60"),
+                   reconnect_min=env("MQTT_RECONNECT_MIN", "1"),
+                   reconnect_max=env("MQTT_RECONNECT_MAX", "60"),
+                   workers=env("MQTT_WORKERS", "2"), queue_max=env("MQTT_QUEUE_MAX", "20000"),
+                   batch_max=env("MQTT_BATCH_MAX", "500"),
+                   enqueue_timeout=env("MQTT_ENQUEUE_TIMEOUT", "1.0"))
+
+    # ---- ciclo de vida ----
+    def start(self):
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._work, args=(i, q), name="mqtt-worker-%d" % i, daemon=True)
+            t.start()
+            self._workers.append(t)
+        # connect_async + loop_start: el hilo de paho conecta y reconecta con
+        # espera exponencial, aunque el broker no esté al arrancar
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.client.loop_start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """Desconecta, procesa lo que quedó en las colas y detiene los workers."""
+        self.client.disconnect()
+        self.client.loop_stop()
+        self._stop.set()
+        for t in self._workers:
+            t.join(timeout)
+        self._workers = []
+
+    @property
+    def pending(self):
+        return sum(q.qsize() for q in self._queues)
+
+    # ---- callbacks del hilo de red ----
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            MQTT_ERRORS.inc(kind="connect")
+            print("MQTT connect failed rc=", rc)
+            return
+        if self.connects:
+            MQTT_RECONNECTS.inc()
+        self.connects += 1
+        MQTT_CONNECTED.set(1)
+        client.subscribe([(t, self.qos) for t in self.topics])
+
+    def _on_disconnect(self, client, userdata, *args):
+        # paho 1: (rc); paho 2: (flags, reason_code, properties)
+        rc = args[1] if len(args) > 1 else args[0]
+        MQTT_CONNECTED.set(0)
+        if rc != 0 and not self._stop.is_set():
+            MQTT_ERRORS.inc(kind="disconnect")
+            print("MQTT disconnected rc=", rc, "(reconectando)")
+
+    def _on_message(self, client, userdata, msg):
+        MQTT_MESSAGES.inc()
+        q = self._queues[zlib.crc32(msg.topic.encode("utf-8")) % len(self._queues)]
+        try:
+            q.put((msg.topic, msg.payload), timeout=self.enqueue_timeout)
+        except queue.Full:
+            MQTT_DROPPED.inc()
+
+    # ---- workers ----
+    def _work(self, i, q):
+        while not (self._stop.is_set() and q.empty()):
+            try:
+                batch = [q.get(timeout=0.2)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            MQTT_QUEUE_DEPTH.set(q.qsize(), worker=i)
+            items, topics = [], []
+            for topic, payload in batch:
+                # TTN envía JSON; si no lo es se guarda el texto crudo
+                try:
+                    raw = json.loads(payload)
+                except ValueError:
+                    raw = {"raw": payload.decode("utf-8", "replace")}
+                items.append(raw)
+                topics.append(topic)
+            try:
+                self.on_batch(items, topics)
+            except Exception as e:
+                MQTT_ERRORS.inc(kind="ingest")
+                print("Error processing mqtt messages:", e)
@@ -0,0 +1,160 @@
+# utils/normalize.py
+"""
+Normalización de payloads decodificados de la pulsera.
+
+Un Normalizer compila una sola vez el mapa de alias (p. ej. "hr", "pulse" ->
+heart_rate) en una tabla alias -> (columna, prioridad). Sirve a los dos caminos:
+ - normalize(payload): un paquete -> dict con los campos encontrados (dashboard)
+ - normalize_batch(payloads): lista de paquetes -> columnas NumPy en una pasada,
+   con NaN para los campos que faltan y una columna `raw` con el payload
+   original cuando no se reconoció ningún campo (ingesta y backfills).
+
+Los alias pueden ajustarse por modelo de dispositivo (model_id de TTN) con un
+archivo JSON (variable NORMALIZERS_FILE):
+
+    {
+      "default":    {"heart_rate": ["heart_rate", "hr", "pulse"]},
+      "pulsera-v2": {"heart_rate": ["bpm"], "smoke": ["ppm"]}
+    }
+
+Los campos no indicados para un modelo usan los alias por defecto.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from utils.store import FIELDS
+
+# alias aceptados para cada campo, en orden de preferencia
+DEFAULT_ALIASES = {
+    "temperature": ("temperature", "temp", "t"),
+    "heart_rate": ("heart_rate", "hr", "pulse"),
+    "smoke": ("smoke", "co", "gas", "air_quality"),
+    "movement": ("movement", "motion", "accel_mag"),
+    "battery": ("battery",),
+}
+GPS_KEYS = ("gps", "location")
+VALUE_FIELDS = tuple(DEFAULT_ALIASES) + ("lat", "lon")
+
+_NAN = float("nan")
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return _NAN
+
+
+class Normalizer:
+    """Mapa de alias compilado (ver docstring del módulo)."""
+
+    def __init__(self, aliases=None):
+        merged = dict(DEFAULT_ALIASES)
+        for field, keys in (aliases or {}).items():
+            if field not in DEFAULT_ALIASES:
+                raise ValueError("campo desconocido en alias: %r" % field)
+            merged[field] = tuple(keys)
+        self.aliases = merged
+        # alias -> (campo, prioridad); la prioridad menor gana
+        self._table = {}
+        for field, keys in merged.items():
+            for rank, key in enumerate(keys):
+                self._table.setdefault(key, (field, rank))
+
+    def _match(self, payload):
+        """Devuelve {campo: valor} usando el alias de mayor prioridad presente."""
+        found, ranks = {}, {}
+        table = self._table
+        for key, value in payload.items():
+            hit = table.get(key)
+            if hit is None:
+                continue
+            field, rank = hit
+            if rank < ranks.get(field, len(self.aliases[field])):
+                found[field] = value
+                ranks[field] = rank
+        if "lat" in payload and "lon" in payload:
+            found["lat"], found["lon"] = payload["lat"], payload["lon"]
+        else:
+            gps = None
+            for key in GPS_KEYS:
+                gps = payload.get(key)
+                if gps:
+                    break
+            if isinstance(gps, dict):
+                found["lat"], found["lon"] = gps.get("lat", 0), gps.get("lon", 0)
+        return found
+
+    def normalize(self, payload):
+        """
+        Un payload (dict) -> dict con los campos reconocidos. Los valores se
+        conservan tal cual salvo lat/lon, que se convierten a float.
+        """
+        if not isinstance(payload, dict):
+            return {}
+        found = self._match(payload)
+        if "lat" in found:
+            found["lat"], found["lon"] = float(found["lat"]), float(found["lon"])
+        return found
+
+    def normalize_batch(self, payloads, timestamps=None):
+        """
+        Lista de payloads -> dict de columnas: un arreglo float64 por campo de
+        FIELDS (NaN si falta) y "raw", un arreglo de objetos con el payload
+        cuando no se reconoció ningún campo (None en otro caso).
+        """
+        n = len(payloads)
+        cols = {name: [_NAN] * n for name in VALUE_FIELDS}
+        raw = [None] * n
+        for i, payload in enumerate(payloads):
+            found = self._match(payload) if isinstance(payload, dict) else None
+            if not found:
+                raw[i] = payload
+                continue
+            for name, value in found.items():
+                cols[name][i] = _to_float(value)
+        out = {name: np.asarray(cols[name], dtype=np.float64) for name in VALUE_FIELDS}
+        if timestamps is None:
+            out["timestamp"] = np.full(n, np.nan)
+        else:
+            out["timestamp"] = np.asarray(timestamps, dtype=np.float64)
+        out["raw"] = np.empty(n, dtype=object)
+        out["raw"][:] = raw
+        return out
+
+    def to_frame(self, payloads, timestamps=None):
+        """Igual que normalize_batch pero como pandas.DataFrame."""
+        import pandas as pd
+        cols = self.normalize_batch(payloads, timestamps)
+        return pd.DataFrame({name: cols[name] for name in FIELDS + ("raw",)})
+
+
+_DEFAULT = Normalizer()
+_BY_MODEL = None
+
+
+def _load_models():
+    path = os.environ.get("NORMALIZERS_FILE")
+    models = {}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+        base = cfg.get("default", {})
+        for model, aliases in cfg.items():
+            merged = dict(base)
+            merged.update(aliases)
+            models[model] = Normalizer(merged)
+    return models
+
+
+def get_normalizer(model_id=None):
+    """Normalizer del modelo indicado (o el por defecto), compilado una sola vez."""
+    global _BY_MODEL
+    if _BY_MODEL is None:
+        _BY_MODEL = _load_models()
+    if model_id is None:
+        return _BY_MODEL.get("default", _DEFAULT)
+    return _BY_MODEL.get(model_id) or _BY_MODEL.get("default", _DEFAULT)
@@ -0,0 +1,254 @@
+# utils/recorder.py
+"""
+Grabación de la telemetría normalizada en archivos columnares (Parquet) para
+revisar después lo que mostró el dashboard (reproducción: utils/replay.py).
+
+Estructura (particiones estilo Hive):
+
+    RECORDER_DIR/day=2026-10-18/bucket=3/part-<inicio>-<pid>-<n>.parquet
+
+ - day: fecha UTC de la muestra.
+ - bucket: crc32(device_id) % RECORDER_BUCKETS. Una carpeta por dispositivo
+   dejaría miles de archivos diminutos por volcado en flotas grandes; con
+   cubetas, un filtro por dispositivo descarta las demás carpetas.
+   RECORDER_BUCKETS no debe cambiar en un directorio que ya tiene grabaciones.
+ - Las filas se acumulan en memoria (append_many recibe las mismas columnas
+   que el store) y se escriben cada RECORDER_FLUSH_S s o al juntar
+   RECORDER_FLUSH_ROWS, desde el tick del servicio de ingesta.
+ - Los días cerrados (anteriores al actual y sin filas en el último volcado)
+   se compactan a un archivo por cubeta, ordenado por timestamp: la
+   reproducción pide ventanas de tiempo de toda la flota y las estadísticas
+   de los row groups descartan el resto del día. Varios procesos pueden
+   grabar en el mismo RECORDER_DIR: compacta uno a la vez (flock sobre
+   _compact.lock, con "_" para que pyarrow.dataset lo ignore) y los demás
+   se saltan la compactación.
+
+read(since, until, device_ids) filtra con pyarrow.dataset sobre la partición
+(day, bucket) y sobre las columnas (timestamp, device_id): solo se abren los
+archivos y row groups que pueden tener filas del rango.
+
+Requiere pyarrow (opcional: sin pyarrow no se graba). Se importa al primer
+volcado o lectura, no al importar el módulo (tarda ~0.4 s).
+
+CONFIGURACIÓN (variables de entorno):
+- RECORDER_ENABLED (1), RECORDER_DIR (data/recordings)
+- RECORDER_BUCKETS (8), RECORDER_FLUSH_S (300), RECORDER_FLUSH_ROWS (500000)
+"""
+
+import fcntl
+import importlib.util
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import numpy as np
+
+from utils.store import FIELDS
+
+DEFAULT_RECORDER_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "recordings")
+DAY_S = 86400
+ROW_GROUP_ROWS = 65536
+# timestamp y posición en f8; el resto de las variables cabe en f4
+FLOAT64_FIELDS = ("timestamp", "lat", "lon")
+
+# pyarrow y los esquemas: los carga _arrow() al primer uso
+pa = pc = ds = pq = None
+SCHEMA = PARTITION_SCHEMA = PARTITIONING = DATASET_SCHEMA = None
+
+
+def available():
+    """True si pyarrow está instalado (sin importarlo)."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _arrow():
+    global pa, pc, ds, pq, SCHEMA, PARTITION_SCHEMA, PARTITIONING, DATASET_SCHEMA
+    if pa is not None:
+        return
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+    SCHEMA = pyarrow.schema([("device_id", pyarrow.string())] + [
+        (name, pyarrow.float64() if name in FLOAT64_FIELDS else pyarrow.float32()) for name in FIELDS])
+    PARTITION_SCHEMA = pyarrow.schema([("day", pyarrow.string()), ("bucket", pyarrow.int32())])
+    PARTITIONING = pyarrow.dataset.partitioning(PARTITION_SCHEMA, flavor="hive")
+    DATASET_SCHEMA = pyarrow.schema(list(SCHEMA) + list(PARTITION_SCHEMA))
+    pc, ds, pq = pyarrow.compute, pyarrow.dataset, pyarrow.parquet
+    pa = pyarrow  # al final: otro hilo que vea pa ya tiene los esquemas
+
+
+def recordings_dir():
+    return os.environ.get("RECORDER_DIR", DEFAULT_RECORDER_DIR)
+
+
+def recorder_options():
+    """Parámetros de SessionRecorder según RECORDER_* (los mismos al grabar y al leer)."""
+    return {"buckets": int(os.environ.get("RECORDER_BUCKETS", "8")),
+            "flush_interval": float(os.environ.get("RECORDER_FLUSH_S", "300")),
+            "flush_rows": int(os.environ.get("RECORDER_FLUSH_ROWS", "500000"))}
+
+
+def device_bucket(device_id, buckets):
+    return zlib.crc32(device_id.encode("utf-8")) % buckets
+
+
+def _day(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+class SessionRecorder:
+    """Grabación particionada por día y cubeta de dispositivo (ver docstring del módulo)."""
+
+    def __init__(self, directory, buckets=8, flush_interval=300.0, flush_rows=500000):
+        if not available():
+            raise RuntimeError("SessionRecorder requiere pyarrow (pip install pyarrow)")
+        self.directory = directory
+        self.buckets = int(buckets)
+        self.flush_interval = float(flush_interval)
+        self.flush_rows = int(flush_rows)
+        self._lock = threading.Lock()        # buffer
+        self._write_lock = threading.Lock()  # escritura y compactación
+        self._chunks = []
+        self._rows = 0
+        self._last_flush = time.monotonic()
+        self._seq = 0
+
+    @classmethod
+    def from_env(cls):
+        """Grabador configurado por RECORDER_*; None si está deshabilitado o falta pyarrow."""
+        if os.environ.get("RECORDER_ENABLED", "1") != "1" or not available():
+            return None
+        return cls(recordings_dir(), **recorder_options())
+
+    # ---- escritura ----
+    def append(self, device_id, rec):
+        self.append_many([device_id], {name: np.array([rec.get(name)], dtype=np.float64)
+                                       for name in FIELDS})
+
+    def append_many(self, device_ids, columns):
+        """Encola filas (columnas de FIELDS alineadas con device_ids); no escribe a disco."""
+        chunk = (list(device_ids), {name: np.asarray(columns[name], dtype=np.float64) for name in FIELDS})
+        with self._lock:
+            self._chunks.append(chunk)
+            self._rows += len(chunk[0])
+
+    @property
+    def pending(self):
+        return self._rows
+
+    def flush_if_due(self):
+        if self._rows and (self._rows >= self.flush_rows or
+                           time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Escribe lo acumulado (un archivo por día y cubeta); devuelve las filas escritas."""
+        with self._lock:
+            chunks, self._chunks, self._rows = self._chunks, [], 0
+            self._last_flush = time.monotonic()
+        if not chunks:
+            return 0
+        _arrow()
+        with self._write_lock:
+            ids = np.array([d for c in chunks for d in c[0]], dtype=object)
+            cols = {name: np.concatenate([c[1][name] for c in chunks]) for name in FIELDS}
+            uniq, inv = np.unique(ids, return_inverse=True)
+            bucket = np.array([device_bucket(d, self.buckets) for d in uniq], dtype=np.int64)[inv]
+            day = np.floor(cols["timestamp"] / DAY_S).astype(np.int64)
+            # (día, cubeta, dispositivo, tiempo): cada archivo sale ordenado
+            order = np.lexsort((cols["timestamp"], inv, bucket, day))
+            day, bucket = day[order], bucket[order]
+            bounds = np.flatnonzero((day[1:] != day[:-1]) | (bucket[1:] != bucket[:-1])) + 1
+            written = set()
+            for s, e in zip(np.r_[0, bounds].tolist(), np.r_[bounds, len(order)].tolist()):
+                rows = order[s:e]
+                written.add(_day(day[s] * DAY_S))
+                self._write(_day(day[s] * DAY_S), int(bucket[s]), ids[rows],
+                            {name: cols[name][rows] for name in FIELDS})
+        # días cerrados: anteriores a hoy y sin filas en este volcado
+        today = _day(time.time())
+        for d in self.days():
+            if d < today and d not in written:
+                self.compact(d)
+        return len(ids)
+
+    def _write(self, day, bucket, ids, cols):
+        folder = os.path.join(self.directory, "day=%s" % day, "bucket=%d" % bucket)
+        os.makedirs(folder, exist_ok=True)
+        table = pa.table([pa.array(ids, type=pa.string())] +
+                         [pa.array(cols[f], type=SCHEMA.field(f).type) for f in FIELDS],
+                         schema=SCHEMA)
+        self._write_table(folder, table)
+
+    def _write_table(self, folder, table):
+        self._seq += 1
+        first = pc.min(table.column("timestamp")).as_py() or 0
+        name = "part-%d-%d-%d.parquet" % (first, os.getpid(), self._seq)
+        # los nombres con "_" los ignora pyarrow.dataset hasta el rename
+        tmp = os.path.join(folder, "_" + name + ".tmp")
+        pq.write_table(table, tmp, row_group_size=ROW_GROUP_ROWS, compression="zstd")
+        os.replace(tmp, os.path.join(folder, name))
+        return name
+
+    def compact(self, day):
+        """
+        Une los archivos de cada cubeta de un día en uno solo. Devuelve False
+        (sin hacer nada) si otro proceso está compactando este directorio.
+        """
+        _arrow()
+        with self._write_lock, open(os.path.join(self.directory, "_compact.lock"), "a+") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+            root = os.path.join(self.directory, "day=%s" % day)
+            for sub in sorted(os.listdir(root)):
+                folder = os.path.join(root, sub)
+                parts = sorted(f for f in os.listdir(folder) if f.endswith(".parquet"))
+                if len(parts) < 2:
+                    continue
+                table = pa.concat_tables(pq.read_table(os.path.join(folder, f), schema=SCHEMA)
+                                         for f in parts)
+                table = table.sort_by([("timestamp", "ascending"), ("device_id", "ascending")])
+                self._write_table(folder, table)
+                for f in parts:
+                    os.remove(os.path.join(folder, f))
+        return True
+
+    # ---- lectura ----
+    def days(self):
+        """Días grabados ("YYYY-MM-DD"), del más viejo al más nuevo."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(n[4:] for n in names if n.startswith("day="))
+
+    def read(self, since=None, until=None, device_ids=None, columns=None):
+        """
+        Tabla pyarrow con las filas de [since, until] (y de device_ids, si se
+        indica), ordenada por timestamp.
+        """
+        _arrow()
+        columns = list(columns or SCHEMA.names)
+        if not self.days():
+            return SCHEMA.empty_table().select(columns)
+        expr = None
+        if since is not None:
+            expr = (ds.field("day") >= _day(since)) & (ds.field("timestamp") >= since)
+        if until is not None:
+            cond = (ds.field("day") <= _day(until)) & (ds.field("timestamp") <= until)
+            expr = cond if expr is None else expr & cond
+        if device_ids:
+            ids = sorted(set(device_ids))
+            cond = (ds.field("bucket").isin(sorted({device_bucket(d, self.buckets) for d in ids})) &
+                    ds.field("device_id").isin(ids))
+            expr = cond if expr is None else expr & cond
+        dataset = ds.dataset(self.directory, schema=DATASET_SCHEMA, format="parquet", partitioning=PARTITIONING)
+        table = dataset.to_table(columns=columns, filter=expr)
+        if "timestamp" in columns:
+            table = table.sort_by([("timestamp", "ascending")])
+        return table
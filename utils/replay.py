@@ -0,0 +1,147 @@
+# utils/replay.py
+"""
+Reproducción de una ventana grabada (utils/recorder.py) a 1x-100x.
+
+Replay carga la ventana con un solo read() columnar y la reinyecta con un
+reloj virtual en un IngestionService propio (store, alertas, geocercas e
+índice espacial), el mismo que usa el modo LoRaWAN en vivo: el dashboard lo
+lee igual que al servicio del proceso. Cada `step` s el reloj avanza
+step * speed segundos, se ingestan las filas hasta ese instante y se corre
+tick(now=reloj), así la histéresis y el debounce de las alertas se evalúan
+en el tiempo de la grabación.
+
+La grabación ya es la salida del normalizador, así que se entra por
+IngestionService.ingest_columns (después de normalizar); el dashboard vuelve
+a normalizar el paquete mostrado como con cualquier paquete LoRaWAN. No se
+escribe el log: el historial del gráfico sale de la ventana ya cargada (lo
+reproducido hasta el reloj).
+
+    replay = Replay(SessionRecorder(recordings_dir(), **recorder_options()), since, until, speed=10).start()
+    svc = replay.service      # snapshot(), alerts, spatial, history(), ...
+    replay.speed = 50         # se puede cambiar en marcha
+    replay.stop()
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.downsample import HistoryCache
+from utils.ingest import IngestionService
+from utils.store import FIELDS, RECORD_DTYPE, TelemetryStore
+
+SPEEDS = (1, 2, 5, 10, 25, 50, 100)
+
+
+def _widen(values):
+    """
+    Columna grabada a float64. Las de float32 se redondean a 7 cifras
+    significativas (su precisión), así 36.2 no vuelve como 36.20000076293945.
+    """
+    out = values.astype(np.float64)
+    if values.dtype != np.float32:
+        return out
+    finite = np.isfinite(out) & (out != 0)
+    scale = 10.0 ** (6 - np.floor(np.log10(np.abs(out[finite]))))
+    out[finite] = np.round(out[finite] * scale) / scale
+    return out
+
+
+class Replay:
+    """Reproducción con reloj virtual (ver docstring del módulo)."""
+
+    def __init__(self, recorder, since=None, until=None, device_ids=None, speed=10.0, step=0.2):
+        t0 = time.perf_counter()
+        table = recorder.read(since, until, device_ids)
+        self.device_ids = table.column("device_id").to_numpy(zero_copy_only=False)
+        self.cols = {name: _widen(table.column(name).to_numpy()) for name in FIELDS}
+        self.load_seconds = time.perf_counter() - t0
+        ts = self.cols["timestamp"]
+        self.start_ts = since if since is not None else (float(ts[0]) if len(ts) else time.time())
+        self.end_ts = until if until is not None else (float(ts[-1]) if len(ts) else self.start_ts)
+        if len(ts):
+            # sin tramos vacíos al principio ni al final de la ventana
+            self.start_ts = max(self.start_ts, float(ts[0]))
+            self.end_ts = min(self.end_ts, float(ts[-1]))
+        self.position = self.start_ts
+        self.speed = float(speed)
+        self.step = step
+        self._cursor = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+        # filas de cada dispositivo, en orden de tiempo (para el historial)
+        uniq, inv = np.unique(self.device_ids.astype(str), return_inverse=True)
+        order = np.argsort(inv, kind="stable")
+        bounds = np.r_[0, np.cumsum(np.bincount(inv, minlength=len(uniq)))]
+        self._rows = {d: order[bounds[k]:bounds[k + 1]] for k, d in enumerate(uniq.tolist())}
+
+        self.service = IngestionService(
+            store=TelemetryStore(capacity=int(os.environ.get("STORE_CAPACITY", "256")),
+                                 max_devices=max(len(uniq), 16)),
+            log=False, record=False)
+        self.service.history_cache = HistoryCache(self._history)
+
+    def __len__(self):
+        return len(self.device_ids)
+
+    @property
+    def progress(self):
+        span = self.end_ts - self.start_ts
+        return 1.0 if span <= 0 else min(max((self.position - self.start_ts) / span, 0.0), 1.0)
+
+    @property
+    def finished(self):
+        return self._cursor >= len(self.device_ids) and self.position >= self.end_ts
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def advance(self, seconds):
+        """Avanza el reloj virtual `seconds` e ingesta lo grabado hasta ahí."""
+        self.position = min(self.position + seconds, self.end_ts)
+        hi = int(np.searchsorted(self.cols["timestamp"], self.position, side="right"))
+        if hi > self._cursor:
+            part = slice(self._cursor, hi)
+            self.service.ingest_columns(self.device_ids[part].tolist(),
+                                        {name: self.cols[name][part] for name in FIELDS},
+                                        path="replay", to_log=False)
+            self._cursor = hi
+        return self.service.tick(self.position)
+
+    def _history(self, device_id, since=None):
+        """Registros del dispositivo ya reproducidos y posteriores a since (loader de HistoryCache)."""
+        idx = self._rows.get(device_id, np.empty(0, dtype=np.int64))
+        idx = idx[:int(np.searchsorted(idx, self._cursor))]
+        if since is not None:
+            idx = idx[self.cols["timestamp"][idx] > since]
+        out = np.empty(len(idx), dtype=RECORD_DTYPE)
+        for name in FIELDS:
+            out[name] = self.cols[name][idx]
+        return out
+
+    def _run(self):
+        last = time.monotonic()
+        while not self._stop.is_set() and not self.finished:
+            now = time.monotonic()
+            try:
+                self.advance((now - last) * self.speed)
+            except Exception as e:
+                print("Error in replay:", e)
+                break
+            last = now
+            self._stop.wait(self.step)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.service.stop()
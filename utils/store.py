@@ -0,0 +1,256 @@
+# utils/store.py
+"""
+Almacén de telemetría en memoria, por dispositivo.
+
+Cada pulsera (device_id de TTN) tiene un buffer circular de capacidad fija
+respaldado por un arreglo NumPy estructurado. El buffer está "espejado":
+cada registro se escribe dos veces (posición i e i + capacidad), de modo que
+los últimos N registros siempre forman un bloque contiguo y las consultas por
+ventana de tiempo devuelven vistas (sin copiar).
+
+Memoria: filas_reservadas * 2 * capacidad * RECORD_DTYPE.itemsize bytes.
+Las filas crecen por duplicación hasta max_devices; al llegar al límite se
+reutiliza la fila del dispositivo con el dato más antiguo.
+
+Aparte del buffer se guarda la última posición válida de cada dispositivo
+(positions()): un frame sin fix GPS trae lat/lon NaN y el mapa debe seguir
+mostrando la última posición conocida.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+# Campos normalizados que guarda cada registro (orden fijo).
+FIELDS = ("timestamp", "temperature", "heart_rate", "smoke", "movement", "battery", "lat", "lon")
+
+# timestamp y coordenadas en f8; el resto cabe en f4 sin perder precisión útil.
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "f8"),
+    ("temperature", "f4"),
+    ("heart_rate", "f4"),
+    ("smoke", "f4"),
+    ("movement", "f4"),
+    ("battery", "f4"),
+    ("lat", "f8"),
+    ("lon", "f8"),
+])
+
+
+def record_to_dict(rec):
+    """Convierte un registro del buffer a dict (NaN -> None)."""
+    out = {}
+    for name in FIELDS:
+        v = float(rec[name])
+        out[name] = None if v != v else v
+    return out
+
+
+class TelemetryStore:
+    """
+    Buffers circulares por dispositivo.
+
+    Las vistas devueltas por window()/last() apuntan al buffer interno: son
+    válidas hasta que lleguen `capacity` registros nuevos del dispositivo (o
+    hasta que el almacén crezca). Haga .copy() si necesita conservarlas.
+    """
+
+    def __init__(self, capacity=256, max_devices=10000, initial_devices=16):
+        if capacity < 1:
+            raise ValueError("capacity debe ser >= 1")
+        self.capacity = int(capacity)
+        self.max_devices = int(max_devices)
+        self._lock = threading.Lock()
+        self._slot = {}   # device_id -> fila
+        self._ids = []    # fila -> device_id
+        self._alloc(min(int(initial_devices), self.max_devices))
+        self.version = 0  # se incrementa en cada append
+
+    # ---- reserva de memoria ----
+    def _alloc(self, rows):
+        buf = np.full((rows, 2 * self.capacity), np.nan, dtype=RECORD_DTYPE)
+        head = np.zeros(rows, dtype=np.int64)
+        count = np.zeros(rows, dtype=np.int64)
+        pos = np.full((rows, 2), np.nan)  # última (lat, lon) válida
+        old = getattr(self, "_buf", None)
+        if old is not None:
+            n = old.shape[0]
+            buf[:n] = old
+            head[:n] = self._head
+            count[:n] = self._count
+            pos[:n] = self._pos
+        self._buf, self._head, self._count, self._pos = buf, head, count, pos
+
+    def _row_for(self, device_id):
+        row = self._slot.get(device_id)
+        if row is not None:
+            return row
+        n = len(self._ids)
+        if n < self._buf.shape[0]:
+            row = n
+        elif n < self.max_devices:
+            self._alloc(min(2 * self._buf.shape[0] or 1, self.max_devices))
+            row = n
+        else:
+            # lleno: reutilizar la fila con el último dato más antiguo
+            row = int(np.nanargmin(self._latest_ts_rows()))
+            del self._slot[self._ids[row]]
+            self._ids[row] = device_id
+            self._slot[device_id] = row
+            self._buf[row] = np.nan
+            self._pos[row] = np.nan
+            self._head[row] = 0
+            self._count[row] = 0
+            return row
+        self._ids.append(device_id)
+        self._slot[device_id] = row
+        return row
+
+    def _latest_ts_rows(self):
+        n = len(self._ids)
+        idx = self._head[:n] + self.capacity - 1
+        return self._buf["timestamp"][np.arange(n), idx]
+
+    # ---- escritura ----
+    def append(self, device_id, record):
+        """Agrega un registro (dict con claves de FIELDS; faltantes = NaN)."""
+        rec = np.empty((), dtype=RECORD_DTYPE)
+        for name in FIELDS:
+            v = record.get(name)
+            try:
+                rec[name] = np.nan if v is None else float(v)
+            except (TypeError, ValueError):
+                rec[name] = np.nan
+        if rec["timestamp"] != rec["timestamp"]:
+            rec["timestamp"] = time.time()
+        with self._lock:
+            row = self._row_for(device_id)
+            w = self._head[row]
+            self._buf[row, w] = rec
+            self._buf[row, w + self.capacity] = rec
+            self._head[row] = (w + 1) % self.capacity
+            if self._count[row] < self.capacity:
+                self._count[row] += 1
+            if rec["lat"] == rec["lat"] and rec["lon"] == rec["lon"]:
+                self._pos[row] = (rec["lat"], rec["lon"])
+            self.version += 1
+
+    def append_many(self, device_ids, columns):
+        """
+        Agrega un lote: device_ids (lista) y columns (dict campo -> arreglo,
+        p. ej. la salida de Normalizer.normalize_batch).
+        """
+        n = len(device_ids)
+        recs = np.empty(n, dtype=RECORD_DTYPE)
+        for name in FIELDS:
+            col = columns.get(name)
+            recs[name] = np.nan if col is None else col
+        ts = recs["timestamp"]
+        ts[np.isnan(ts)] = time.time()
+        fix = ~(np.isnan(recs["lat"]) | np.isnan(recs["lon"]))
+        cap = self.capacity
+        with self._lock:
+            if len(self._ids) + len(set(device_ids) - self._slot.keys()) > self.max_devices:
+                # habrá que reutilizar filas: de a uno, en orden
+                for i, device_id in enumerate(device_ids):
+                    row = self._row_for(device_id)
+                    w = self._head[row]
+                    self._buf[row, w] = recs[i]
+                    self._buf[row, w + cap] = recs[i]
+                    self._head[row] = (w + 1) % cap
+                    if self._count[row] < cap:
+                        self._count[row] += 1
+                    if fix[i]:
+                        self._pos[row] = (recs["lat"][i], recs["lon"][i])
+            else:
+                rows = np.fromiter((self._row_for(d) for d in device_ids), dtype=np.int64, count=n)
+                # posición de cada registro: head de su fila + los previos del lote en esa fila
+                order = np.argsort(rows, kind="stable")
+                sr = rows[order]
+                starts = np.r_[0, np.flatnonzero(sr[1:] != sr[:-1]) + 1]
+                k = np.diff(np.r_[starts, n])
+                rank = np.empty(n, dtype=np.int64)
+                rank[order] = np.arange(n) - np.repeat(starts, k)
+                w = (self._head[rows] + rank) % cap
+                # con índices repetidos (más de cap registros) queda el último
+                self._buf[rows, w] = recs
+                self._buf[rows, w + cap] = recs
+                urows = sr[starts]
+                self._head[urows] = (self._head[urows] + k) % cap
+                self._count[urows] = np.minimum(self._count[urows] + k, cap)
+                # con filas repetidas queda la última posición del lote
+                self._pos[rows[fix], 0] = recs["lat"][fix]
+                self._pos[rows[fix], 1] = recs["lon"][fix]
+            self.version += n
+
+    # ---- consultas ----
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, device_id):
+        return device_id in self._slot
+
+    def devices(self):
+        return list(self._ids)
+
+    @property
+    def nbytes(self):
+        return self._buf.nbytes + self._head.nbytes + self._count.nbytes
+
+    def last(self, device_id, n=None):
+        """Vista con los últimos n registros del dispositivo, en orden cronológico."""
+        with self._lock:
+            row = self._slot.get(device_id)
+            if row is None:
+                return self._buf[:0, 0]
+            count = int(self._count[row])
+            n = count if n is None else max(0, min(int(n), count))
+            end = int(self._head[row]) + self.capacity
+            return self._buf[row, end - n:end]
+
+    def window(self, device_id, since=None, until=None):
+        """Vista de registros con since <= timestamp <= until (sin copia)."""
+        view = self.last(device_id)
+        ts = view["timestamp"]
+        lo = 0 if since is None else int(np.searchsorted(ts, since, side="left"))
+        hi = len(ts) if until is None else int(np.searchsorted(ts, until, side="right"))
+        return view[lo:hi]
+
+    def latest(self, device_id):
+        """Último registro del dispositivo (np.void sobre el buffer) o None."""
+        view = self.last(device_id, 1)
+        return view[0] if len(view) else None
+
+    def latest_all(self):
+        """
+        Devuelve (device_ids, registros) con el último dato de cada dispositivo.
+        `registros` es una copia pequeña (un registro por dispositivo).
+        """
+        with self._lock:
+            n = len(self._ids)
+            ids = list(self._ids)
+            rows = np.arange(n)
+            recs = self._buf[rows, self._head[:n] + self.capacity - 1]
+        return ids, recs
+
+    def positions(self):
+        """(device_ids, lat, lon) con la última posición válida de cada dispositivo (NaN si nunca hubo)."""
+        with self._lock:
+            n = len(self._ids)
+            ids = list(self._ids)
+            pos = self._pos[:n].copy()
+        return ids, pos[:, 0], pos[:, 1]
+
+    def fleet_view(self):
+        """
+        (device_ids, vista (n, capacity) con cada muestra una vez y sin orden,
+        últimos registros). Para cálculos vectorizados sobre toda la flota; las
+        posiciones vacías tienen timestamp NaN.
+        """
+        with self._lock:
+            n = len(self._ids)
+            ids = list(self._ids)
+            view = self._buf[:n, :self.capacity]
+            latest = self._buf[np.arange(n), self._head[:n] + self.capacity - 1]
+        return ids, view, latest
@@ -0,0 +1,419 @@
+# utils/tslog.py
+"""
+Registro de series temporales en disco: segmentos append-only.
+
+Formato de un segmento (archivo NNNNNNNN.seg):
+    MAGIC (8 bytes) + registros
+    registro = HEADER (longitud del cuerpo, crc32 del cuerpo)
+               + BODY (timestamp, 7 campos f8, len(device_id), len(raw))
+               + device_id (utf-8) + raw (JSON utf-8, opcional)
+
+- Escritura: append con fsync por lotes (cada `flush_every` registros o
+  `fsync_interval` segundos).
+- Rotación: al superar `segment_bytes` se cierra el segmento y se guarda su
+  índice disperso en NNNNNNNN.idx (JSON).
+- Retención: se borran los segmentos más viejos que `retention_seconds` o que
+  excedan `max_segments`.
+- Índice disperso por (dispositivo, timestamp): cada `index_every` registros de
+  un dispositivo se guarda (ts, offset). Además se guardan los offsets de todos
+  los registros de cada dispositivo (uint32), de modo que una consulta por
+  rango hace una búsqueda binaria en el índice disperso y luego salta solo por
+  los registros del dispositivo con mmap, sin recorrer los de los demás.
+- Recuperación: al abrir como escritor, el último segmento se trunca en el
+  primer registro incompleto o con CRC inválido.
+
+Un solo proceso escritor por directorio (se toma un flock sobre LOCK); los
+demás procesos pueden leer y ven los registros ya sincronizados.
+"""
+
+import bisect
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+import numpy as np
+
+from utils.store import FIELDS, RECORD_DTYPE
+
+MAGIC = b"PGTSLOG1"
+HEADER = struct.Struct("<II")
+BODY = struct.Struct("<d7dHI")
+VALUE_FIELDS = FIELDS[1:]  # todo menos timestamp
+
+
+def _encode(device_id, rec, raw):
+    dev = device_id.encode("utf-8")
+    blob = b"" if raw is None else json.dumps(raw, separators=(",", ":")).encode("utf-8")
+    vals = []
+    for name in VALUE_FIELDS:
+        v = rec.get(name)
+        try:
+            vals.append(float("nan") if v is None else float(v))
+        except (TypeError, ValueError):
+            vals.append(float("nan"))
+    body = BODY.pack(float(rec["timestamp"]), *vals, len(dev), len(blob)) + dev + blob
+    return HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def _iter_records(buf, start, end, verify=True):
+    """
+    Recorre registros válidos en buf[start:end].
+    Produce (offset, siguiente_offset, ts, device_id en bytes, cuerpo_offset).
+    Se detiene en el primer registro incompleto o corrupto. verify=False omite
+    el CRC (solo para rangos ya validados por scan()/append()).
+    """
+    off = start
+    while off + HEADER.size <= end:
+        blen, crc = HEADER.unpack_from(buf, off)
+        b0 = off + HEADER.size
+        b1 = b0 + blen
+        if blen < BODY.size or b1 > end or (verify and zlib.crc32(buf[b0:b1]) != crc):
+            return
+        ts = BODY.unpack_from(buf, b0)[0]
+        dlen = struct.unpack_from("<H", buf, b0 + BODY.size - 6)[0]
+        yield off, b1, ts, buf[b0 + BODY.size:b0 + BODY.size + dlen], b0
+        off = b1
+
+
+def _unpack(buf, b0):
+    vals = BODY.unpack_from(buf, b0)
+    dlen, rlen = vals[-2], vals[-1]
+    r0 = b0 + BODY.size + dlen
+    raw = json.loads(bytes(buf[r0:r0 + rlen])) if rlen else None
+    return vals[:-2], raw
+
+
+class _SegmentIndex:
+    """
+    Índice de un segmento: disperso dispositivo -> ([ts], [offset]) y completo
+    dispositivo -> array('I') con el offset de cada registro.
+    """
+
+    def __init__(self, path, index_every):
+        self.path = path
+        self.index_every = index_every
+        self.size = len(MAGIC)  # bytes válidos escaneados
+        self.min_ts = None
+        self.max_ts = None
+        self.last_off = None
+        self.devices = {}
+        self.counts = {}
+        self.offsets = {}
+
+    def add(self, off, ts, dev):
+        n = self.counts.get(dev, 0)
+        offs = self.offsets.get(dev)
+        if offs is None:
+            offs = self.offsets[dev] = array("I")
+        offs.append(off)
+        if n % self.index_every == 0:
+            ts_list, off_list = self.devices.setdefault(dev, ([], []))
+            ts_list.append(ts)
+            off_list.append(off)
+        self.counts[dev] = n + 1
+        if self.min_ts is None or ts < self.min_ts:
+            self.min_ts = ts
+        if self.max_ts is None or ts > self.max_ts:
+            self.max_ts = ts
+        self.last_off = off
+
+    def scan(self):
+        """Indexa los registros nuevos del archivo (desde self.size)."""
+        try:
+            file_size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if file_size <= self.size:
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for off, nxt, ts, dev, _ in _iter_records(mm, self.size, file_size):
+                self.add(off, ts, dev.decode("utf-8"))
+                self.size = nxt
+
+    def record_offsets(self, dev, since):
+        """Offsets de los registros de `dev` desde la entrada dispersa previa a since."""
+        entry = self.devices.get(dev)
+        if entry is None:
+            return ()
+        i = 0 if since is None else max(bisect.bisect_right(entry[0], since) - 1, 0)
+        return self.offsets[dev][i * self.index_every:]
+
+    def to_json(self):
+        return {
+            "size": self.size, "min_ts": self.min_ts, "max_ts": self.max_ts,
+            "last_off": self.last_off, "devices": self.devices, "counts": self.counts,
+            "offsets": {k: v.tolist() for k, v in self.offsets.items()},
+        }
+
+    @classmethod
+    def from_json(cls, path, index_every, d):
+        idx = cls(path, index_every)
+        idx.size, idx.min_ts, idx.max_ts = d["size"], d["min_ts"], d["max_ts"]
+        idx.last_off = d["last_off"]
+        idx.devices = {k: (v[0], v[1]) for k, v in d["devices"].items()}
+        idx.counts = d["counts"]
+        idx.offsets = {k: array("I", v) for k, v in d["offsets"].items()}
+        return idx
+
+
+class TimeSeriesLog:
+    """Log segmentado de telemetría normalizada (ver docstring del módulo)."""
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, max_segments=64,
+                 retention_seconds=7 * 24 * 3600, flush_every=64, fsync_interval=1.0,
+                 index_every=8):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.retention_seconds = retention_seconds
+        self.flush_every = flush_every
+        self.fsync_interval = fsync_interval
+        self.index_every = index_every
+        self._lock = threading.RLock()
+        self._segments = []  # [(_SegmentIndex), ...] del más viejo al más nuevo
+        self._file = None     # segmento activo (solo escritor)
+        self._lockfile = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # ---- apertura / recuperación ----
+    def _seg_path(self, seq):
+        return os.path.join(self.directory, "%08d.seg" % seq)
+
+    def _load(self):
+        known = {s.path for s in self._segments}
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(".seg"))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if path in known:
+                continue
+            idx = None
+            try:
+                with open(path[:-4] + ".idx", "r", encoding="utf-8") as f:
+                    idx = _SegmentIndex.from_json(path, self.index_every, json.load(f))
+            except (OSError, ValueError, KeyError):
+                idx = _SegmentIndex(path, self.index_every)
+                idx.scan()
+            self._segments.append(idx)
+
+    def refresh(self):
+        """Relee segmentos nuevos o crecidos (útil en procesos lectores)."""
+        with self._lock:
+            if self._file is not None:
+                # escritor: basta con vaciar el buffer de Python (sin fsync)
+                self._file.flush()
+                return
+            self._segments = [s for s in self._segments if os.path.exists(s.path)]
+            for s in self._segments[-1:]:
+                s.scan()
+            self._load()
+
+    def acquire_writer(self):
+        """Abre el log como escritor si ningún otro proceso lo tiene; False si no se pudo."""
+        with self._lock:
+            if self._file is None:
+                try:
+                    self._open_writer()
+                except RuntimeError:
+                    return False
+            return True
+
+    def _open_writer(self):
+        self._lockfile = open(os.path.join(self.directory, "LOCK"), "a+")
+        try:
+            fcntl.flock(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lockfile.close()
+            self._lockfile = None
+            raise RuntimeError("otro proceso ya escribe en %s" % self.directory)
+        self.refresh()
+        if self._segments:
+            seg = self._segments[-1]
+            seg.scan()
+            # recuperación: descartar cola parcial o corrupta
+            if os.path.getsize(seg.path) != seg.size:
+                with open(seg.path, "r+b") as f:
+                    f.truncate(seg.size)
+            self._file = open(seg.path, "ab")
+        else:
+            self._new_segment(1)
+
+    def _new_segment(self, seq):
+        path = self._seg_path(seq)
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._file.flush()
+        self._segments.append(_SegmentIndex(path, self.index_every))
+
+    # ---- escritura ----
+    def append(self, device_id, rec, raw=None):
+        """Agrega un registro normalizado (dict con 'timestamp') y su paquete crudo."""
+        data = _encode(device_id, rec, raw)
+        with self._lock:
+            if self._file is None:
+                self._open_writer()
+            seg = self._segments[-1]
+            if seg.size + len(data) > self.segment_bytes and seg.last_off is not None:
+                self._rotate()
+                seg = self._segments[-1]
+            self._file.write(data)
+            seg.add(seg.size, float(rec["timestamp"]), device_id)
+            seg.size += len(data)
+            self._pending += 1
+            now = time.monotonic()
+            if self._pending >= self.flush_every or now - self._last_sync >= self.fsync_interval:
+                self._sync(now)
+
+    def _sync(self, now=None):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic() if now is None else now
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        seg = self._segments[-1]
+        with open(seg.path[:-4] + ".idx", "w", encoding="utf-8") as f:
+            json.dump(seg.to_json(), f)
+        seq = int(os.path.basename(seg.path)[:-4]) + 1
+        self._new_segment(seq)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        cutoff = time.time() - self.retention_seconds if self.retention_seconds else None
+        while len(self._segments) > 1:
+            old = self._segments[0]
+            too_many = self.max_segments and len(self._segments) > self.max_segments
+            too_old = cutoff is not None and old.max_ts is not None and old.max_ts < cutoff
+            if not (too_many or too_old):
+                break
+            for p in (old.path, old.path[:-4] + ".idx"):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            self._segments.pop(0)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None and self._pending:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+            if self._lockfile is not None:
+                self._lockfile.close()
+                self._lockfile = None
+
+    # ---- lectura ----
+    def read(self, device_id, since=None, until=None, with_raw=False):
+        """
+        Registros de un dispositivo con since <= timestamp <= until como arreglo
+        estructurado RECORD_DTYPE. Con with_raw=True devuelve (arreglo, [raw]).
+        """
+        self.refresh()
+        rows, raws = [], []
+        with self._lock:
+            segs = list(self._segments)
+        for seg in segs:
+            if seg.max_ts is None or (since is not None and seg.max_ts < since):
+                continue
+            if until is not None and seg.min_ts > until:
+                continue
+            offsets = seg.record_offsets(device_id, since)
+            if not offsets:
+                continue
+            try:
+                f = open(seg.path, "rb")
+            except OSError:
+                continue
+            with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = min(seg.size, len(mm))
+                for off in offsets:
+                    if off >= end:
+                        break
+                    b0 = off + HEADER.size
+                    ts = BODY.unpack_from(mm, b0)[0]
+                    if since is not None and ts < since:
+                        continue
+                    if until is not None and ts > until:
+                        break
+                    vals, raw = _unpack(mm, b0)
+                    rows.append(vals)
+                    if with_raw:
+                        raws.append(raw)
+        out = np.array(rows, dtype=RECORD_DTYPE) if rows else np.empty(0, dtype=RECORD_DTYPE)
+        return (out, raws) if with_raw else out
+
+    @property
+    def writing(self):
+        """True si este proceso tiene abierto el log como escritor."""
+        return self._file is not None
+
+    def position(self):
+        """(ruta del segmento más nuevo, bytes válidos); cambia con cada escritura."""
+        with self._lock:
+            if not self._segments:
+                return (None, 0)
+            seg = self._segments[-1]
+            return (seg.path, seg.size)
+
+    def read_since(self, position):
+        """
+        Registros escritos después de `position` (ver position()), en orden.
+        Devuelve ([(device_id, valores, raw), ...], nueva_posición). Con
+        position=None empieza en el segmento más nuevo.
+        """
+        self.refresh()
+        with self._lock:
+            segs = list(self._segments)
+        path, size = position if position is not None else (None, 0)
+        if path is None and segs:
+            path = segs[-1].path
+        out = []
+        new_pos = position if position is not None else (path, size)
+        for seg in segs:
+            if path is not None and seg.path < path:
+                continue
+            start = size if seg.path == path else len(MAGIC)
+            start = max(start, len(MAGIC))
+            if start >= seg.size:
+                new_pos = (seg.path, start)
+                continue
+            try:
+                f = open(seg.path, "rb")
+            except OSError:
+                continue
+            with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = min(seg.size, len(mm))
+                for _, _, _, dev, b0 in _iter_records(mm, start, end, verify=False):
+                    vals, raw = _unpack(mm, b0)
+                    out.append((bytes(dev).decode("utf-8"), vals, raw))
+                new_pos = (seg.path, end)
+        return out, new_pos
+
+    def last_packet(self):
+        """Paquete crudo (raw) del último registro escrito, o None."""
+        self.refresh()
+        with self._lock:
+            segs = [s for s in self._segments if s.last_off is not None]
+        if not segs:
+            return None
+        seg = segs[-1]
+        with open(seg.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for _, _, _, _, b0 in _iter_records(mm, seg.last_off, min(seg.size, len(mm))):
+                return _unpack(mm, b0)[1]
+        return None
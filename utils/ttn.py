@@ -1,128 +1,176 @@
 # utils/ttn.py
 """
-Módulo para obtener el último paquete LoRaWAN.
+Módulo para obtener paquetes LoRaWAN.
 Implementa dos flujos:
- - MQTT: crea un cliente que suscribe a un topic y guarda el último mensaje en data/last_lora.json
- - Webhook: alternativa: un endpoint FastAPI (receiver.py) escribirá al mismo archivo.
+ - MQTT: un cliente (utils/mqtt_ingest.py) suscrito a uno o más topics que
+   agrega los mensajes al log data/tslog en lotes, desde un pool de workers
+ - Webhook: alternativa: un endpoint FastAPI (receiver.py) escribirá al mismo log.
+El cliente MQTT puede correr sin dashboard (ingestor.py); entonces los
+dashboards (LORA_BACKEND=log) solo leen el log, como con el webhook.
+
+Cada uplink se normaliza y se entrega al servicio de ingesta del proceso
+(utils/ingest.py), que lo agrega al almacén en memoria con un buffer circular
+por dispositivo (utils/store.py) y al log append-only en disco (utils/tslog.py).
 
 CONFIGURACIÓN (variables de entorno o editar aquí):
-- LORA_BACKEND = "mqtt"  # o "webhook"
-- MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS, MQTT_TOPIC
+- LORA_BACKEND = "mqtt"  # o "webhook"; "log" (o cualquier otro valor): solo
+  seguir el log que escribe otro proceso (receiver.py o ingestor.py)
+- MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS, MQTT_TOPIC, MQTT_QOS, MQTT_SHARE_GROUP,
+  MQTT_WORKERS, ... (ver utils/mqtt_ingest.py)
+- LOG_DIR (por defecto data/tslog), LOG_RETENTION_S, STORE_CAPACITY, STORE_MAX_DEVICES
+- DEDUP_ENABLED, DEDUP_WINDOW, DEDUP_REORDER_S, ... (ver utils/dedup.py)
 """
 
-import json
 import os
-import threading
 import time
 
-DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "last_lora.json")
-os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
+from datetime import datetime
 
-# simple accessor; devuelve dict o None
-def _read_last():
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return None
+from utils.codec import DEFAULT_REGISTRY
+from utils.dedup import gateway_metadata, set_gateways
+from utils.ingest import get_service
+
+def _device_id(raw, topic):
+    if isinstance(raw, dict):
+        ids = raw.get("end_device_ids")
+        if isinstance(ids, dict) and ids.get("device_id"):
+            return ids["device_id"]
+    return topic or "unknown"
+
+def _model_id(up):
+    ver = up.get("version_ids") if isinstance(up, dict) else None
+    return ver.get("model_id") if isinstance(ver, dict) else None
+
+def _device_time(raw, up):
+    """
+    received_at de TTN en epoch: lo más cercano al momento de la medición, ya
+    que el frame LoRaWAN no trae reloj (parse_uplink prefiere el timestamp
+    del payload si el dispositivo lo envía).
+    """
+    for src in (up, raw):
+        ts = src.get("received_at") if isinstance(src, dict) else None
+        if isinstance(ts, str):
+            try:
+                return datetime.fromisoformat(ts).timestamp()
+            except ValueError:
+                pass
+    return None
+
+def parse_uplink(raw, topic=None, decode=True):
+    """
+    Convierte un uplink ya parseado (dict de TTN v3 u otro JSON) en el paquete
+    enriquecido que guarda el servicio de ingesta (utils/ingest.py).
+    Si TTN no trae decoded_payload se decodifica frm_payload con los formatos
+    binarios de utils/codec.py (decode=False lo deja para un lote posterior).
+    """
+    # if TTN v3 uplink_message with decoded_payload:
+    data = None
+    model_id = None
+    device_time = None
+    up = None
+    if isinstance(raw, dict) and "uplink_message" in raw:
+        up = raw.get("uplink_message", {})
+        model_id = _model_id(up)
+        device_time = _device_time(raw, up)
+        # prefer decoded_payload if exists
+        dec = up.get("decoded_payload")
+        if dec:
+            data = dict(dec)
+        elif decode and up.get("frm_payload"):
+            data = DEFAULT_REGISTRY.decode_b64(up["frm_payload"], up.get("f_port"))
+        if data is None:
+            # frame sin formato registrado: se guarda el uplink completo
+            data = {"raw_uplink": up}
+    else:
+        data = raw
+
+    # enrich with topic, device and timestamp
+    out = {
+        "received_topic": topic,
+        "device_id": _device_id(raw, topic),
+        "payload": data,
+        "timestamp": time.time()
+    }
+    if model_id:
+        out["model_id"] = model_id
+    if isinstance(data, dict) and isinstance(data.get("timestamp"), (int, float)):
+        device_time = float(data["timestamp"])
+    if device_time is not None:
+        out["device_time"] = device_time
+    if isinstance(up, dict):
+        # contador de frame y gateways: deduplicación y orden (utils/dedup.py).
+        # El JSON de TTN omite los campos en cero: un frame sin f_cnt es el 0
+        f_cnt = up.get("f_cnt", 0 if "frm_payload" in up else None)
+        if isinstance(f_cnt, int):
+            out["f_cnt"] = f_cnt
+        gateways = gateway_metadata(up)
+        if gateways:
+            set_gateways(out, gateways)
+    return out
+
+def ingest_uplink(raw, topic=None):
+    """Procesa y guarda un uplink a través del servicio de ingesta del proceso."""
+    return get_service().ingest_uplink(raw, topic)
+
+def ingest_batch(items, topic=None):
+    """
+    Procesa una lista de uplinks; devuelve cuántos fallaron. `topic` puede
+    ser uno para todos o una lista alineada con items.
+    """
+    return get_service().ingest_batch(items, topic)
 
-def get_lorawan_data():
+def get_lorawan_data(device_id=None):
     """
     Devuelve el último paquete LoRaWAN como diccionario (o None si no hay datos).
     Este dato puede ser escrito por:
       - el cliente MQTT (si seleccionas LORA_BACKEND=mqtt)
       - el receiver FastAPI (webhook)
+    Con device_id devuelve el último paquete de ese dispositivo.
     """
-    return _read_last()
+    snap = get_service().snapshot()
+    if device_id is None:
+        return snap.last
+    return snap.devices.get(device_id)
+
+def get_latest_per_device():
+    """Dict device_id -> último registro normalizado (campos de FIELDS)."""
+    return get_service().latest_per_device()
+
+def get_device_window(device_id, seconds=None, since=None, until=None):
+    """
+    Registros del dispositivo en una ventana de tiempo, como vista NumPy
+    estructurada (sin copia). `seconds` equivale a since = ahora - seconds.
+    """
+    if seconds is not None:
+        since = time.time() - seconds
+    return get_service().store.window(device_id, since, until)
+
+def get_device_history(device_id, seconds=None, since=None, until=None):
+    """Como get_device_window pero leyendo del log en disco (historial completo)."""
+    if seconds is not None:
+        since = time.time() - seconds
+    return get_service().log.read(device_id, since, until)
 
 
 # -------------------------
 # MQTT helper (background)
 # -------------------------
-def _start_mqtt_client_if_needed():
+def _start_mqtt_client_if_needed(on_batch):
     """
-    Para desarrollo local: si configuras LORA_BACKEND=mqtt y las variables MQTT_*,
-    el cliente MQTT se levantará en background y actualizará data/last_lora.json
+    Si configuras LORA_BACKEND=mqtt y las variables MQTT_* (ver
+    utils/mqtt_ingest.py), arranca el cliente MQTT en background; sus workers
+    entregan los uplinks en lotes a on_batch(items, topics). Devuelve el
+    MqttIngestor o None.
+    Lo llama IngestionService.start(); no se arranca al importar.
     """
     cfg_backend = os.environ.get("LORA_BACKEND", "mqtt").lower()
     if cfg_backend != "mqtt":
-        return
+        return None
 
     try:
-        import paho.mqtt.client as mqtt
-    except Exception:
-        # no instalado
-        return
-
-    MQTT_HOST = os.environ.get("MQTT_HOST", "")
-    MQTT_PORT = int(os.environ.get("MQTT_PORT", "1883"))
-    MQTT_USER = os.environ.get("MQTT_USER", "")
-    MQTT_PASS = os.environ.get("MQTT_PASS", "")
-    MQTT_TOPIC = os.environ.get("MQTT_TOPIC", "#")  # suscribir por defecto a todo
-
-    if not MQTT_HOST:
-        return
-
-    client = mqtt.Client()
-
-    if MQTT_USER:
-        client.username_pw_set(MQTT_USER, MQTT_PASS or None)
-
-    def on_connect(c, userdata, flags, rc):
-        if rc == 0:
-            c.subscribe(MQTT_TOPIC)
-        else:
-            print("MQTT connect failed rc=", rc)
-
-    def on_message(c, userdata, msg):
-        try:
-            payload_s = msg.payload.decode("utf-8")
-            # TTN puede enviar JSON; guardamos raw y si tiene 'uplink_message' usamos decoded payload.
-            raw = None
-            try:
-                raw = json.loads(payload_s)
-            except Exception:
-                raw = {"raw": payload_s}
-
-            # if TTN v3 uplink_message with decoded_payload:
-            data = None
-            if isinstance(raw, dict) and "uplink_message" in raw:
-                up = raw.get("uplink_message", {})
-                # prefer decoded_payload if exists
-                dec = up.get("decoded_payload")
-                if dec:
-                    data = dict(dec)
-                else:
-                    # try raw bytes base64 (user needs to implement decoder)
-                    data = {"raw_uplink": up}
-            else:
-                data = raw
-
-            # enrich with topic and timestamp
-            out = {
-                "received_topic": msg.topic,
-                "payload": data,
-                "timestamp": time.time()
-            }
-
-            with open(DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(out, f)
-        except Exception as e:
-            print("Error processing mqtt message:", e)
-
-    client.on_connect = on_connect
-    client.on_message = on_message
-
-    def _loop():
-        try:
-            client.connect(MQTT_HOST, MQTT_PORT, 60)
-            client.loop_forever()
-        except Exception as e:
-            print("MQTT client error:", e)
-            time.sleep(5)
-
-    t = threading.Thread(target=_loop, daemon=True)
-    t.start()
-
-# start automatically if user requested mqtt backend
-_start_mqtt_client_if_needed()
\ No newline at end of file
+        from utils.mqtt_ingest import MqttIngestor
+        ingestor = MqttIngestor.from_env(on_batch)
+    except ImportError:
+        # paho-mqtt no instalado
+        return None
+    return ingestor.start() if ingestor is not None else None